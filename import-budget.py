@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# author: grey@christoforo.net
+# checks that importing our packages stays fast (python -X importtime) and that the heavy
+# dependencies we only load on first use (matplotlib, pyvisa...) don't sneak back in at import time
+# usage: ./import-budget.py [budget in ms]
+# exits with 0 when everything is in budget, 1 otherwise
+import os
+import subprocess
+import sys
+
+modules = ['k2450', 'k2450.stations', 'k2450.mapping', 'rs', 'rs.geometry', 'rs.store'] # what rs-tool.py imports before it talks to an instrument
+lazyModules = ['matplotlib', 'scipy', 'uncertainties', 'pyvisa', 'visa', 'PyQt5'] # must not be imported by the above
+defaultBudget = 400 # ms, total cumulative import time (numpy is most of it)
+nRuns = 5 # take the best of this many runs to keep the noise down
+
+# returns a dict of {module name: cumulative import time [us]} for one fresh interpreter
+def importTimes(modules):
+  here = os.path.dirname(os.path.abspath(__file__))
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=here)
+  if proc.returncode != 0:
+    print(proc.stderr)
+    raise RuntimeError('Unable to import {:}'.format(', '.join(modules)))
+  times = {}
+  # lines look like "import time:  self [us] | cumulative | imported package"
+  for line in proc.stderr.splitlines():
+    if not line.startswith('import time:'):
+      continue
+    fields = line[len('import time:'):].split('|')
+    try:
+      cumulative = int(fields[1])
+    except ValueError:
+      continue # the header line
+    name = fields[2].rstrip()
+    times[name.strip()] = (cumulative, len(name) - len(name.lstrip()) == 1) # (time, is it top level?)
+  return times
+
+def main():
+  if len(sys.argv) > 1:
+    budget = float(sys.argv[1])
+  else:
+    budget = defaultBudget
+
+  best = None
+  for run in range(nRuns):
+    times = importTimes(modules)
+    total = sum([times[name][0] for name in modules if times[name][1]])/1000 # ms, one imported by another is in its time already
+    if (best is None) or (total < best):
+      best = total
+
+  ok = True
+  for name in lazyModules:
+    if name in times:
+      print('FAIL: importing {:} also imports {:}'.format(', '.join(modules), name))
+      ok = False
+
+  print('Import time for {:}: {:.1f} ms (budget {:.1f} ms)'.format(', '.join(modules), best, budget))
+  slowest = sorted([(t, name) for (name, (t, topLevel)) in times.items() if not topLevel], reverse=True)
+  for (t, name) in slowest[:5]: # the biggest things pulled in along the way
+    print('  {:>8.1f} ms  {:}'.format(t/1000, name))
+  if best > budget:
+    print('FAIL: over budget')
+    ok = False
+
+  if ok:
+    sys.exit(0)
+  else:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -5,6 +5,11 @@ import socket # this is for testing if a TCPIP connection is pre-existing
 import types
 import struct
 import math
+import selectors # so we can wait for socket data without spinning
+import threading # for completion notifications
+import concurrent.futures
+import weakref # for per-connection instrument state
+from k2450 import timing # the sweep duration model
 
 MSB = 1<<0 # message summary bit
 EAV = 1<<2 # error available bit
@@ -22,6 +27,96 @@ SS_LIM = 1<<5 # Source function level was limited
 SS_4WS = 1<<6 # Four-wire sense was used
 SS_OON = 1<<7 # Output was on
 
+# standard event status register bits (enabled via *ESE, summarized in the ESB bit)
+ESE_OPC = 1<<0 # operation complete
+ESE_QYE = 1<<2 # query error
+ESE_DDE = 1<<3 # device dependent error
+ESE_EXE = 1<<4 # execution error
+ESE_CME = 1<<5 # command error
+
+# connections that turned out not to support serial polls (e.g. pyvisa raw sockets)
+noSerialPoll = weakref.WeakSet()
+
+# reads the status byte, via a serial poll if the transport can do one (works even while the instrument is busy)
+def readSTB(sm):
+  if hasattr(sm, 'read_stb') and (sm not in noSerialPoll):
+    try:
+      return int(sm.read_stb())
+    except Exception: # fall back to asking for it from now on
+      noSerialPoll.add(sm)
+  return int(sm.query('*STB?'))
+
+# polls the status byte until one of the requested bits is set or until timeout ms have passed
+# the time between polls backs off from minPoll to maxPoll seconds so we don't hammer the instrument
+# returns the last status byte read
+def pollSTB(sm, request, timeout=None, minPoll=0.001, maxPoll=0.1):
+  if timeout is None:
+    deadline = None
+  else:
+    deadline = time.monotonic() + timeout/1000
+  pause = minPoll
+  byte = readSTB(sm)
+  while not byte & request:
+    if deadline is None:
+      time.sleep(pause)
+    else:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      time.sleep(min(pause, remaining))
+    pause = min(pause*2, maxPoll)
+    byte = readSTB(sm)
+  return byte
+
+# waits for the operation complete event flagged by a previously sent "*OPC" (see doSweep)
+# needs setup2450's *ESE/*SRE masks so OPC shows up in the ESB bit of the status byte
+# uses SRQ when the transport supports it, otherwise polls the status byte with backoff
+# timeout is in ms (None waits forever), returns True on completion and False on timeout
+# notBefore is how many seconds from now the operation can't possibly be done (see sweepDuration), polling starts then
+def waitForComplete(sm, timeout=None, useSRQ=True, notBefore=None):
+  if timeout is None:
+    deadline = None
+  else:
+    deadline = time.monotonic() + timeout/1000
+  srq = False
+  if useSRQ and hasattr(sm, 'wait_for_srq'):
+    try:
+      sm.wait_for_srq(timeout)
+      srq = True
+    except Exception: # not every interface can deliver SRQs, we'll just poll
+      pass
+  if (not srq) and (notBefore is not None) and (notBefore > 0):
+    if deadline is not None:
+      notBefore = min(notBefore, deadline - time.monotonic())
+    time.sleep(max(notBefore, 0))
+  while True:
+    if deadline is None:
+      remaining = None
+    else:
+      remaining = max(deadline - time.monotonic(), 0)*1000
+    byte = pollSTB(sm, ESB, remaining)
+    if not byte & ESB:
+      return False # timed out
+    esr = int(sm.query('*ESR?')) # reading this clears it (and so ESB too)
+    if esr & ESE_OPC:
+      return True
+    # ESB was set by something other than OPC (e.g. a command error), keep waiting
+
+# waits for completion in a background thread and returns a concurrent.futures.Future for the result
+# callback (if given) is called with the result of waitForComplete once it's known
+# nothing else should talk to sm until the future is done
+def notifyOnComplete(sm, callback=None, timeout=None):
+  future = concurrent.futures.Future()
+  if callback is not None:
+    future.add_done_callback(lambda f: f.exception() is None and callback(f.result()))
+  def waiter():
+    try:
+      future.set_result(waitForComplete(sm, timeout))
+    except Exception as e:
+      future.set_exception(e)
+  threading.Thread(target=waiter, daemon=True).start()
+  return future
+
 def printErrors(sm):
   errorCount = int(sm.query(':SYSTem:ERRor:COUNt?'))
   while errorCount > 0:
@@ -46,64 +141,112 @@ def printErrors(sm):
     print(sm.query('SYST:ERR:NEXT?'))
     errorCount = int(sm.query(':SYSTem:ERRor:COUNt?'))
 
+# what printEventLog prints for a :SYSTEM:EVENTLOG:NEXT? reply, None once the log is empty
+def eventLogEntry(errorString):
+  errorSplit = errorString.split('"')
+  errorNum = int(errorSplit[0].split(',')[0])
+  if errorNum == 0:
+    return None # no error
+  errorSubSplit = errorSplit[1] # toss quotations
+  errorSubSplit = errorSubSplit.split(';')
+  return (errorSubSplit[2], errorSubSplit[0], "TYPE", errorSubSplit[1])
+
 def printEventLog(sm):
   errorCount = 0
   while True:
-    errorString = sm.query(':SYSTEM:EVENTLOG:NEXT?')
-    errorSplit = errorString.split('"')
-    errorNum = int(errorSplit[0].split(',')[0])
-    if errorNum == 0:
-      break # no error
-    else:
-      errorCount = errorCount + 1
-      errorSubSplit = errorSplit[1] # toss quotations
-      errorSubSplit = errorSubSplit.split(';')
-      print(errorSubSplit[2], errorSubSplit[0],"TYPE",errorSubSplit[1],)
+    entry = eventLogEntry(sm.query(':SYSTEM:EVENTLOG:NEXT?'))
+    if entry is None:
+      break
+    errorCount = errorCount + 1
+    print(*entry)
   sm.write(':SYSTEM:CLEAR') # clear the logs since we've read them now
   if errorCount == 0:
     print('No errors in log.')
 
 
 
+# a pyvisa style values_format for our own connections (socketConn and k2450.aio's asyncConn)
+def valuesFormat():
+  values_format = types.SimpleNamespace()
+  values_format.container = numpy.array
+  values_format.datatype = 'd'
+  values_format.is_big_endian = False # the 2450 sends little endian doubles unless told otherwise with :FORMat:BORDer
+  return values_format
+
+# the numpy dtype of the values a values_format describes
+def valuesDtype(values_format):
+  dtype = numpy.dtype(values_format.datatype)
+  if values_format.is_big_endian:
+    return dtype.newbyteorder('>')
+  else:
+    return dtype.newbyteorder('<')
+
+# IEEE 488.2 binary blocks (#<n><length><data> or #0<data>) for readBlock:
+# the number of length digits from the start of a block (at least its first two bytes), 0 for an indefinite length one
+# nBytes must be given for indefinite length (#0) blocks since their data may contain the terminator
+def blockDigits(head, nBytes=None):
+  if head[0:1] != b'#':
+    raise ValueError('Expected a binary block but got {:}'.format(bytes(head[:16])))
+  nDigits = int(head[1:2])
+  if (nDigits == 0) and (nBytes is None):
+    raise ValueError('The instrument sent an indefinite length block, its length must be given')
+  return nDigits
+
+# the payload length of a definite length block given its length digits, which must agree with nBytes if it's given
+def blockLength(digits, nBytes=None):
+  blockLen = int(digits)
+  if (nBytes is not None) and (nBytes != blockLen):
+    raise ValueError('Expected a {:} byte block but the instrument sent {:} bytes'.format(nBytes, blockLen))
+  return blockLen
+
+# the message terminator follows the block
+def checkBlockEnd(term, termChar):
+  if term != termChar:
+    raise ValueError('Binary block was not followed by the message terminator')
+
 class socketConn:
   def __init__(self, s=None):
     self.s = s
     self.termChar = b'\n'
     self.decode = 'utf-8'
     self.getLen = 4096
-    self.values_format = types.SimpleNamespace()
-    self.values_format.container = numpy.array
-    self.values_format.datatype = 'd'
-    self.timeout = s.timeout
-    try: # this will clear all pending data
-      rcv = None
-      while rcv == b'':
-        rcv = s.recv(self.getLen)
-    except:
-      pass
+    self.values_format = valuesFormat()
+    if s.gettimeout() is None:
+      self.timeout = None # wait forever
+    else:
+      self.timeout = s.gettimeout()*1000 # ms, same units as a pyvisa resource
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # don't let Nagle hold back small commands waiting on delayed ACKs
+    self.rxBuf = bytearray() # bytes we've received but not yet handed out (anything past a terminator lives here)
+    self.sel = selectors.DefaultSelector() # lets us sleep until the socket has data instead of spinning on recv
+    self.sel.register(s, selectors.EVENT_READ)
+    self.flush() # this will clear all pending data
   
-    
   def __del__(self):
-    self.s.shutdown(socket.SHUT_RDWR)
+    self.disconnect()
+  
+  # closes the socket (close() only turns the output off, the socket goes when we do)
+  def disconnect(self):
+    if self.s is None:
+      return
+    self.sel.close()
+    try:
+      self.s.shutdown(socket.SHUT_RDWR)
+    except OSError: # the connection is already gone
+      pass
     self.s.close()
-    del(self.s)
+    self.s = None
     
   def close(self):
     self.write('OUTPut OFF')
   
+  # a context manager that sends the commands written to it in one go, see commandBatch
+  def batch(self, checkErrors=True):
+    return commandBatch(self, checkErrors)
+  
   # serial poll routine until we get one of the requested status bits set
-  # or until a non-zero status byte or until we timeout
+  # or until we timeout
   def spoll(self, request):
-    byte = int(self.query('*STB?'))
-    start = time.time()
-    elapsed = time.time() - start
-    while (not byte & request) and elapsed < self.timeout:
-      byte = int(self.query('*STB?'))
-      print(byte)
-      if byte & (MAV | EAV): # handle events
-        printEvents(self)
-      elapsed = time.time() - start
-    return byte
+    return pollSTB(self, request, self.timeout)
   
   def write(self,string):
     toSend = bytes(string,self.decode) + self.termChar
@@ -114,27 +257,50 @@ class socketConn:
     else:
       return False
   
-  def read(self, string=True, nBytes=0):
-    buf = b''
-    
-    self.s.setblocking(False)
-    if string == True:
-      while self.termChar not in buf:
-        try:
-          buf += self.s.recv(self.getLen)
-        except BlockingIOError:
-          pass
+  # throws away anything the instrument has already sent that we haven't read yet
+  def flush(self):
+    self.rxBuf.clear()
+    while self.sel.select(0):
+      if self.s.recv(self.getLen) == b'':
+        break # peer closed the connection, nothing more will come
+  
+  # returns the absolute (monotonic clock) time at which the current read should give up
+  def _deadline(self):
+    if self.timeout is None:
+      return None
+    else:
+      return time.monotonic() + self.timeout/1000
+  
+  # sleeps until the socket is readable then appends what's there to the receive buffer
+  def _recvSome(self, deadline):
+    if deadline is None:
+      remaining = None
     else:
-      while len(buf) < nBytes:
-        try:
-          buf += self.s.recv(self.getLen)
-        except BlockingIOError:
-          pass      
-    self.s.setblocking(True)
+      remaining = max(deadline - time.monotonic(), 0)
+    if not self.sel.select(remaining):
+      raise socket.timeout('Timed out after {:} ms waiting for the instrument'.format(self.timeout))
+    chunk = self.s.recv(self.getLen)
+    if chunk == b'':
+      raise ConnectionError('The instrument closed the connection')
+    self.rxBuf += chunk
+  
+  def read(self, string=True, nBytes=0):
+    deadline = self._deadline()
     if string == True:
+      end = self.rxBuf.find(self.termChar)
+      while end < 0:
+        searchFrom = max(len(self.rxBuf) - len(self.termChar) + 1, 0) # don't rescan what we've already checked
+        self._recvSome(deadline)
+        end = self.rxBuf.find(self.termChar, searchFrom)
+      buf = bytes(self.rxBuf[:end])
+      del self.rxBuf[:end+len(self.termChar)] # keep whatever came after the terminator for next time
       ret = buf.decode(self.decode)
       return ret.rstrip()
     else:
+      while len(self.rxBuf) < nBytes:
+        self._recvSome(deadline)
+      buf = bytes(self.rxBuf[:nBytes])
+      del self.rxBuf[:nBytes]
       return buf.rstrip().lstrip(b'#0')
     
   def query(self,string):
@@ -143,89 +309,348 @@ class socketConn:
     else:
       return None
     
-  def query_values(self, string, nValues=0):
-    if nValues != 0:
-      nBytes = 2 + 16*nValues + 1;
-    buf = b''
+  # waits for the socket then receives straight into the given memoryview, returns the number of bytes received
+  def _recvInto(self, view, deadline):
+    if deadline is None:
+      remaining = None
+    else:
+      remaining = max(deadline - time.monotonic(), 0)
+    if not self.sel.select(remaining):
+      raise socket.timeout('Timed out after {:} ms waiting for the instrument'.format(self.timeout))
+    got = self.s.recv_into(view)
+    if got == 0:
+      raise ConnectionError('The instrument closed the connection')
+    return got
+  
+  # reads exactly nBytes from the instrument into a new preallocated bytearray
+  def _readExactly(self, nBytes, deadline):
+    buf = bytearray(nBytes)
+    view = memoryview(buf)
+    have = min(len(self.rxBuf), nBytes) # first use up anything we've already buffered
+    view[:have] = self.rxBuf[:have]
+    del self.rxBuf[:have]
+    while have < nBytes:
+      have += self._recvInto(view[have:], deadline)
+    view.release()
+    return buf
+  
+  # reads one IEEE 488.2 binary block and returns its payload (see blockDigits)
+  def readBlock(self, nBytes=None):
+    deadline = self._deadline()
+    while len(self.rxBuf) < 2:
+      self._recvSome(deadline)
+    nDigits = blockDigits(self.rxBuf, nBytes)
+    if nDigits == 0: # indefinite length block
+      del self.rxBuf[:2]
+    else: # definite length block
+      while len(self.rxBuf) < 2 + nDigits:
+        self._recvSome(deadline)
+      nBytes = blockLength(self.rxBuf[2:2+nDigits], nBytes)
+      del self.rxBuf[:2+nDigits]
+    payload = self._readExactly(nBytes, deadline)
+    checkBlockEnd(self._readExactly(len(self.termChar), deadline), self.termChar)
+    return payload
+  
+  # nValues is the total number of values expected (two per reading when asking for SOUR, READ)
+  def query_values(self, string, nValues=None):
     if self.write(string):
-      result = self.read(string=False, nBytes=nBytes)
-      unpacker = struct.iter_unpack('d',result)
-      return numpy.array(list(unpacker))
+      dtype = valuesDtype(self.values_format)
+      if nValues is None:
+        nBytes = None
+      else:
+        nBytes = nValues*dtype.itemsize
+      payload = self.readBlock(nBytes)
+      return numpy.frombuffer(payload, dtype=dtype) # a view on the payload, no copying
     else:
       return None    
     
     
 
-# connects to a instrument/device given a resource manager and some open parameters
-def visaConnect (rm, openParams):
-  print("Connecting to", openParams['resource_name'], "...")
-  if 'TCPIP::' in openParams['resource_name']:
-    ip = openParams['resource_name'].split('::')[1]
-    try: # let's try to open a connection to the instrument on port 5025 (SOCKET), 1024(VXI-11) then 111...
-      s = socket.create_connection((ip,5030),timeout=openParams['timeout']/1000) # dead socket kills all previous connections
-      s.shutdown(socket.SHUT_RDWR)
-      s.close()
-      del(s)      
-      s = socket.create_connection((ip,1024),timeout=openParams['timeout']/1000)
-      s.shutdown(socket.SHUT_RDWR)
-      s.close()
-      del(s)
-      s = socket.create_connection((ip,111))
-      s.shutdown(socket.SHUT_RDWR)
-      s.close()
-      del(s)
-      s = socket.create_connection((ip,5025))
-      s.shutdown(socket.SHUT_RDWR)
-      s.close()
-      del(s)      
-    except:
-      print("Error: Unable to open a socket to", ip)
-      exctype, value = sys.exc_info()[:2]
-      print(value)
-      return None   
-  if 'SOCKET' in openParams['resource_name']:
-    s = socket.create_connection((ip,5025),timeout=openParams['timeout']/1000) # open a socket
-    d = socketConn(s)
+# our idea of the instrument's current settings, one shadow dict per connection
+# maps normalized SCPI headers (see scpiKey) to the last value written with commandBatch.set
+instrumentStates = weakref.WeakKeyDictionary()
+
+def instrumentState(sm):
+  if sm not in instrumentStates:
+    instrumentStates[sm] = {}
+  return instrumentStates[sm]
+
+# call this whenever the instrument's settings may have changed behind our back (*RST, errors...)
+def forgetState(sm):
+  instrumentState(sm).clear()
+
+# the settings we've asked for on each connection since its last *RST, as the commands that asked for them
+# in the order they were made, unlike instrumentState this isn't forgotten when in doubt
+# since it's what k2450.pool sends again to put a reconnected instrument back the way it was
+requestedSettings = weakref.WeakKeyDictionary()
+
+def settingsRequested(sm):
+  if sm not in requestedSettings:
+    requestedSettings[sm] = {}
+  return requestedSettings[sm]
+
+# normalizes a SCPI header so different spellings of the same setting share a key
+# e.g. ':SENSE1:VOLTage:RSENSE' and 'SENSe:VOLT:RSEN' both become 'SENS:VOLT:RSEN'
+def scpiKey(header):
+  nodes = []
+  for node in header.strip().strip(':').upper().split(':'):
+    node = node.rstrip('0123456789') # SENSE1 is SENSE
+    if len(node) > 4: # long form to short form
+      node = node[:4]
+      if node[3] in 'AEIOU':
+        node = node[:3]
+    nodes.append(node)
+  return ':'.join(nodes)
+
+# collects SCPI commands and sends them to sm joined with ';' as a single message
+# so a whole configuration sequence costs one write (or one VXI-11 RPC) instead of one per command
+# queries go out together with whatever is queued, on exit any leftovers are sent and
+# (if checkErrors) the error queue is checked once, the count ending up in errorCount
+# works with socketConn and pyvisa resources alike:
+#   with commandBatch(sm) as b:
+#     b.write(...)
+class commandBatch:
+  maxLen = 1024 # longest message (in characters) we'll let build up before sending it
+  
+  def __init__(self, sm, checkErrors=True):
+    self.sm = sm
+    self.checkErrors = checkErrors
+    self.queue = []
+    self.queueLen = 0
+    self.errorCount = 0
+    self.state = instrumentState(sm)
+    self.requested = settingsRequested(sm)
+    self.changed = False # becomes True when set() actually has to send something
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      if self.checkErrors:
+        self.errorCount = int(self.query(':SYSTem:ERRor:COUNt?'))
+        if self.errorCount > 0:
+          self.state.clear() # we can't know which of our settings took
+          printErrors(self.sm)
+      else:
+        self.flush()
+    else:
+      self.state.clear()
+    return False
+  
+  # anything we don't handle ourselves (values_format etc.) comes from the real connection
+  def __getattr__(self, name):
+    return getattr(self.sm, name)
+  
+  @property
+  def timeout(self):
+    return self.sm.timeout
+  
+  @timeout.setter
+  def timeout(self, value):
+    self.sm.timeout = value
+  
+  # joins commands into one message, each one made absolute so it doesn't inherit the previous one's path
+  def _take(self, string=None):
+    cmds = self.queue
+    if string is not None:
+      cmds = cmds + [string]
+    self.queue = []
+    self.queueLen = 0
+    return ';'.join([c if c.startswith((':','*')) else ':'+c for c in cmds])
+  
+  def write(self, string):
+    if string.strip().upper().startswith('*RST'):
+      self.state.clear()
+      self.requested.clear()
+    header = string.strip().partition(' ')[0]
+    if scpiKey(header) in ('OUTP', 'OUTP:STAT'): # output on/off is worth restoring too (see k2450.pool)
+      self.requested.pop('OUTP', None)
+      self.requested['OUTP'] = string
+    if self.queueLen + len(string) + 2 > self.maxLen:
+      self._overflow()
+    self.queue.append(string)
+    self.queueLen = self.queueLen + len(string) + 2
+    return True
+  
+  # makes room when the next command won't fit in the message being built up, by sending what's queued
+  def _overflow(self):
+    self.flush()
+  
+  # like write() but for a "HEADER value" setting, which is only sent if the instrument
+  # isn't already known to have that value (key overrides the header as the cache key)
+  # returns True if the setting had to be sent
+  def set(self, string, key=None):
+    header, sep, value = string.strip().partition(' ')
+    value = value.strip()
+    if key is None:
+      key = scpiKey(header)
+    if self.state.get(key) == value:
+      return False
+    # a new FUNCtion may change anything else in its subsystem, so forget what we knew about that,
+    # turning an AUTO on leaves the value it had unknown (autoranging moves it) while turning it off freezes it,
+    # and setting a new range or delay turns its AUTO off
+    if key.endswith(':FUNC'):
+      prefix = key.rsplit(':', 1)[0] + ':'
+      for settings in (self.state, self.requested):
+        for k in [k for k in settings if k.startswith(prefix)]:
+          del settings[k]
+    elif key.endswith(':AUTO'):
+      if value.upper() not in ('OFF', '0'):
+        for settings in (self.state, self.requested):
+          settings.pop(key.rsplit(':', 1)[0], None)
+    else:
+      if (key + ':AUTO') in self.state:
+        self.state[key + ':AUTO'] = 'OFF'
+      self.requested.pop(key + ':AUTO', None) # sending the value again does that
+    self.state[key] = value
+    self.requested.pop(key, None) # so it goes to the end, after anything it depends on
+    self.requested[key] = string
+    self.changed = True
+    return self.write(string)
+  
+  # sends whatever is queued up
+  def flush(self):
+    if len(self.queue) > 0:
+      return self.sm.write(self._take())
+    else:
+      return True
+  
+  def query(self, string):
+    return self.sm.query(self._take(string))
+  
+  def query_values(self, string, nValues=None):
+    return queryValues(self.sm, self._take(string), nValues)
+
+# asks for binary (:FORMAT:DATA REAL) values over any kind of connection, returns a numpy array
+# nValues is the total number of values expected, needed for the 2450's #0 (indefinite length) blocks
+def queryValues(sm, string, nValues=None):
+  if isinstance(sm, (socketConn, commandBatch)):
+    return sm.query_values(string, nValues=nValues)
+  elif hasattr(sm, 'query_binary_values'): # newer pyvisa
+    if nValues is None:
+      nValues = 0
+    return sm.query_binary_values(string, datatype='d', is_big_endian=False, container=numpy.array, data_points=nValues)
+  else: # older pyvisa, set up by setup2450's values_format
+    return sm.query_values(string)
+
+# returns a (shared) pyvisa resource manager, pyvisa is only imported the first time this is called
+# so raw socket connections never pay for it
+resourceManagers = {}
+resourceManagersLock = threading.Lock() # several stations might connect at once (see k2450.stations)
+def resourceManager(backend='@py'): # pyvisa-py (pure python) backend by default
+  with resourceManagersLock:
+    if backend not in resourceManagers:
+      try:
+        import pyvisa as visa # https://github.com/hgrecco/pyvisa
+      except ImportError:
+        import visa # older pyvisa releases
+      resourceManagers[backend] = visa.ResourceManager(backend)
+    return resourceManagers[backend]
+
+# the ports we poke when a TCPIP connection fails, to find out why and to clear things up:
+# 5030 is the 2450's dead socket termination port (connecting there kills stale connections to the instrument),
+# 111 and 1024 are VXI-11's portmapper and core channel (so we can tell if the instrument's there at all)
+deadSocketPort = 5030
+probedPorts = [deadSocketPort, 111, 1024]
+
+# what we learned about each address (its instrumentInfo) the last time we connected to it
+knownAddresses = {}
+
+# returns (host, port) from a TCPIP[board]::host[::port]::SOCKET resource name (the 2450 listens on 5025)
+def socketAddress(resourceName):
+  fields = resourceName.split('::')
+  host = fields[1]
+  if (len(fields) > 3) and fields[2].isdigit():
+    port = int(fields[2])
   else:
+    port = 5025
+  return (host, port)
+
+# tries to connect to all the ports at once, waiting at most timeout ms for each
+# returns {port: True if something accepted the connection}
+def probePorts(host, ports, timeout):
+  def probe(port):
     try:
-      d = rm.open_resource(**openParams) # connect to device
-    except:
-      print("Unable to connect via", openParams['resource_name'])
-      exctype, value = sys.exc_info()[:2]
-      print(value)
-      return None
-  print("Connection established.")
-  
-  print("Resetting Device...")
-  try:
-    res = d.query("*RST; *CLS; *ESE 32; *OPC?")
-    if res is not '1':
-      raise
-    print("Done.")
-  except:
-    print("Unable perform device reset")
-    exctype, value = sys.exc_info()[:2]
-    print(value)
+      s = socket.create_connection((host, port), timeout=timeout/1000)
+    except OSError:
+      return False
     try:
-      d.close()
-    except:
+      s.shutdown(socket.SHUT_RDWR)
+    except OSError:
       pass
+    s.close()
+    return True
+  with concurrent.futures.ThreadPoolExecutor(len(ports)) as pool:
+    return dict(zip(ports, pool.map(probe, ports)))
+
+# opens the connection itself, raises on failure
+def openConnection(rm, openParams):
+  if 'SOCKET' in openParams['resource_name']:
+    s = socket.create_connection(socketAddress(openParams['resource_name']), timeout=openParams['timeout']/1000) # open a socket
+    return socketConn(s)
+  else:
+    return rm.open_resource(**openParams) # connect to device
+
+# visaConnect's (and k2450.aio's) reports and decisions when connecting fails
+def connectionFailed(address, e):
+  print("Unable to connect via", address)
+  print(e)
+
+# the host whose ports are worth poking (see probePorts) after a failed connection, None if there isn't one
+def hostToProbe(address):
+  if 'TCPIP' not in address:
     return None
-  
-  #byte = int(d.query('*STB?'))
-  #pollret = d.spoll(OSB)
-  
-  print("Querying device type...")
+  return address.split('::')[1]
+
+# says what poking host's ports found, returns True if connecting again is worth a try
+def worthRetrying(host, probes):
+  print("Ports answering on {:}: {:}".format(host, ', '.join([str(p) for p in probedPorts if probes[p]]) or 'none'))
+  if not probes[deadSocketPort]: # it's not there (or not a 2450), no point trying again
+    print("Error: Unable to open a socket to", host)
+    return False
+  return True # the dead socket port has dropped any stale connections
+
+# the new connection d to address couldn't identify the instrument, d is forgotten (the caller closes it)
+def identifyFailed(d, e):
+  print('Unable perform "*IDN?" query.')
+  print(e)
+  instrumentInfos.pop(d, None)
+
+# connects to a instrument/device given a resource manager and some open parameters
+# connects straight away and only if that fails pokes (with a timeout, all at once) the ports that tell us
+# why, which also clears out stale connections via the dead socket port, before trying once more
+# the identification is asked for once per address (a quick status byte read checks later connections)
+# this does not reset the instrument, setup2450 does that
+def visaConnect (rm, openParams):
+  address = openParams['resource_name']
+  print("Connecting to", address, "...")
+  try:
+    d = openConnection(rm, openParams)
+  except Exception as e:
+    connectionFailed(address, e)
+    host = hostToProbe(address)
+    if (host is None) or (not worthRetrying(host, probePorts(host, probedPorts, openParams['timeout']))):
+      return None
+    try: # once more
+      d = openConnection(rm, openParams)
+    except Exception as e:
+      connectionFailed(address, e)
+      return None
+  print("Connection established.")
+
   try:
-    # ask the device to identify its self
-    idnString = d.query("*IDN?")
-  except:
-    print('Unable perform "*IDN?" query.')
-    exctype, value = sys.exc_info()[:2]
-    print(value)
+    if address in knownAddresses:
+      readSTB(d) # the instrument's answering
+      instrumentInfos[d] = dict(knownAddresses[address])
+    else:
+      print("Querying device type...")
+      knownAddresses[address] = dict(instrumentInfo(d)) # ask the device to identify its self
+  except Exception as e:
+    identifyFailed(d, e)
     try:
       d.close()
-    except:
+    except Exception:
       pass
     return None
   
@@ -234,93 +659,163 @@ def visaConnect (rm, openParams):
   # this software has been tested with a Keithley 2450 sourcemeter with firmware version 1.5.0g
   # your milage may vary if you try to use anything else
   
-  print("Device identified as",idnString)
+  print("Device identified as",instrumentInfos[d]['idn'])
   
   return d
 
 # basic setup tasks for a keithley 2450
 def setup2450(sm):
-  sm.write("*RST")
-  sm.write(":TRACE:CLEAR") # clear the defualt buffer ("defbuffer1")
-  sm.write("*CLS") # clear status & system logs and associated registers
-  sm.write("*SRE {:}".format((1<<2) + (1<<4))) # enable error reporting via status bit (by setting EAV bit)
-  sm.write("*LANG SCPI")
+  with commandBatch(sm) as b:
+    queueSetup2450(b)
+  if hasattr(sm, 'values_format'): # socketConn and older pyvisa (see queryValues)
+    sm.values_format.container = numpy.array
+    sm.values_format.datatype = 'd'
+  return b.errorCount == 0 # setup completed properly
+
+# queues up setup2450's commands on a commandBatch (k2450.aio's setup2450 sends the same ones)
+def queueSetup2450(b):
+  b.write("*RST")
+  b.write(":TRACE:CLEAR") # clear the defualt buffer ("defbuffer1")
+  b.write("*CLS") # clear status & system logs and associated registers
+  b.write("*ESE {:}".format(ESE_OPC | ESE_CME)) # operation complete and command errors summarize into the ESB bit
+  b.write("*SRE {:}".format(EAV | MAV | ESB)) # enable error reporting via status bit (by setting EAV bit) and completion via ESB
+  b.write("*LANG SCPI")
   
   # setup for binary (superfast) data transfer
-  sm.write(":FORMAT:DATA REAL")
-  sm.values_format.container = numpy.array
-  sm.values_format.datatype = 'd'
-  return True # setup completed properly
+  b.write(":FORMAT:DATA REAL")
+
+# the sweep duration model, calibrated by every sweep fetchSweepData sees finish
+# in memory only unless told where to keep its timings: sweepTiming.load(timing.defaultPath)
+sweepTiming = timing.sweepTimer()
+
+# things about the instrument that don't change while we're connected, asked for once per connection
+instrumentInfos = weakref.WeakKeyDictionary()
+
+infoQuery = '*IDN?;:SYSTem:LFRequency?' # what instrumentInfo asks
+
+# instrumentInfo's dict from the reply to infoQuery, returns (info, ok), ok being False when the line frequency
+# didn't come back (the default is used, the error queue says why)
+def parseInstrumentInfo(reply):
+  idn, sep, lineFrequency = reply.rpartition(';')
+  if sep == '':
+    idn = reply
+  try:
+    lineFrequency = float(lineFrequency)
+    ok = True
+  except ValueError:
+    lineFrequency = timing.defaultLineFrequency
+    ok = False
+  return ({'idn': idn.strip(), 'lineFrequency': lineFrequency}, ok)
+
+# returns {'idn': *IDN? string, 'lineFrequency': power line frequency [Hz]}
+def instrumentInfo(sm):
+  if isinstance(sm, commandBatch):
+    sm.flush()
+    sm = sm.sm
+  if sm not in instrumentInfos:
+    info, ok = parseInstrumentInfo(sm.query(infoQuery))
+    if not ok:
+      printErrors(sm)
+    instrumentInfos[sm] = info
+  return instrumentInfos[sm]
+
+# when the current sweep on a connection was triggered (time.monotonic(), see doSweep)
+sweepStarts = weakref.WeakKeyDictionary()
+
+# the timing model's settings for a sweep with these sweepParams (or rsOpt) on this instrument
+def sweepTimingConfig(sm, sweepParams, nReadings=None):
+  return timing.sweepConfig(sweepParams, instrumentInfo(sm)['lineFrequency'], nReadings)
+
+# how long a sweep with these parameters should take on this instrument
+# returns (expected duration, its standard deviation) in seconds
+def sweepDuration(sm, sweepParams, nReadings=None):
+  return sweepTiming.predict(instrumentInfo(sm)['idn'], sweepTimingConfig(sm, sweepParams, nReadings))
+
+# how long to wait for a sweep with these parameters before giving up [ms]
+def sweepTimeout(sm, sweepParams, nReadings=None):
+  return sweepTiming.timeout(instrumentInfo(sm)['idn'], sweepTimingConfig(sm, sweepParams, nReadings))
 
-# returns number of milliseconds to use for the sweep timeout value
+# the timeout [ms] for a dual sweep when we don't know the instrument, see sweepTimeout
 def estimateSweepTimeout(nPoints,stepDelay,nplc):
-  # let's estimate how long the sweep will take so we know when to time out
-  # here we assume one measurement takes no longer than 100ms
-  # and the initial setup time is 500ms
-  # this will break if NPLC and averaging are not their default values
-  # TODO: take into account averaging, autozero to make a better estimate
-  powerlineAssumption = 50 # Hz
-  cycleTime = 1/powerlineAssumption # seconds
-  fudgeFactor = 10 # don't know why I need this
-  measurementTime = nplc * cycleTime * fudgeFactor # seconds
-  if stepDelay is -1:
-    localStepDelay = 0
-  else:
-    localStepDelay = stepDelay
-  estimate = 500 + round(nPoints*(localStepDelay*1000+measurementTime*1000))
+  estimate = sweepTiming.timeout(None, timing.sweepConfig({'nPoints': nPoints, 'stepDelay': stepDelay, 'nplc': nplc}))
   print ('Sweep Estimate [ms]: {:}'.format(estimate))
   return estimate
 
+# rSweepStatus results, the preliminary measurement checks that can fail
+RS_OK = 0 # all good, the sweep is configured
+RS_VLIMIT = 1 # source voltage limit was hit
+RS_LOW_VOLTAGE = 2 # measured voltage too small to be useful
+RS_UNSTEADY = 3 # source current was unsteady
+RS_TIMEOUT = 4 # the measurement didn't finish in time (it was aborted)
+
 # sweep through some source current values and measure v to find R
+# returns True when the sweep is configured and ready for doSweep
 def rSweep(sm, rsOpt):
-  sm.write('SENSE:NPLC {:}'.format(rsOpt['nplc']))
-  sm.write('SENSe:FUNCtion "VOLT"')
-  sm.write('SENSe:VOLTage:RANGe:AUTO ON')
-  sm.write('SENSe:VOLTage:UNIT OHM')
-  
-  if not rsOpt['autoZero']:
-    sm.write(':SENSe:AZERO:ONCE') # do one autozero now
-    sm.write(':SENSe:VOLTage:AZERO OFF')
-  else:
-    sm.write(':SENSe:VOLTage:AZERO ON') # do autozero on every measurement
+  return rSweepStatus(sm, rsOpt) == RS_OK
+
+# same as rSweep but returns one of the RS_* codes so callers can tell why it failed
+def rSweepStatus(sm, rsOpt):
+  with commandBatch(sm) as b:
+    b.set('SENSe:FUNCtion "VOLT"') # first, a new function forgets the other SENSe settings (see commandBatch.set)
+    b.set('SENSE:NPLC {:}'.format(rsOpt['nplc']))
   
-  if rsOpt['oCom']:
-    sm.write('SENSe:VOLTage:OCOM ON')
-  else:
-    sm.write('SENSe:VOLTage:OCOM OFF')
+    if rsOpt['oCom']:
+      b.set('SENSe:VOLTage:OCOM ON')
+    else:
+      b.set('SENSe:VOLTage:OCOM OFF')
   
-  if rsOpt['fourWire']:
-    sm.write(':SENSE1:VOLTage:RSENSE ON')# rsense (remote voltage sense) ON means four wire mode
-  else:
-    sm.write(':SENSE:VOLTage:RSENSE OFF')# rsense (remote voltage sense) ON means four wire mode
+    if rsOpt['fourWire']:
+      b.set(':SENSE1:VOLTage:RSENSE ON')# rsense (remote voltage sense) ON means four wire mode
+    else:
+      b.set(':SENSE:VOLTage:RSENSE OFF')# rsense (remote voltage sense) ON means four wire mode
     
-  sm.write('SOURce:FUNCtion CURR')
-  if rsOpt['stepDelay'] != '-1':
-    sm.write('SOURce:CURRent:DELAY:AUTO OFF')
-    sm.write('SOURce:CURRent:DELAY {:}'.format(float(rsOpt['stepDelay'])))
-  else:
-    sm.write('SOURce:CURRent:DELAY:AUTO ON')
-  sm.write('SOURce:CURRent {:}'.format(rsOpt['iMax']))
-  sm.write('SOURce:CURRent:VLIM {:}'.format(rsOpt['vLim']))
-  preCount = 10
-  sm.write('SENSe:COUNt {:}'.format(preCount))
-  sm.write('OUTPut ON')
-  sm.write('TRACe:TRIGger "defbuffer1"')
+    b.set('SOURce:FUNCtion CURR')
+    if rsOpt['stepDelay'] != '-1':
+      b.set('SOURce:CURRent:DELAY:AUTO OFF')
+      b.set('SOURce:CURRent:DELAY {:}'.format(float(rsOpt['stepDelay'])))
+    else:
+      b.set('SOURce:CURRent:DELAY:AUTO ON')
+    b.write('SOURce:CURRent {:}'.format(rsOpt['iMax'])) # the sweep moves the level so always send it
+    b.set('SOURce:CURRent:VLIM {:}'.format(rsOpt['vLim']))
+    preCount = 10
+    b.set('SENSe:COUNt {:}'.format(preCount))
+    
+    if not rsOpt['autoZero']:
+      if b.changed: # no need to zero again if nothing changed since the last time
+        b.write(':SENSe:AZERO:ONCE') # do one autozero now
+      b.set(':SENSe:VOLTage:AZERO OFF')
+    else:
+      b.set(':SENSe:VOLTage:AZERO ON') # do autozero on every measurement
+    # the sweep below fixes the range and the unit, these undo that for every preliminary measurement
+    # so they come after the autozero decision, they aren't a reason to zero again
+    b.set('SENSe:VOLTage:RANGe:AUTO ON')
+    b.set('SENSe:VOLTage:UNIT OHM')
+  expected, sigma = sweepDuration(sm, rsOpt, nReadings=preCount)
+  timeout = sweepTimeout(sm, rsOpt, nReadings=preCount)
+  with commandBatch(sm, checkErrors=False) as b: # no error check here, it would wait on the measurement
+    b.write('OUTPut ON')
+    b.write('TRACe:TRIGger "defbuffer1"')
+    b.write('*OPC') # flag operation complete when the measurement is done
+  if not waitForComplete(sm, timeout, notBefore=expected - 2*sigma):
+    print('ERROR: The preliminary measurement took longer than the expected {:.2f}+/-{:.2f} s'.format(expected, sigma))
+    abortSweep(sm) # the buffer's only partly filled, and so its *OPC can't turn up later
+    return RS_TIMEOUT
   
-  status = int(sm.query('*STB?')) # this will return when the measurement is done
+  status = readSTB(sm)
   if status != 0:
     events = getEvents(sm,pr=True)
-  values = sm.query_values('TRACe:DATA? 1, {:}, "defbuffer1", SOUR, READ'.format(preCount), nValues=preCount)
-  sm.write(":FORMAT:DATA ASCII")
-  statiiA = sm.query('TRACe:DATA? 1, {:}, "defbuffer1", SOURSTAT'.format(preCount))
-  statiiA = list(map(int,statiiA.split(',')))
-  #print(statiiA)
-  statii = sm.query('TRACe:DATA? 1, {:}, "defbuffer1", STAT'.format(preCount))
-  statii = list(map(int,statii.split(',')))
-  #print(statii)
-  sm.write(":FORMAT:DATA REAL")
-  
-  sm.write(":TRACE:CLEAR")
+  values = queryValues(sm, 'TRACe:DATA? 1, {:}, "defbuffer1", SOUR, READ'.format(preCount), nValues=preCount*2)
+  with commandBatch(sm, checkErrors=False) as b:
+    b.write(":FORMAT:DATA ASCII")
+    statiiA = b.query('TRACe:DATA? 1, {:}, "defbuffer1", SOURSTAT'.format(preCount))
+    statiiA = list(map(int,statiiA.split(',')))
+    #print(statiiA)
+    statii = b.query('TRACe:DATA? 1, {:}, "defbuffer1", STAT'.format(preCount))
+    statii = list(map(int,statii.split(',')))
+    #print(statii)
+    b.write(":FORMAT:DATA REAL")
+    
+    b.write(":TRACE:CLEAR")
   values = values.reshape([preCount,2])
   s = values[:,0]
   r = values[:,1]
@@ -329,34 +824,35 @@ def rSweep(sm, rsOpt):
   if any(map (lambda x: SS_LIM & x,statiiA)):
     print('ERROR: Source voltage limit hit on one or more of our measurements.')
     print('Pro Tip: Reduce the max source current or increase the voltage limit.')
-    return False
+    return RS_VLIMIT
   elif vMin < 0.01:
     print('ERROR: A voltage measured was only {:}V'.format(vMin))
     print('Pro Tip: Consider increasing the max source current.')
-    return False
+    return RS_LOW_VOLTAGE
   elif 0.1*s[1::].mean() < s[1::].std():
     print('ERROR: The source current was very unsteady across several measurements.')
     print('Pro Tip: Reduce the max source current.')
-    return False
+    return RS_UNSTEADY
   else:
     newImax = s.mean()
     print('Preliminary values:')
     R = r.mean() # resistance
-    rS = R*math.pi/math.log(2) # sheet resistance
+    rS = R*rsOpt.get('geometryFactor', math.pi/math.log(2)) # sheet resistance (see rs.geometry for the factor)
     print ("R=", R,'+/-',R.std(),u" [\u03A9]")
     print ("R_s=",rS,u" [\u03A9/\u25AB]")
     
     print('Starting resistance sweep from {:} to {:} A'.format(newImax,-newImax))
-    senseRange = float(sm.query('SENSe:VOLTage:RANGe?'))
-    sm.write('SENSe:VOLTage:RANGe {:}'.format(senseRange))
-    sm.write(':SYSTem:CLEar')
-    #getEvents(sm,pr=False)
-    sourceRange = float(sm.query('SOURCE:CURR:RANGe?'))
-    sm.write('SOURCE:CURR:RANGe {:}'.format(sourceRange))
-    sm.write('SENSe:VOLTage:UNIT VOLT')
-    
-    # setup the sweep
-    sm.write(':SOURCE:SWEEP:CURR:LINEAR {:}, {:}, {:}, {:}, 1, fixed, {:}, ON, "defbuffer1"'.format(newImax,-newImax,rsOpt['nPoints'],rsOpt['stepDelay'],rsOpt['failAbort']))
+    with commandBatch(sm) as b:
+      senseRange = float(b.query('SENSe:VOLTage:RANGe?'))
+      b.set('SENSe:VOLTage:RANGe {:}'.format(senseRange))
+      b.write(':SYSTem:CLEar')
+      #getEvents(sm,pr=False)
+      sourceRange = float(b.query('SOURCE:CURR:RANGe?'))
+      b.set('SOURCE:CURR:RANGe {:}'.format(sourceRange))
+      b.set('SENSe:VOLTage:UNIT VOLT')
+      
+      # setup the sweep (this replaces any previous trigger model)
+      b.set(':SOURCE:SWEEP:CURR:LINEAR {:}, {:}, {:}, {:}, 1, fixed, {:}, ON, "defbuffer1"'.format(newImax,-newImax,rsOpt['nPoints'],rsOpt['stepDelay'],rsOpt['failAbort']), key='SOUR:SWE')
       
 #      sm.write('INIT')#do the sweep
 #      sm.write('*WAI') # no other commands during this
@@ -368,7 +864,7 @@ def rSweep(sm, rsOpt):
 #        
 #  sm.write('OUTPut OFF')
   
-  return True
+  return RS_OK
   
   
 
@@ -376,77 +872,91 @@ def rSweep(sm, rsOpt):
 def measureR(sm, rOpt):
   #sm.write('*RST')
   
-  sm.write('SENSE:NPLC {:}'.format(rOpt['nplc']))
-  sm.write('SENSe:FUNCtion "RES"')
-  sm.write('SENSe:RESistance:RANGe:AUTO ON')
-  sm.write('SENSe:RESistance:OCOMpensated ON')
-  sm.write('SENSe:COUNt {:}'.format(rOpt['n']))
-  
-  if rOpt['fourWire']:
-    sm.write(':SENSE1:RESistance:RSENSE ON')# rsense (remote voltage sense) ON means four wire mode
-  else:
-    sm.write(':SENSE:RESistance:RSENSE OFF')# rsense (remote voltage sense) ON means four wire mode
-  
-  sm.write('OUTPut ON')
+  with commandBatch(sm) as b:
+    b.set('SENSE:NPLC {:}'.format(rOpt['nplc']))
+    b.set('SENSe:FUNCtion "RES"')
+    b.set('SENSe:RESistance:RANGe:AUTO ON')
+    b.set('SENSe:RESistance:OCOMpensated ON')
+    b.set('SENSe:COUNt {:}'.format(rOpt['n']))
+    
+    if rOpt['fourWire']:
+      b.set(':SENSE1:RESistance:RSENSE ON')# rsense (remote voltage sense) ON means four wire mode
+    else:
+      b.set(':SENSE:RESistance:RSENSE OFF')# rsense (remote voltage sense) ON means four wire mode
+    
+    b.write('OUTPut ON')
   time.sleep(1)
   sm.write('TRACe:TRIGger "defbuffer1"')
   sm.timeout = 500
   #pollRet = sm.spoll(ESB)
-  values = sm.query_values('TRACe:DATA? 1, {:}, "defbuffer1", SOUR, READ'.format(rOpt['n']), nValues=rOpt['n'])
-  autoSenseCurrent = float(sm.query("source:current:level?"))
-  sm.write('source:current:level {:}'.format(autoSenseCurrent*-1))
-  sm.write('OUTPut OFF')
+  values = queryValues(sm, 'TRACe:DATA? 1, {:}, "defbuffer1", SOUR, READ'.format(rOpt['n']), nValues=rOpt['n']*2)
+  with commandBatch(sm, checkErrors=False) as b:
+    autoSenseCurrent = float(b.query("source:current:level?"))
+    b.write('source:current:level {:}'.format(autoSenseCurrent*-1))
+    b.write('OUTPut OFF')
   values = values.reshape([rOpt['n'],2])
   r = values[:,1]
   return r
   
 # setup 2450 for sweep returns True on success
 def configureSweep(sm,sweepParams):
-  sm.write(':SOURCE1:FUNCTION {:}'.format(sweepParams['sourceFun']))
-  sm.write(':SOURCE1:{:}:RANGE {:}'.format(sweepParams['sourceFun'],max(map(abs,[sweepParams['sweepStart'],sweepParams['sweepEnd']]))))
-  sm.write(':SOURCE1:{:}:ILIMIT {:}'.format(sweepParams['sourceFun'],sweepParams['maxCurrent']))
-  sm.write(':SENSE1:FUNCTION "{:}"'.format(sweepParams['senseFun']))
-  sm.write(':SENSE1:{:}:RANGE {:}'.format(sweepParams['senseFun'],sweepParams['maxCurrent']))
-  if sweepParams['fourWire']:
-    sm.write(':SENSE1:{:}:RSENSE ON'.format(sweepParams['senseFun']))# rsense (remote voltage sense) ON means four wire mode
-  else:
-    sm.write(':SENSE1:{:}:RSENSE OFF'.format(sweepParams['senseFun']))# rsense (remote voltage sense) ON means four wire mode
-  sm.write(':ROUTE:TERMINALS FRONT')
-  sm.write(':SOURCE1:{:}:LEVEL:IMMEDIATE:AMPLITUDE {:}'.format(sweepParams['sourceFun'],sweepParams['sweepStart'])) # set output to sweep start voltage
-  
-  # do one auto zero manually (could take over a second)
+  # the auto zero below could take over a second
   oldTimeout = sm.timeout
   sm.timeout = 5000
-  if not sweepParams['autoZero']:
-    sm.write(':SENSE1:AZERO:ONCE') # do one autozero now
-    sm.write(':SENSE1:{:}:AZERO OFF'.format(sweepParams['senseFun']))
-  else:
-    sm.write(':SENSE1:{:}:AZERO ON'.format(sweepParams['senseFun'])) # do autozero on every measurement
-  sm.write('*WAI') # no other commands during this
-  opc = sm.query('*OPC?') # wait for the operation to complete
+  with commandBatch(sm) as b:
+    queueSweepSetup(b, sweepParams)
+    opc = b.query('*OPC?') # wait for the operations (including the auto zero) to complete
   sm.timeout=oldTimeout  
   
-  # here are a few settings that trade accuracy for speed
-  #sm.write(':SENSE1:CURRENT:AZERO:STATE 0') # disable autozero for future readings
-  sm.write(':SENSE1:NPLC {:}'.format(sweepParams['nplc'])) # set NPLC
-  #sm.write(':SOURCE1:VOLTAGE:READ:BACK OFF') # disable voltage readback
-  
-  # turn on the source and wait for it to settle
-  sm.write(':OUTPUT1:STATE ON')
-  sm.write('*WAI') # no other commands during this
-  opc = sm.query('*OPC?') # wait for the operation to complete
-  
   if checkStatus(sm):
+    forgetState(sm)
     return False
   
-  # setup the sweep
-  sm.write(':SOURCE1:SWEEP:{:}:LINEAR {:}, {:}, {:}, {:}, 1, {:}, {:}, {:}'.format(sweepParams['sourceFun'],sweepParams['sweepStart'],sweepParams['sweepEnd'],sweepParams['nPoints'],sweepParams['stepDelay'],sweepParams['rangeType'],sweepParams['failAbort'],sweepParams['dual']))
+  # setup the sweep (unless it's already loaded) and check on it in the same message
+  with commandBatch(sm, checkErrors=False) as b:
+    b.set(sweepCommand(sweepParams), key='SOUR:SWE')
+    failed = checkStatus(b)
+  if failed:
+    forgetState(sm)
+  return not failed
+
+# queues up configureSweep's settings on a commandBatch, up to turning the source on
+# (k2450.aio's configureSweep sends the same ones)
+def queueSweepSetup(b, sweepParams):
+  b.set(':SOURCE1:FUNCTION {:}'.format(sweepParams['sourceFun']))
+  b.set(':SOURCE1:{:}:RANGE {:}'.format(sweepParams['sourceFun'],max(map(abs,[sweepParams['sweepStart'],sweepParams['sweepEnd']]))))
+  b.set(':SOURCE1:{:}:ILIMIT {:}'.format(sweepParams['sourceFun'],sweepParams['maxCurrent']))
+  b.set(':SENSE1:FUNCTION "{:}"'.format(sweepParams['senseFun']))
+  b.set(':SENSE1:{:}:RANGE {:}'.format(sweepParams['senseFun'],sweepParams['maxCurrent']))
+  if sweepParams['fourWire']:
+    b.set(':SENSE1:{:}:RSENSE ON'.format(sweepParams['senseFun']))# rsense (remote voltage sense) ON means four wire mode
+  else:
+    b.set(':SENSE1:{:}:RSENSE OFF'.format(sweepParams['senseFun']))# rsense (remote voltage sense) ON means four wire mode
+  b.set(':ROUTE:TERMINALS FRONT')
+  # the sweep moves the source level around so we always send this one
+  b.write(':SOURCE1:{:}:LEVEL:IMMEDIATE:AMPLITUDE {:}'.format(sweepParams['sourceFun'],sweepParams['sweepStart'])) # set output to sweep start voltage
   
-  stb = sm.query('*STB?') # ask for the status byte
-  if checkStatus(sm):
-    return False  
+  # here are a few settings that trade accuracy for speed
+  #b.write(':SENSE1:CURRENT:AZERO:STATE 0') # disable autozero for future readings
+  b.set(':SENSE1:NPLC {:}'.format(sweepParams['nplc'])) # set NPLC
+  #b.write(':SOURCE1:VOLTAGE:READ:BACK OFF') # disable voltage readback
+  
+  # do one auto zero manually (could take over a second)
+  if not sweepParams['autoZero']:
+    if b.changed: # the last one is still good if nothing changed since
+      b.write(':SENSE1:AZERO:ONCE') # do one autozero now
+    b.set(':SENSE1:{:}:AZERO OFF'.format(sweepParams['senseFun']))
   else:
-    return True
+    b.set(':SENSE1:{:}:AZERO ON'.format(sweepParams['senseFun'])) # do autozero on every measurement
+  b.write('*WAI') # no other commands during this
+  
+  # turn on the source and wait for it to settle
+  b.write(':OUTPUT1:STATE ON')
+  b.write('*WAI') # no other commands during this
+
+# the command that loads the sweep itself (set it with key='SOUR:SWE' so any sweep replaces the last)
+def sweepCommand(sweepParams):
+  return ':SOURCE1:SWEEP:{:}:LINEAR {:}, {:}, {:}, {:}, 1, {:}, {:}, {:}'.format(sweepParams['sourceFun'],sweepParams['sweepStart'],sweepParams['sweepEnd'],sweepParams['nPoints'],sweepParams['stepDelay'],sweepParams['rangeType'],sweepParams['failAbort'],sweepParams['dual'])
   
 
   
@@ -458,13 +968,25 @@ def doSweep(sm):
   print ("Sweep initiated...")
   # trigger the sweep
   sm.write(':INITIATE:IMMEDIATE') #should be: sm.assert_trigger()
-  sm.write('*WAI') # no other commands during this
+  sweepStarts[sm] = time.monotonic() # for fetchSweepData's timing
+  sm.write('*OPC') # flag operation complete (see waitForComplete) when the sweep is done
   return True
 
+# checkStatus's verdict on a status byte, True if there's been an event
+# esr is the *ESR? reply, only asked for when stb has ESB set (reading it clears it), since
+# an ESB that only an *OPC set (a sweep we stopped waiting for finishing, say) doesn't count
+def statusFailed(stb, esr=0):
+  if (stb & ESB) and not (esr & ~ESE_OPC):
+    stb = stb & ~ESB
+  return stb not in (0,64)
+
 # returns true if event
 def checkStatus(sm):
   stb = int(sm.query('*STB?')) # ask for the status byte
-  if stb not in(0,64):
+  esr = 0
+  if stb & ESB:
+    esr = int(sm.query('*ESR?'))
+  if statusFailed(stb, esr):
     print ("Status byte value:", stb)
     printEventLog(sm)
     return True
@@ -472,33 +994,178 @@ def checkStatus(sm):
     return False
     
 
-def fetchSweepData(sm,sweepParams):
-  oldTimeout = sm.timeout
-  #sm.timeout = sweepParams['durationEstimate']
-  t = time.time()
-  #TODO: should rely on SRQ here rather than read with timeout
-  opc = sm.query('*OPC?') # wait for any pending operation to complete
-  elapsed=time.time()-t
-  sm.timeout = oldTimeout
+# waits for the sweep doSweep started and returns its data as (i,v,i2,v2) or (None,None,None,None) on failure
+# the timeout comes from the sweep duration model unless sweepParams has a 'durationEstimate' [ms]
+# with onReadings, the readings are streamed (see streamSweepData) and onReadings is called with each new batch
+# with cancel (a threading.Event), they're streamed too and setting it aborts the sweep
+def fetchSweepData(sm,sweepParams,onReadings=None,cancel=None):
+  if (onReadings is not None) or (cancel is not None):
+    return fetchStreamedSweepData(sm, sweepParams, onReadings, cancel)
+  sweep = sweepInProgress(sm, sweepParams)
+  if not waitForComplete(sm, sweep.timeout(), notBefore=sweep.notBefore()): # wait for the sweep to finish
+    sweep.timedOut()
+    abortSweep(sm) # so its *OPC can't turn up later
+    return (None,None,None,None)
+  sweep.finished()
   nReadings = int(sm.query(':TRACE:ACTUAL?'))
-  print ("Sweep complete!")
-  print ("Sample frequency = {:.1f} Hz".format(nReadings/elapsed))
-  print ("Sweep event Log:")
+  sweep.report(nReadings)
   printEventLog(sm)
   
-  if nReadings != sweepParams['nPoints']*2-1: # check if we got enough readings
-    print("Error: We expected", sweepParams['nPoints']*2-1, "data points, but the Keithley's data buffer contained", nReadings)
-    return (None,None)
+  nExpected = expectedReadings(sweepParams)
+  if nReadings != nExpected: # check if we got enough readings
+    print("Error: We expected", nExpected, "data points, but the Keithley's data buffer contained", nReadings)
+    return (None,None,None,None)
   
   # ask keithley to return its buffer
-  values = sm.query_values ('TRACE:DATA? {:}, {:}, "defbuffer1", SOUR, READ'.format(1,sweepParams['nPoints']*2-1), nValues=nReadings)
+  values = queryValues(sm, traceDataQuery(1, nExpected), nValues=nReadings*2)
+  sm.write(":TRACE:CLEAR") # clear the buffer now that we've fetched it
+  return splitSweepData(values, sweepParams)
+
+# the timing of the sweep doSweep started on sm, for waiting on it (here and in k2450.aio)
+# from the sweep duration model unless sweepParams has a 'durationEstimate' [ms], and the instrumentInfo cache
+# (so k2450.aio fills that in first)
+class sweepInProgress:
+  def __init__(self, sm, sweepParams):
+    self.idn = instrumentInfo(sm)['idn']
+    self.config = sweepTimingConfig(sm, sweepParams)
+    self.expected, self.sigma = sweepTiming.predict(self.idn, self.config)
+    timeout = sweepParams.get('durationEstimate')
+    if timeout is None:
+      timeout = sweepTiming.timeout(self.idn, self.config)
+    now = time.monotonic()
+    self.start = sweepStarts.pop(sm, now)
+    self.timed = self.start != now # we know when it started, so its duration will be a good timing for the model
+    self.deadline = self.start + timeout/1000 # the sweep's been running since doSweep
+    self.elapsed = None
+  
+  # how long until we give up on it [ms]
+  def timeout(self):
+    return max(self.deadline - time.monotonic(), 0)*1000
+  
+  # how many seconds from now it can't possibly be done
+  def notBefore(self):
+    return self.start + self.expected - 2*self.sigma - time.monotonic()
+  
+  # seconds between looks at the buffer while streaming it (see streamPollInterval)
+  def pollInterval(self):
+    return streamPollInterval(self.expected)
+  
+  def timedOut(self):
+    print("Error: Timed out waiting for the sweep to complete (expected it to take {:.2f}+/-{:.2f} s)".format(self.expected, self.sigma))
+  
+  # call as soon as its *OPC is seen
+  def finished(self):
+    self.elapsed = time.monotonic() - self.start
+    if self.timed:
+      sweepTiming.record(self.idn, self.config, self.elapsed)
+  
+  # the caller prints the event log after this
+  def report(self, nReadings):
+    print ("Sweep complete!")
+    print ("Sweep took {:.2f} s (expected {:.2f}+/-{:.2f} s)".format(self.elapsed, self.expected, self.sigma))
+    print ("Sample frequency = {:.1f} Hz".format(nReadings/self.elapsed))
+    print ("Sweep event Log:")
+
+streamPolls = 50 # polls of the buffer per (expected) sweep, so the sweep's timing is good to 2% like timing.noise() assumes...
+minStreamPoll = 0.05 # s ...but no more often than this
+maxStreamPoll = 1 # s ...and no less often than this
+
+# how long to wait between looks at the buffer while streaming a sweep expected to take this many seconds
+def streamPollInterval(expected):
+  return min(max(expected/streamPolls, minStreamPoll), maxStreamPoll)
+
+# the TRACE:DATA? query for readings first to last (counting from 1, inclusive) of defbuffer1
+def traceDataQuery(first, last):
+  return 'TRACE:DATA? {:}, {:}, "defbuffer1", SOUR, READ'.format(first, last)
+
+# streams the sweep doSweep started: a generator that yields the new SOUR, READ pairs (an [n,2] array) as they arrive
+# while the trigger model runs it looks at how full the buffer is (:TRACE:ACTUAL?) every streamPollInterval and
+# fetches only the readings it hasn't seen yet with a ranged TRACE:DATA?, so the transfer overlaps the measurement
+# it stops once the sweep's *OPC comes through (clearing the buffer) or on timeout (printing an error), so the
+# caller can tell what happened by counting readings against expectedReadings (a timed out sweep is aborted)
+# setting cancel (a threading.Event, if given) aborts the sweep (see abortSweep) and stops the stream
+# nothing else should talk to sm until it's done
+def streamSweepData(sm, sweepParams, cancel=None):
+  sweep = sweepInProgress(sm, sweepParams)
+  pause = sweep.pollInterval()
+  fetched = 0
+  done = False
+  while not done:
+    remaining = sweep.timeout()/1000
+    if remaining <= 0:
+      sweep.timedOut()
+      abortSweep(sm) # so its *OPC can't turn up later
+      return
+    if cancel is None:
+      time.sleep(min(pause, remaining))
+    elif cancel.wait(min(pause, remaining)):
+      abortSweep(sm)
+      return
+    if readSTB(sm) & ESB: # the status byte first, so once OPC is seen the buffer count below is final
+      done = bool(int(sm.query('*ESR?')) & ESE_OPC) # reading this clears it (and so ESB too)
+      if done:
+        sweep.finished()
+    nReadings = int(sm.query(':TRACE:ACTUAL?'))
+    if nReadings > fetched:
+      values = queryValues(sm, traceDataQuery(fetched + 1, nReadings), nValues=(nReadings - fetched)*2)
+      fetched = nReadings
+      yield values.reshape([-1,2])
+  sweep.report(fetched)
+  printEventLog(sm)
   sm.write(":TRACE:CLEAR") # clear the buffer now that we've fetched it
 
-  # reformat what we got back  
+# stops the running trigger model and waits for the *OPC doSweep asked for, so the next sweep doesn't see it
+def abortSweep(sm, timeout=2000):
+  sm.write(':ABORt')
+  print("Sweep aborted.")
+  if not waitForComplete(sm, timeout):
+    print("Error: The sweep did not stop")
+  sm.write(":TRACE:CLEAR")
+
+# fetchSweepData's streaming half: gathers what streamSweepData yields, passing each batch to onReadings (if given) too
+def fetchStreamedSweepData(sm, sweepParams, onReadings=None, cancel=None):
+  batches = []
+  for readings in streamSweepData(sm, sweepParams, cancel):
+    if onReadings is not None:
+      onReadings(readings)
+    batches.append(readings)
+  nReadings = sum([len(b) for b in batches])
+  nExpected = expectedReadings(sweepParams)
+  if nReadings != nExpected: # check if we got enough readings
+    if (cancel is not None) and cancel.is_set():
+      return (None,None,None,None) # aborted, that's why
+    print("Error: We expected", nExpected, "data points, but the Keithley sent", nReadings)
+    return (None,None,None,None)
+  return splitSweepData(numpy.concatenate(batches), sweepParams)
+
+# how many readings a sweep leaves in the buffer
+# a dual sweep goes there and back in one trigger, sharing the turnaround point
+def expectedReadings(sweepParams):
+  if sweepParams.get('dual', 'ON') in ('ON', True):
+    return sweepParams['nPoints']*2-1
+  else:
+    return sweepParams['nPoints']
+
+# which of a sweep's SOUR, READ columns are the current and the voltage, as (current column, voltage column)
+# sweeps source current unless their sourceFun says voltage (rSweep's rsOpt has none, it always sources current)
+def ivColumns(sweepParams):
+  if str(sweepParams.get('sourceFun', 'CURR')).upper().startswith('VOLT'):
+    return (1, 0)
+  return (0, 1)
+
+# reformats the SOUR, READ pairs of a sweep into (i,v,i2,v2) whatever was sourced (see ivColumns)
+# these are all views onto values (no copies)
+def splitSweepData(values, sweepParams):
+  nPoints = sweepParams['nPoints']
+  iColumn, vColumn = ivColumns(sweepParams)
   values = values.reshape([-1,2])
-  i = values[0:sweepParams['nPoints'],0]
-  v = values[0:sweepParams['nPoints'],1]
-  i2 = values[sweepParams['nPoints']-1::,0]
-  v2 = values[sweepParams['nPoints']-1::,1]
+  i = values[0:nPoints,iColumn]
+  v = values[0:nPoints,vColumn]
+  if sweepParams.get('dual', 'ON') in ('ON', True):
+    i2 = values[nPoints-1::,iColumn]
+    v2 = values[nPoints-1::,vColumn]
+  else:
+    i2 = None
+    v2 = None
   
   return (i,v,i2,v2)
@@ -0,0 +1,454 @@
+# asyncio flavoured k2450, so one event loop can drive many instruments (and a UI or web API) without a thread for each
+# asyncConn speaks SCPI over a raw socket (TCPIP::host::port::SOCKET resources) with asyncio streams and
+# threadedConn runs anything else (VXI-11, serial, USB via pyvisa) in a worker thread of its own,
+# both have coroutine versions of socketConn's write/read/query/query_values
+# usage:
+#   sm = await k2450.aio.visaConnect({'resource_name': 'TCPIP::192.168.1.204::5025::SOCKET', 'timeout': 1000})
+#   await k2450.aio.setup2450(sm)
+#   await k2450.aio.configureSweep(sm, sweepParams)
+#   await k2450.aio.doSweep(sm)
+#   i, v, i2, v2 = await k2450.aio.fetchSweepData(sm, sweepParams)
+#   await sm.close()
+# the settings cache, sweep duration model and instrument info are shared with the blocking functions in k2450,
+# and so is everything that isn't I/O (parsing replies, deciding what they mean, timing sweeps), only the awaits are here
+import asyncio
+import concurrent.futures
+import socket
+import time
+
+import numpy
+
+import k2450
+
+class asyncConn:
+  def __init__(self, reader, writer, timeout=1000):
+    self.reader = reader
+    self.writer = writer
+    self.termChar = b'\n'
+    self.decode = 'utf-8'
+    self.getLen = 4096
+    self.values_format = k2450.valuesFormat()
+    self.timeout = timeout # ms, same units as a pyvisa resource, None waits forever
+    s = writer.get_extra_info('socket')
+    if s is not None:
+      s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # don't let Nagle hold back small commands waiting on delayed ACKs
+
+  # the output goes off (like socketConn.close does) and the connection is closed
+  async def close(self):
+    try:
+      await self.write('OUTPut OFF')
+    finally:
+      self.writer.close()
+      try:
+        await self.writer.wait_closed()
+      except OSError:
+        pass
+
+  # a context manager that sends the commands written to it in one go, see asyncBatch
+  def batch(self, checkErrors=True):
+    return asyncBatch(self, checkErrors)
+
+  # awaits aw for at most timeout ms, raising the same exceptions socketConn does
+  async def _wait(self, aw):
+    try:
+      if self.timeout is None:
+        return await aw
+      else:
+        return await asyncio.wait_for(aw, self.timeout/1000)
+    except asyncio.TimeoutError:
+      raise socket.timeout('Timed out after {:} ms waiting for the instrument'.format(self.timeout))
+    except asyncio.IncompleteReadError:
+      raise ConnectionError('The instrument closed the connection')
+
+  async def write(self, string):
+    self.writer.write(bytes(string, self.decode) + self.termChar)
+    await self._wait(self.writer.drain())
+    return True
+
+  # throws away anything the instrument has sent that we haven't read yet (e.g. after a timeout)
+  async def flush(self, quiet=0.01):
+    while True:
+      try:
+        chunk = await asyncio.wait_for(self.reader.read(self.getLen), quiet)
+      except asyncio.TimeoutError:
+        return # nothing more for a while
+      if chunk == b'':
+        return # peer closed the connection
+
+  async def read(self):
+    line = await self._wait(self.reader.readuntil(self.termChar))
+    return line[:-len(self.termChar)].decode(self.decode).rstrip()
+
+  async def query(self, string):
+    if await self.write(string):
+      return await self.read()
+    else:
+      return None
+
+  # the status byte (there's no serial poll over a raw socket)
+  async def readSTB(self):
+    return int(await self.query('*STB?'))
+
+  # reads one IEEE 488.2 binary block and returns its payload (see k2450.blockDigits)
+  async def readBlock(self, nBytes=None):
+    return await self._wait(self._readBlock(nBytes))
+
+  async def _readBlock(self, nBytes):
+    nDigits = k2450.blockDigits(await self.reader.readexactly(2), nBytes)
+    if nDigits > 0: # definite length block
+      nBytes = k2450.blockLength(await self.reader.readexactly(nDigits), nBytes)
+    payload = await self.reader.readexactly(nBytes)
+    k2450.checkBlockEnd(await self.reader.readexactly(len(self.termChar)), self.termChar)
+    return payload
+
+  # nValues is the total number of values expected (two per reading when asking for SOUR, READ)
+  async def query_values(self, string, nValues=None):
+    if await self.write(string):
+      dtype = k2450.valuesDtype(self.values_format)
+      if nValues is None:
+        nBytes = None
+      else:
+        nBytes = nValues*dtype.itemsize
+      payload = await self.readBlock(nBytes)
+      return numpy.frombuffer(payload, dtype=dtype) # a view on the payload, no copying
+    else:
+      return None
+
+# the same coroutines as asyncConn for a blocking connection (a pyvisa resource or a socketConn)
+# its calls run one at a time in a thread of their own so they keep their order and never block the event loop
+class threadedConn:
+  def __init__(self, sm):
+    self.sm = sm
+    self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='k2450')
+
+  async def _call(self, fun, *args):
+    return await asyncio.get_running_loop().run_in_executor(self.executor, fun, *args)
+
+  @property
+  def timeout(self):
+    return self.sm.timeout
+
+  @timeout.setter
+  def timeout(self, value):
+    self.sm.timeout = value
+
+  async def close(self):
+    try:
+      await self._call(self.sm.close)
+    finally:
+      self.executor.shutdown(wait=False)
+
+  def batch(self, checkErrors=True):
+    return asyncBatch(self, checkErrors)
+
+  async def write(self, string):
+    return await self._call(self.sm.write, string)
+
+  async def read(self):
+    return await self._call(self.sm.read)
+
+  async def query(self, string):
+    return await self._call(self.sm.query, string)
+
+  async def readSTB(self):
+    return await self._call(k2450.readSTB, self.sm)
+
+  async def query_values(self, string, nValues=None):
+    return await self._call(k2450.queryValues, self.sm, string, nValues)
+
+# k2450.commandBatch for async connections: the commands are queued up the same way (write and set don't
+# do any I/O, so k2450's queue* functions work on these too) but flush, query and query_values are coroutines
+#   async with asyncBatch(sm) as b:
+#     b.set(...)
+#     reply = await b.query(...)
+class asyncBatch(k2450.commandBatch):
+  def __init__(self, sm, checkErrors=True):
+    k2450.commandBatch.__init__(self, sm, checkErrors)
+    self.pending = [] # messages that got too long to add to and are waiting to be sent
+
+  def __enter__(self):
+    raise TypeError('Use "async with" for an asyncBatch')
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      if self.checkErrors:
+        self.errorCount = int(await self.query(':SYSTem:ERRor:COUNt?'))
+        if self.errorCount > 0:
+          self.state.clear() # we can't know which of our settings took
+          await printErrors(self.sm)
+      else:
+        await self.flush()
+    else:
+      self.state.clear()
+    return False
+
+  # write can't send anything (it isn't a coroutine), so a full message waits for the next flush or query
+  def _overflow(self):
+    self.pending.append(self._take())
+
+  async def _sendPending(self):
+    while len(self.pending) > 0:
+      if not await self.sm.write(self.pending.pop(0)):
+        return False
+    return True
+
+  # sends whatever is queued up
+  async def flush(self):
+    ok = await self._sendPending()
+    if len(self.queue) > 0:
+      ok = await self.sm.write(self._take()) and ok
+    return ok
+
+  async def query(self, string):
+    await self._sendPending()
+    return await self.sm.query(self._take(string))
+
+  async def query_values(self, string, nValues=None):
+    await self._sendPending()
+    return await self.sm.query_values(self._take(string), nValues)
+
+# waits for the operation complete event flagged by a previously sent "*OPC", see k2450.waitForComplete
+# polls the status byte with backoff (starting after notBefore seconds), returns True on completion and False on timeout [ms]
+async def waitForComplete(sm, timeout=None, notBefore=None, minPoll=0.001, maxPoll=0.1):
+  if timeout is None:
+    deadline = None
+  else:
+    deadline = time.monotonic() + timeout/1000
+  if (notBefore is not None) and (notBefore > 0):
+    if deadline is not None:
+      notBefore = min(notBefore, deadline - time.monotonic())
+    await asyncio.sleep(max(notBefore, 0))
+  pause = minPoll
+  while True:
+    byte = await sm.readSTB()
+    if byte & k2450.ESB:
+      esr = int(await sm.query('*ESR?')) # reading this clears it (and so ESB too)
+      if esr & k2450.ESE_OPC:
+        return True
+      continue # ESB was set by something other than OPC (e.g. a command error), keep waiting
+    if deadline is None:
+      await asyncio.sleep(pause)
+    else:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return False
+      await asyncio.sleep(min(pause, remaining))
+    pause = min(pause*2, maxPoll)
+
+async def printErrors(sm):
+  errorCount = int(await sm.query(':SYSTem:ERRor:COUNt?'))
+  while errorCount > 0:
+    print(await sm.query('SYST:ERR:NEXT?'))
+    errorCount = int(await sm.query(':SYSTem:ERRor:COUNt?'))
+
+async def printEventLog(sm):
+  errorCount = 0
+  while True:
+    entry = k2450.eventLogEntry(await sm.query(':SYSTEM:EVENTLOG:NEXT?'))
+    if entry is None:
+      break
+    errorCount = errorCount + 1
+    print(*entry)
+  await sm.write(':SYSTEM:CLEAR') # clear the logs since we've read them now
+  if errorCount == 0:
+    print('No errors in log.')
+
+# returns true if event (see k2450.statusFailed)
+async def checkStatus(sm):
+  stb = int(await sm.query('*STB?')) # ask for the status byte
+  esr = 0
+  if stb & k2450.ESB:
+    esr = int(await sm.query('*ESR?'))
+  if k2450.statusFailed(stb, esr):
+    print ("Status byte value:", stb)
+    await printEventLog(sm)
+    return True
+  else:
+    return False
+
+# fills in k2450.instrumentInfo's cache for this connection (so the blocking one can be used after) and returns it
+async def instrumentInfo(sm):
+  if isinstance(sm, asyncBatch):
+    await sm.flush()
+    sm = sm.sm
+  if sm not in k2450.instrumentInfos:
+    info, ok = k2450.parseInstrumentInfo(await sm.query(k2450.infoQuery))
+    if not ok:
+      await printErrors(sm)
+    k2450.instrumentInfos[sm] = info
+  return k2450.instrumentInfos[sm]
+
+# opens the connection itself, raises on failure
+async def openConnection(openParams):
+  timeout = openParams.get('timeout')
+  if 'SOCKET' in openParams['resource_name']:
+    host, port = k2450.socketAddress(openParams['resource_name'])
+    if timeout is None:
+      reader, writer = await asyncio.open_connection(host, port)
+    else:
+      reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout/1000)
+    return asyncConn(reader, writer, timeout)
+  else:
+    loop = asyncio.get_running_loop()
+    rm = await loop.run_in_executor(None, k2450.resourceManager, '@py')
+    return threadedConn(await loop.run_in_executor(None, lambda: rm.open_resource(**openParams)))
+
+# connects to an instrument the way k2450.visaConnect does (no reset, see setup2450)
+# returns an asyncConn (SOCKET resources), a threadedConn (anything else, through pyvisa) or None on failure
+async def visaConnect(openParams):
+  address = openParams['resource_name']
+  print("Connecting to", address, "...")
+  try:
+    d = await openConnection(openParams)
+  except Exception as e:
+    k2450.connectionFailed(address, e)
+    host = k2450.hostToProbe(address)
+    if host is None:
+      return None
+    probes = await asyncio.get_running_loop().run_in_executor(None, k2450.probePorts, host, k2450.probedPorts, openParams['timeout'])
+    if not k2450.worthRetrying(host, probes):
+      return None
+    try: # once more
+      d = await openConnection(openParams)
+    except Exception as e:
+      k2450.connectionFailed(address, e)
+      return None
+  print("Connection established.")
+
+  try:
+    if address in k2450.knownAddresses:
+      await d.readSTB() # the instrument's answering
+      k2450.instrumentInfos[d] = dict(k2450.knownAddresses[address])
+    else:
+      print("Querying device type...")
+      k2450.knownAddresses[address] = dict(await instrumentInfo(d)) # ask the device to identify its self
+  except Exception as e:
+    k2450.identifyFailed(d, e)
+    try:
+      await d.close()
+    except Exception:
+      pass
+    return None
+  print("Device identified as", k2450.instrumentInfos[d]['idn'])
+  return d
+
+# see k2450.setup2450
+async def setup2450(sm):
+  async with asyncBatch(sm) as b:
+    k2450.queueSetup2450(b)
+  if isinstance(sm, threadedConn) and hasattr(sm.sm, 'values_format'): # socketConn and older pyvisa (see k2450.queryValues)
+    sm.sm.values_format.container = numpy.array
+    sm.sm.values_format.datatype = 'd'
+  return b.errorCount == 0 # setup completed properly
+
+# see k2450.configureSweep
+async def configureSweep(sm, sweepParams):
+  # the auto zero could take over a second
+  oldTimeout = sm.timeout
+  sm.timeout = 5000
+  try:
+    async with asyncBatch(sm) as b:
+      k2450.queueSweepSetup(b, sweepParams)
+      opc = await b.query('*OPC?') # wait for the operations (including the auto zero) to complete
+  finally:
+    sm.timeout = oldTimeout
+
+  if await checkStatus(sm):
+    k2450.forgetState(sm)
+    return False
+
+  # setup the sweep (unless it's already loaded), then check on it
+  # (on sm, not b: an asyncBatch can't send printEventLog's writes)
+  async with asyncBatch(sm, checkErrors=False) as b:
+    b.set(k2450.sweepCommand(sweepParams), key='SOUR:SWE')
+  failed = await checkStatus(sm)
+  if failed:
+    k2450.forgetState(sm)
+  return not failed
+
+# see k2450.doSweep
+async def doSweep(sm):
+  # check that things are cool before we do the sweep
+  if await checkStatus(sm):
+    return False
+
+  print ("Sweep initiated...")
+  await sm.write(':INITIATE:IMMEDIATE;*OPC') # flag operation complete (see waitForComplete) when the sweep is done
+  k2450.sweepStarts[sm] = time.monotonic() # for fetchSweepData's timing
+  return True
+
+# see k2450.fetchSweepData, the event loop is free for other things while the sweep runs
+# onReadings (a plain function) gets each batch of readings as they're streamed, see streamSweepData
+async def fetchSweepData(sm, sweepParams, onReadings=None):
+  if onReadings is not None:
+    return await fetchStreamedSweepData(sm, sweepParams, onReadings)
+  await instrumentInfo(sm) # for sweepInProgress
+  sweep = k2450.sweepInProgress(sm, sweepParams)
+  if not await waitForComplete(sm, sweep.timeout(), notBefore=sweep.notBefore()): # wait for the sweep to finish
+    sweep.timedOut()
+    await abortSweep(sm) # so its *OPC can't turn up later
+    return (None,None,None,None)
+  sweep.finished()
+  nReadings = int(await sm.query(':TRACE:ACTUAL?'))
+  sweep.report(nReadings)
+  await printEventLog(sm)
+
+  nExpected = k2450.expectedReadings(sweepParams)
+  if nReadings != nExpected: # check if we got enough readings
+    print("Error: We expected", nExpected, "data points, but the Keithley's data buffer contained", nReadings)
+    return (None,None,None,None)
+
+  # ask keithley to return its buffer
+  values = await sm.query_values(k2450.traceDataQuery(1, nExpected), nValues=nReadings*2)
+  await sm.write(":TRACE:CLEAR") # clear the buffer now that we've fetched it
+  return k2450.splitSweepData(values, sweepParams)
+
+# see k2450.streamSweepData, an async generator: async for readings in k2450.aio.streamSweepData(sm, sweepParams): ...
+async def streamSweepData(sm, sweepParams):
+  await instrumentInfo(sm) # for sweepInProgress
+  sweep = k2450.sweepInProgress(sm, sweepParams)
+  pause = sweep.pollInterval()
+  fetched = 0
+  done = False
+  while not done:
+    remaining = sweep.timeout()/1000
+    if remaining <= 0:
+      sweep.timedOut()
+      await abortSweep(sm) # so its *OPC can't turn up later
+      return
+    await asyncio.sleep(min(pause, remaining))
+    if (await sm.readSTB()) & k2450.ESB: # the status byte first, so once OPC is seen the buffer count below is final
+      done = bool(int(await sm.query('*ESR?')) & k2450.ESE_OPC) # reading this clears it (and so ESB too)
+      if done:
+        sweep.finished()
+    nReadings = int(await sm.query(':TRACE:ACTUAL?'))
+    if nReadings > fetched:
+      values = await sm.query_values(k2450.traceDataQuery(fetched + 1, nReadings), nValues=(nReadings - fetched)*2)
+      fetched = nReadings
+      yield values.reshape([-1,2])
+  sweep.report(fetched)
+  await printEventLog(sm)
+  await sm.write(":TRACE:CLEAR") # clear the buffer now that we've fetched it
+
+# see k2450.abortSweep
+async def abortSweep(sm, timeout=2000):
+  await sm.write(':ABORt')
+  print("Sweep aborted.")
+  if not await waitForComplete(sm, timeout):
+    print("Error: The sweep did not stop")
+  await sm.write(":TRACE:CLEAR")
+
+async def fetchStreamedSweepData(sm, sweepParams, onReadings):
+  batches = []
+  async for readings in streamSweepData(sm, sweepParams):
+    onReadings(readings)
+    batches.append(readings)
+  nReadings = sum([len(b) for b in batches])
+  nExpected = k2450.expectedReadings(sweepParams)
+  if nReadings != nExpected: # check if we got enough readings
+    print("Error: We expected", nExpected, "data points, but the Keithley sent", nReadings)
+    return (None,None,None,None)
+  return k2450.splitSweepData(numpy.concatenate(batches), sweepParams)
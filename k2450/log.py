@@ -0,0 +1,117 @@
+# logging for the k2450 chatter (and anything else that print()s)
+# k2450 reports what it's doing with print(), printStream turns those lines into records for a logging.Logger
+# so where they end up (console, file, GUI...) is just a matter of which handlers that logger has
+# ringHandler keeps the latest records in a bounded buffer for a GUI to pick up in batches, at its own pace
+# usage:
+#   logger = k2450.log.setup(logFile='rs-tool.log') # console and file handlers, no GUI needed
+#   ring = k2450.log.ringHandler(1000)
+#   logger.addHandler(ring)
+#   with k2450.log.capturePrints(logger):
+#     ... # print()s from any thread become records
+#     lines = ring.take() # the formatted lines since the last take(), oldest first
+import collections
+import contextlib
+import logging
+import sys
+import threading
+
+loggerName = 'rs-tool'
+logFormat = '%(asctime)s %(levelname)s %(threadName)s: %(message)s'
+
+# the level for a printed line, k2450 starts its complaints with "Error" or "Warning"
+def lineLevel(line):
+  if line.startswith('Error'):
+    return logging.ERROR
+  elif line.startswith('Warning'):
+    return logging.WARNING
+  else:
+    return logging.INFO
+
+# a write only text stream (to stand in for sys.stdout) that logs each line written to it
+# each thread gets its own partial line, so print()s from different threads don't get mixed up
+class printStream:
+  def __init__(self, logger):
+    self.logger = logger
+    self.partial = threading.local()
+
+  def write(self, text):
+    pending = getattr(self.partial, 'text', '') + text
+    lines = pending.split('\n')
+    self.partial.text = lines.pop() # what's after the last newline waits for the rest of its line
+    for line in lines:
+      if line.strip() != '':
+        self.logger.log(lineLevel(line), line)
+    return len(text)
+
+  def flush(self):
+    pending = getattr(self.partial, 'text', '')
+    self.partial.text = ''
+    if pending.strip() != '':
+      self.logger.log(lineLevel(pending), pending)
+
+  def isatty(self):
+    return False
+
+# keeps the last maxLines formatted records, emit() is cheap and never blocks on whoever reads them
+class ringHandler(logging.Handler):
+  def __init__(self, maxLines=1000, level=logging.NOTSET):
+    logging.Handler.__init__(self, level)
+    self.lines = collections.deque(maxlen=maxLines)
+    self.nDropped = 0 # records that fell off the end before anyone took them
+
+  def emit(self, record):
+    try:
+      line = self.format(record)
+    except Exception:
+      self.handleError(record)
+      return
+    with self.lock: # logging.Handler's own
+      if len(self.lines) == self.lines.maxlen:
+        self.nDropped = self.nDropped + 1
+      self.lines.append(line)
+
+  # returns (and forgets) the lines waiting, oldest first, after a line saying how many were lost (if any were)
+  def take(self):
+    with self.lock:
+      lines = list(self.lines)
+      self.lines.clear()
+      nDropped = self.nDropped
+      self.nDropped = 0
+    if nDropped > 0:
+      lines.insert(0, '[{:} lines not shown]'.format(nDropped))
+    return lines
+
+# the logger the prints go to, with a console handler (on the real stdout) and, with logFile, a file handler
+# calling it again replaces the handlers it added the last time
+def setup(logFile=None, console=True, level=logging.INFO):
+  logger = logging.getLogger(loggerName)
+  logger.setLevel(level)
+  logger.propagate = False
+  for h in [h for h in logger.handlers if getattr(h, 'fromSetup', False)]:
+    logger.removeHandler(h)
+    h.close()
+  handlers = []
+  if console:
+    h = logging.StreamHandler(sys.__stdout__)
+    h.setFormatter(logging.Formatter('%(message)s')) # looks like it always did
+    handlers.append(h)
+  if logFile is not None:
+    h = logging.FileHandler(logFile)
+    h.setFormatter(logging.Formatter(logFormat))
+    handlers.append(h)
+  for h in handlers:
+    h.fromSetup = True
+    logger.addHandler(h)
+  return logger
+
+# sends what's print()ed to logger while in the with block
+@contextlib.contextmanager
+def capturePrints(logger=None):
+  if logger is None:
+    logger = logging.getLogger(loggerName)
+  stream = printStream(logger)
+  with contextlib.redirect_stdout(stream):
+    try:
+      yield stream
+    finally:
+      stream.flush()
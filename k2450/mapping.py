@@ -0,0 +1,173 @@
+# measurement plans for mapping a sample: an rSweep (see k2450.stations.station.rSweep) at each of a list of sites,
+# with a stage moving the probe head between them, without an operator clicking Sweep in between
+# the instrument work for a site (move, preliminary measurement and sweep setup, sweep, fetch) runs in the calling
+# thread while whatever the caller does with the previous site's results (fitting, saving...) runs in another,
+# so the next site's setup overlaps the last one's analysis
+# the stage is anything with moveTo(x, y) (see stage), mockStage stands in when there isn't one
+# a site that fails (the stage, the instrument, the link to it) is recorded as such and the plan goes on
+# usage:
+#   sites = k2450.mapping.discSites(diameter=100, pitch=10, s=1)
+#   plan = k2450.mapping.measurementPlan(k2450.stations.station('W1', address), sites, rsOpt, finish=saveSite)
+#   results = plan.run() # saveSite(results) has been called for every site by now
+# or from the command line: rs-tool.py --disc-sites 100 10 ... (see the README)
+import concurrent.futures
+import csv
+import importlib
+import json
+import math
+import os
+import time
+
+import k2450
+
+# what a plan needs from a stage, subclass it for a real one:
+# moveTo blocks until the probe head is down on (x, y) (in the plan's units), lift raises it
+class stage:
+  def moveTo(self, x, y):
+    raise NotImplementedError
+
+  def lift(self):
+    pass
+
+  def close(self):
+    pass
+
+# a stage that isn't there, it only keeps track of where it would be
+# with a speed (units/s) and a settle time (s) moves take as long as they would on a real one
+class mockStage(stage):
+  def __init__(self, speed=None, settle=0):
+    self.speed = speed
+    self.settle = settle
+    self.x = 0
+    self.y = 0
+    self.nMoves = 0
+
+  def moveTo(self, x, y):
+    if self.speed is not None:
+      time.sleep(math.hypot(x - self.x, y - self.y)/self.speed + self.settle)
+    self.x = x
+    self.y = y
+    self.nMoves = self.nMoves + 1
+
+# makes the stage named like package.module:className with the given keyword arguments
+def loadStage(name, **kwargs):
+  moduleName, className = name.split(':')
+  return getattr(importlib.import_module(moduleName), className)(**kwargs)
+
+# sites on an nx by ny grid with this pitch, centred on centre, in serpentine order so the stage never goes far
+def gridSites(nx, ny, pitch, centre=(0, 0)):
+  sites = []
+  for row in range(ny):
+    columns = range(nx) if row % 2 == 0 else reversed(range(nx))
+    for column in columns:
+      x = centre[0] + (column - (nx - 1)/2)*pitch
+      y = centre[1] + (row - (ny - 1)/2)*pitch
+      sites.append({'site': 'r{:}c{:}'.format(row, column), 'x': x, 'y': y})
+  return sites
+
+# the grid sites (see gridSites) on a disc where the probe head (spacing s, along x) fits, exclusion from the edge
+def discSites(diameter, pitch, s=1, exclusion=0):
+  n = int(diameter//pitch) + 1
+  reach = diameter/2 - exclusion
+  return [site for site in gridSites(n, n, pitch) if math.hypot(abs(site['x']) + 1.5*s, site['y']) < reach]
+
+# sites from a csv (site, x, y columns) or json (a list of {'site': ..., 'x': ..., 'y': ...}) file
+def loadSites(path):
+  if os.path.splitext(path)[1].lower() == '.json':
+    with open(path) as f:
+      sites = json.load(f)
+  else:
+    with open(path, newline='') as f:
+      sites = list(csv.DictReader(f))
+  return [{'site': str(s.get('site', n)), 'x': float(s['x']), 'y': float(s['y'])} for (n, s) in enumerate(sites)]
+
+class measurementPlan:
+  # station: the k2450.stations.station to measure with, rsOpt: see k2450.rSweep
+  # sites: list of {'site': name, 'x': ..., 'y': ...} plus anything else that should go into that site's results
+  # (a 'geometryFactor' goes into the site's rsOpt too, for the preliminary R_s)
+  # finish(results) is called in the plan's analysis thread with each site's results (see measureSite), in order
+  def __init__(self, station, sites, rsOpt, stage=None, finish=None):
+    self.station = station
+    self.sites = sites
+    self.rsOpt = rsOpt
+    if stage is None:
+      stage = mockStage()
+    self.stage = stage
+    self.finish = finish
+
+  # measures every site, returns the list of their results dicts in site order
+  # cancel (a threading.Event) stops it after the site it's on
+  def run(self, cancel=None):
+    analysis = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='mapping') # one, so the sites stay in order
+    futures = []
+    t = time.monotonic()
+    try:
+      for (n, site) in enumerate(self.sites):
+        if (cancel is not None) and cancel.is_set():
+          print('Map cancelled after {:} of {:} sites'.format(n, len(self.sites)))
+          break
+        print('Site {:} ({:} of {:}) at ({:}, {:})'.format(site['site'], n + 1, len(self.sites), site['x'], site['y']))
+        results = self.measureSite(site)
+        futures.append(analysis.submit(self.finishSite, results)) # and on to the next site while that happens
+    finally:
+      try:
+        self.stage.lift()
+      finally:
+        analysis.shutdown(wait=True)
+    done = [f.result() for f in futures]
+    elapsed = time.monotonic() - t
+    if len(done) > 0:
+      print('Mapped {:} sites in {:.1f} s ({:.0f} sites/hour)'.format(len(done), elapsed, len(done)/elapsed*3600))
+    return done
+
+  # the instrument half of a site: move there, rSweep and fetch the data
+  # the output goes off and the probes up before every move, so they're never dragged across the sample live
+  # returns the site's results: the site dict's items, start, end, status ('ok' or what went wrong),
+  # rsStatus if the preliminary check failed and {'i': ..., 'v': ...} for forward and reverse if it all went well
+  def measureSite(self, site):
+    results = dict(site)
+    results['start'] = time.time()
+    try:
+      self.station.run(lambda station: station.outputOff())
+    except Exception as e:
+      print('Error: Unable to turn the output off to move to site {:}: {:}'.format(site['site'], e))
+      results['status'] = 'failed: {:}'.format(e)
+      results['end'] = time.time()
+      return results
+    try:
+      self.stage.lift()
+      self.stage.moveTo(site['x'], site['y'])
+    except Exception as e:
+      print('Error: Unable to move to site {:}: {:}'.format(site['site'], e))
+      results['status'] = 'move failed: {:}'.format(e)
+      results['end'] = time.time()
+      return results
+    rsOpt = dict(self.rsOpt)
+    if 'geometryFactor' in site:
+      rsOpt['geometryFactor'] = site['geometryFactor']
+    try:
+      sweep = self.station.run(lambda station: station.rSweep(rsOpt)) # reconnects if the link dropped
+    except Exception as e:
+      print('Error: Site {:} failed: {:}'.format(site['site'], e))
+      results['status'] = 'failed: {:}'.format(e)
+      results['end'] = time.time()
+      return results
+    if sweep['ok']:
+      results['status'] = 'ok'
+      results['forward'] = {'i': sweep['i'], 'v': sweep['v']}
+      results['reverse'] = {'i': sweep['i2'], 'v': sweep['v2']}
+    else:
+      results['status'] = sweep['error']
+      if sweep.get('rsStatus', k2450.RS_OK) != k2450.RS_OK:
+        results['rsStatus'] = sweep['rsStatus']
+    results['end'] = sweep['end']
+    return results
+
+  # the other half (in the analysis thread), returns the results
+  def finishSite(self, results):
+    if self.finish is not None:
+      try:
+        self.finish(results)
+      except Exception as e:
+        print('Error: Unable to finish site {:}: {:}'.format(results['site'], e))
+    return results
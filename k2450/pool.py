@@ -0,0 +1,209 @@
+# long lived, shared connections to instruments, one per VISA address, that heal themselves
+# so the GUI, scripts and k2450.stations can all use the same session instead of each paying for a connect and reset
+# using a connection checks it's still there (a *STB? if it's been idle for a while) and reopens it if not,
+# after which setup2450 and every setting asked for before (see k2450.requestedSettings) are sent again
+# usage:
+#   conn = k2450.pool.connection('TCPIP::192.168.1.204::5025::SOCKET', timeout=1000)
+#   with conn as sm: # this thread has the instrument to itself until the with block ends
+#     k2450.configureSweep(sm, sweepParams)
+#   conn.run(k2450.configureSweep, sweepParams) # the same, but tries again on a new connection if the link dropped
+#   conn.keepAlive(10) # check on it every 10 s in the background while nobody's using it
+import threading
+import time
+
+import k2450
+
+# True for the exceptions that mean the link to the instrument is gone (or at least can't be trusted)
+def isConnectionError(e):
+  return isinstance(e, (OSError, EOFError)) or (type(e).__name__ == 'VisaIOError') # socket errors and timeouts, pyvisa's
+
+class pooledConnection:
+  checkAfter = 1 # s, a connection that's been idle for longer than this gets checked before it's used
+
+  def __init__(self, address, timeout=1000, termination='\n', setup=True):
+    self.openParams = {'resource_name': address, 'timeout': timeout, '_read_termination': termination}
+    self.setup = setup # run setup2450 on every new connection
+    self.sm = None
+    self.lock = threading.RLock() # one user at a time
+    self.lastGood = 0 # time.monotonic() of the last time the connection was known to work
+    self.healthy = False
+    self.nConnects = 0
+    self.keepAliveThread = None
+    self.keepAliveStop = threading.Event()
+
+  @property
+  def address(self):
+    return self.openParams['resource_name']
+
+  def __enter__(self):
+    self.lock.acquire()
+    try:
+      return self.acquire()
+    except:
+      self.lock.release()
+      raise
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    try:
+      if exc_type is None:
+        self.lastGood = time.monotonic()
+      elif isConnectionError(exc_value):
+        print('Lost the connection to {:} ({:}), it will be reopened next time'.format(self.address, exc_value))
+        self.healthy = False
+    finally:
+      self.lock.release()
+    return False
+
+  # returns the connection, (re)connecting first if it's not known to be working, raises ConnectionError if it can't
+  # hold the lock (use "with") while using what this returns
+  def acquire(self):
+    with self.lock:
+      if self.healthy and (time.monotonic() - self.lastGood > self.checkAfter):
+        self.healthy = self.check()
+      if not self.healthy:
+        if not self.reconnect():
+          raise ConnectionError('Unable to connect to {:}'.format(self.address))
+      return self.sm
+
+  # the cheap health check: can we read the status byte?
+  def check(self):
+    with self.lock:
+      if self.sm is None:
+        return False
+      try:
+        k2450.readSTB(self.sm)
+      except Exception as e:
+        if not isConnectionError(e):
+          raise
+        return False
+      self.lastGood = time.monotonic()
+      return True
+
+  # drops the current connection (if any) and opens a new one, returns True on success
+  # the new one gets setup2450 and then the settings the old one had been asked for
+  def reconnect(self):
+    with self.lock:
+      settings = {}
+      if self.sm is not None:
+        settings = dict(k2450.settingsRequested(self.sm))
+        self._drop(orderly=self.healthy)
+      self.healthy = False
+      if 'SOCKET' in self.address:
+        rm = None
+      else:
+        rm = k2450.resourceManager('@py') # select pyvisa-py (pure python) backend
+      sm = k2450.visaConnect(rm, self.openParams)
+      if sm is None:
+        return False
+      try:
+        if self.setup and (not k2450.setup2450(sm)):
+          raise ValueError('setup2450 failed')
+        if len(settings) > 0:
+          print('Restoring {:} settings on {:}'.format(len(settings), self.address))
+          with k2450.commandBatch(sm) as b:
+            for (key, command) in settings.items():
+              b.set(command, key=key)
+      except Exception as e:
+        print('Unable to set up {:}: {:}'.format(self.address, e))
+        self.sm = sm
+        self._drop(orderly=False)
+        return False
+      self.sm = sm
+      self.healthy = True
+      self.lastGood = time.monotonic()
+      self.nConnects = self.nConnects + 1
+      return True
+
+  # runs fun(sm, *args, **kwargs) with the connection, if the link drops it reconnects and runs it again
+  # (up to retries times) so fun should be safe to repeat
+  def run(self, fun, *args, retries=1, **kwargs):
+    while True:
+      try:
+        with self as sm:
+          return fun(sm, *args, **kwargs)
+      except Exception as e:
+        if (not isConnectionError(e)) or (retries <= 0):
+          raise
+        retries = retries - 1
+
+  # closes the connection for good (well, until it's next used)
+  def close(self):
+    self.stopKeepAlive()
+    with self.lock:
+      self._drop(orderly=self.healthy)
+      self.healthy = False
+
+  # forgets the connection, with orderly it's closed properly (output off), otherwise it's just let go
+  def _drop(self, orderly):
+    sm = self.sm
+    self.sm = None
+    if sm is None:
+      return
+    if orderly:
+      try:
+        sm.close()
+      except Exception:
+        orderly = False
+    if isinstance(sm, k2450.socketConn):
+      sm.disconnect()
+    elif not orderly:
+      try:
+        sm.close()
+      except Exception:
+        pass
+
+  # checks on the connection every interval seconds in a background thread, reconnecting it when it's broken
+  # (but only while nobody else is using it and it's been idle for at least interval)
+  def keepAlive(self, interval=10):
+    self.stopKeepAlive()
+    self.keepAliveStop.clear()
+    def keeper():
+      while not self.keepAliveStop.wait(interval):
+        if not self.lock.acquire(blocking=False):
+          continue # busy, so it's alive
+        try:
+          if (self.sm is not None) and (time.monotonic() - self.lastGood >= interval):
+            self.healthy = self.check()
+            if not self.healthy:
+              print('{:} stopped answering, reconnecting'.format(self.address))
+              self.reconnect()
+        except Exception as e:
+          print('Keep alive for {:} failed: {:}'.format(self.address, e))
+        finally:
+          self.lock.release()
+    self.keepAliveThread = threading.Thread(target=keeper, daemon=True)
+    self.keepAliveThread.start()
+
+  def stopKeepAlive(self):
+    if self.keepAliveThread is not None:
+      self.keepAliveStop.set()
+      if self.keepAliveThread is not threading.current_thread():
+        self.keepAliveThread.join()
+      self.keepAliveThread = None
+
+# the connections, by address
+class connectionPool:
+  def __init__(self):
+    self.connections = {}
+    self.lock = threading.Lock()
+
+  # the shared connection to address (made on first use, the other parameters only count then)
+  def connection(self, address, timeout=1000, termination='\n', setup=True):
+    with self.lock:
+      if address not in self.connections:
+        self.connections[address] = pooledConnection(address, timeout, termination, setup)
+      return self.connections[address]
+
+  def closeAll(self):
+    with self.lock:
+      connections = list(self.connections.values())
+    for c in connections:
+      try:
+        c.close()
+      except Exception as e:
+        print('Unable to close {:}: {:}'.format(c.address, e))
+
+defaultPool = connectionPool() # the one everything in this process shares
+
+def connection(address, timeout=1000, termination='\n', setup=True):
+  return defaultPool.connection(address, timeout, termination, setup)
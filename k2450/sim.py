@@ -0,0 +1,535 @@
+# a simulated Keithley 2450 that speaks (the subset of) SCPI this project uses over TCP
+# so k2450 can be exercised, benchmarked and debugged without real hardware
+# the "device under test" is a resistor with some gaussian noise on its readings and
+# readings take as long as their NPLC (and autozero/offset compensation) say they should
+# run it standalone:
+#   python3 -m k2450.sim --port 5025 --resistance 5000
+# then connect to TCPIP::127.0.0.1::5025::SOCKET
+# or in process:
+#   server = k2450.sim.simulated2450(port=0, timeScale=0) # port 0 picks a free port, timeScale 0 never sleeps
+#   server.start()
+#   ... connect to ('127.0.0.1', server.port) ...
+#   server.stop()
+import argparse
+import math
+import random
+import socketserver
+import struct
+import threading
+import time
+
+import k2450
+
+idnString = 'KEITHLEY INSTRUMENTS,MODEL 2450,SIMULATED,1.5.0g'
+voltageRanges = [0.02, 0.2, 2, 20, 200] # V
+currentRanges = [1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1] # A
+autoDelay = 0.001 # s, source delay used when it's on auto
+readingOverhead = 0.0005 # s, per reading on top of the integration time
+
+# what the settings are after *RST, keyed by k2450.scpiKey
+resetSettings = {
+  'SOUR:FUNC': 'VOLT',
+  'SENS:FUNC': 'CURR',
+  'SENS:NPLC': '1',
+  'SENS:COUN': '1',
+  'OUTP': 'OFF',
+  'FORM:DATA': 'ASCII',
+  'SOUR:CURR:VLIM': '21',
+  'SOUR:VOLT:ILIM': '0.000105',
+  'SOUR:CURR:LEV': '0',
+  'SOUR:VOLT:LEV': '0',
+}
+
+# splits a message on sep, leaving anything in double quotes alone
+def splitOutsideQuotes(string, sep):
+  parts = []
+  current = ''
+  quoted = False
+  for c in string:
+    if c == '"':
+      quoted = not quoted
+    if (c == sep) and not quoted:
+      parts.append(current)
+      current = ''
+    else:
+      current += c
+  parts.append(current)
+  return parts
+
+def isOn(value):
+  return value.strip().upper() in ('ON', '1')
+
+# a normalized function name from things like '"VOLT"', 'voltage' or 'CURRent'
+def functionName(value):
+  return k2450.scpiKey(value.strip().strip('"'))
+
+# picks the smallest range that fits value
+def pickRange(ranges, value):
+  for r in ranges:
+    if abs(value) <= r:
+      return r
+  return ranges[-1]
+
+# the instrument itself, shared by all connections to the server
+class instrument:
+  def __init__(self, resistance=5000, noise=1e-4, lineFrequency=50, timeScale=1, seed=None):
+    self.resistance = resistance # ohms
+    self.noise = noise # relative standard deviation of the readings
+    self.lineFrequency = lineFrequency # Hz
+    self.timeScale = timeScale # multiplies every delay, 0 makes everything instant
+    self.random = random.Random(seed)
+    self.lock = threading.RLock()
+    self.idle = threading.Event() # set while the trigger model isn't running
+    self.idle.set()
+    self.abort = False
+    self.reset()
+    self.ese = 0
+    self.sre = 0
+
+  def reset(self):
+    with self.lock:
+      self.settings = dict(resetSettings)
+      self.sweep = None
+      self.buffer = [] # (source, reading, source status, status) tuples
+      self.clear()
+
+  # *CLS
+  def clear(self):
+    with self.lock:
+      self.esr = 0
+      self.errors = [] # (code, message)
+      self.events = [] # (code, message, type)
+      self.opcPending = False
+
+  def pushError(self, code, message):
+    with self.lock:
+      self.errors.append((code, message))
+      self.events.append((code, message, 2))
+      if code <= -100 and code > -200:
+        self.esr |= k2450.ESE_CME
+      elif code <= -200 and code > -300:
+        self.esr |= k2450.ESE_EXE
+      else:
+        self.esr |= k2450.ESE_DDE
+
+  def stb(self):
+    with self.lock:
+      byte = 0
+      if len(self.errors) > 0:
+        byte |= k2450.EAV
+      if self.esr & self.ese:
+        byte |= k2450.ESB
+      if byte & self.sre:
+        byte |= k2450.MSS
+      return byte
+
+  def sleep(self, seconds):
+    if self.timeScale > 0 and seconds > 0:
+      time.sleep(seconds*self.timeScale)
+
+  def sourceFunction(self):
+    return functionName(self.settings['SOUR:FUNC'])
+
+  def senseFunction(self):
+    return functionName(self.settings['SENS:FUNC'])
+
+  def setting(self, key, default):
+    return self.settings.get(key, default)
+
+  # how long one reading takes (seconds, before timeScale)
+  def readingTime(self):
+    sense = self.senseFunction()
+    t = float(self.setting('SENS:NPLC', '1'))/self.lineFrequency
+    if isOn(self.setting('SENS:{:}:AZER'.format(sense), 'ON')):
+      t = t*2 # a reference and zero measurement for every reading
+    if isOn(self.setting('SENS:{:}:OCOM'.format(sense), 'OFF')):
+      t = t*2 # one reading with the source on and one with it off
+    return t + readingOverhead
+
+  # the source's delay before each reading (seconds, before timeScale)
+  def sourceDelay(self, sweepDelay=None):
+    source = self.sourceFunction()
+    if sweepDelay is not None:
+      if sweepDelay < 0:
+        return autoDelay
+      else:
+        return sweepDelay
+    if isOn(self.setting('SOUR:{:}:DEL:AUTO'.format(source), 'ON')):
+      return autoDelay
+    return float(self.setting('SOUR:{:}:DEL'.format(source), '0'))
+
+  def sourceLevel(self):
+    source = self.sourceFunction()
+    for key in ('SOUR:{:}'.format(source), 'SOUR:{:}:LEV'.format(source), 'SOUR:{:}:LEV:IMM'.format(source), 'SOUR:{:}:LEV:IMM:AMPL'.format(source)):
+      if key in self.settings:
+        return float(self.settings[key])
+    return 0.0
+
+  def setSourceLevel(self, value, source=None):
+    if source is None:
+      source = self.sourceFunction()
+    for key in [k for k in self.settings if k.startswith('SOUR:{:}'.format(source)) and (k.split(':')[2:] in ([], ['LEV'], ['LEV','IMM'], ['LEV','IMM','AMPL']))]:
+      del self.settings[key]
+    self.settings['SOUR:{:}:LEV'.format(source)] = repr(value)
+
+  # makes one reading with the source at level, returns (source, reading, source status, status)
+  def measure(self, level):
+    source = self.sourceFunction()
+    sense = self.senseFunction()
+    sourstat = k2450.SS_MES
+    if isOn(self.settings['OUTP']):
+      sourstat |= k2450.SS_OON
+    else:
+      level = 0.0
+    if isOn(self.setting('SENS:{:}:RSEN'.format(sense), 'OFF')):
+      sourstat |= k2450.SS_4WS
+    if source == 'CURR':
+      i = level
+      v = i*self.resistance
+      vLim = float(self.setting('SOUR:CURR:VLIM', '21'))
+      if abs(v) > vLim:
+        v = math.copysign(vLim, v)
+        i = v/self.resistance
+        sourstat |= k2450.SS_LIM
+      sourceValue = i
+    else:
+      v = level
+      i = v/self.resistance
+      iLim = float(self.setting('SOUR:VOLT:ILIM', '0.000105'))
+      if abs(i) > iLim:
+        i = math.copysign(iLim, i)
+        v = i*self.resistance
+        sourstat |= k2450.SS_LIM
+      sourceValue = v
+    v = v*(1 + self.random.gauss(0, self.noise))
+    i = i*(1 + self.random.gauss(0, self.noise))
+    if sense == 'VOLT':
+      if self.setting('SENS:VOLT:UNIT', 'VOLT').upper().startswith('OHM'):
+        reading = v/i if i != 0 else float('nan')
+      else:
+        reading = v
+    elif sense == 'CURR':
+      reading = i
+    else: # RES
+      reading = self.resistance*(1 + self.random.gauss(0, self.noise))
+    return (sourceValue, reading, sourstat, 0)
+
+  # runs the trigger model (in its own thread) for the given list of source levels
+  def runModel(self, levels, sweepDelay=None):
+    self.idle.wait() # only one trigger model at a time
+    self.idle.clear()
+    self.abort = False
+    def model():
+      try:
+        for level in levels:
+          if self.abort:
+            break
+          with self.lock:
+            if level is not None:
+              self.setSourceLevel(level)
+            delay = self.sourceDelay(sweepDelay) + self.readingTime()
+          self.sleep(delay)
+          with self.lock:
+            self.buffer.append(self.measure(self.sourceLevel()))
+      finally:
+        with self.lock:
+          self.idle.set()
+          self.operationComplete()
+    threading.Thread(target=model, daemon=True).start()
+
+  # sets OPC in the ESR if someone asked for it and we're not busy
+  def operationComplete(self):
+    with self.lock:
+      if self.opcPending and self.idle.is_set():
+        self.esr |= k2450.ESE_OPC
+        self.opcPending = False
+
+  # the level list for the loaded sweep
+  def sweepLevels(self):
+    start, stop, points, delay, count, dual = self.sweep
+    if points > 1:
+      levels = [start + (stop - start)*n/(points - 1) for n in range(points)]
+    else:
+      levels = [start]
+    if dual:
+      levels = levels + levels[-2::-1]
+    return levels*count, delay
+
+  def traceData(self, args):
+    start = int(args[0])
+    end = int(args[1])
+    elements = [a.strip().upper() for a in args[3:]] or ['READ']
+    with self.lock:
+      if start < 1 or end > len(self.buffer) or start > end:
+        self.pushError(-222, 'Data out of range')
+        return None
+      rows = self.buffer[start-1:end]
+    values = []
+    for row in rows:
+      for element in elements:
+        if element.startswith('SOURSTAT'):
+          values.append(row[2])
+        elif element.startswith('STAT'):
+          values.append(row[3])
+        elif element.startswith('SOUR'):
+          values.append(row[0])
+        elif element.startswith('READ'):
+          values.append(row[1])
+        else:
+          values.append(0)
+    if self.settings['FORM:DATA'].upper().startswith('REAL'):
+      return b'#0' + struct.pack('<{:}d'.format(len(values)), *[float(x) for x in values])
+    else:
+      return ','.join([str(int(x)) if isinstance(x, int) else '{:.9e}'.format(x) for x in values]).encode()
+
+  # handles one SCPI command (header plus arguments), returns the response (bytes) or None
+  def command(self, cmd):
+    cmd = cmd.strip()
+    if cmd == '':
+      return None
+    header, sep, argString = cmd.partition(' ')
+    argString = argString.strip()
+    query = header.endswith('?')
+    header = header.rstrip('?').upper()
+
+    if header.startswith('*'): # common commands
+      if header == '*RST':
+        self.abort = True
+        self.idle.wait()
+        self.reset()
+      elif header == '*CLS':
+        self.clear()
+      elif header == '*IDN' and query:
+        return idnString.encode()
+      elif header == '*ESE':
+        if query:
+          return str(self.ese).encode()
+        self.ese = int(argString)
+      elif header == '*SRE':
+        if query:
+          return str(self.sre).encode()
+        self.sre = int(argString)
+      elif header == '*ESR' and query:
+        with self.lock:
+          esr = self.esr
+          self.esr = 0
+        return str(esr).encode()
+      elif header == '*STB' and query:
+        return str(self.stb()).encode()
+      elif header == '*OPC':
+        if query:
+          self.idle.wait()
+          return b'1'
+        with self.lock:
+          self.opcPending = True
+          self.operationComplete()
+      elif header == '*WAI':
+        self.idle.wait()
+      elif header == '*LANG':
+        if query:
+          return b'SCPI'
+      elif header == '*TRG':
+        pass
+      else:
+        self.pushError(-113, 'Undefined header')
+      return None
+
+    key = k2450.scpiKey(header)
+    args = [a.strip() for a in splitOutsideQuotes(argString, ',')] if argString != '' else []
+    with self.lock:
+      if key in ('SYST:ERR:COUN', 'SYST:EVEN:COUN') and query:
+        if key == 'SYST:ERR:COUN':
+          return str(len(self.errors)).encode()
+        return str(len(self.events)).encode()
+      if key in ('SYST:ERR:NEXT', 'SYST:ERR') and query:
+        if len(self.errors) == 0:
+          return b'0,"No error"'
+        code, message = self.errors.pop(0)
+        return '{:},"{:}"'.format(code, message).encode()
+      if key == 'SYST:EVEN:NEXT' and query:
+        if len(self.events) == 0:
+          return b'0,"No error;0;1970/01/01 00:00:00.000"'
+        code, message, eventType = self.events.pop(0)
+        return '{:},"{:};{:};{:}"'.format(code, message, eventType, time.strftime('%Y/%m/%d %H:%M:%S.000')).encode()
+      if key == 'SYST:LFR' and query:
+        return repr(self.lineFrequency).encode()
+      if key == 'SYST:CLE':
+        self.errors = []
+        self.events = []
+        return None
+      if key == 'TRAC:CLE':
+        self.buffer = []
+        return None
+      if key in ('TRAC:ACT', 'TRAC:ACT:END') and query:
+        return str(len(self.buffer)).encode()
+      if key == 'TRAC:ACT:STAR' and query:
+        return b'1' if len(self.buffer) > 0 else b'0'
+      if key == 'TRAC:DATA' and query:
+        if len(args) < 2: # just the last reading
+          args = [str(len(self.buffer)), str(len(self.buffer))] + args
+        return self.traceData(args)
+      if key == 'SENS:AZER:ONCE':
+        self.sleep(float(self.setting('SENS:NPLC', '1'))/self.lineFrequency*2)
+        return None
+      if key.startswith('SOUR:SWE:') and key.endswith(':LIN') and not query:
+        if len(args) < 3:
+          self.pushError(-109, 'Missing parameter')
+          return None
+        self.settings['SOUR:FUNC'] = key.split(':')[2]
+        delay = float(args[3]) if len(args) > 3 else -1
+        count = int(args[4]) if len(args) > 4 else 1
+        dual = isOn(args[7]) if len(args) > 7 else False
+        self.sweep = (float(args[0]), float(args[1]), int(args[2]), delay, count, dual)
+        self.setSourceLevel(float(args[0]))
+        return None
+      if key == 'ROUT:TERM' and query:
+        return self.setting(key, 'FRON').encode()
+      if key == 'OUTP:STAT':
+        key = 'OUTP'
+      if key == 'OUTP' and query:
+        return b'1' if isOn(self.settings['OUTP']) else b'0'
+      if query and key.endswith(':RANG'): # ranges follow the source level or last reading when not set
+        if key in self.settings:
+          return self.settings[key].encode()
+        if len(self.buffer) > 0:
+          last = self.buffer[-1]
+        else:
+          last = self.measure(self.sourceLevel())
+        if key == 'SOUR:{:}:RANG'.format(self.sourceFunction()):
+          value = last[0]
+        else:
+          value = last[1]
+        if ':VOLT:' in key + ':':
+          return repr(pickRange(voltageRanges, value)).encode()
+        return repr(pickRange(currentRanges, value)).encode()
+      if query and key.startswith('SOUR:') and key.split(':')[2:] in ([], ['LEV'], ['LEV','IMM'], ['LEV','IMM','AMPL']):
+        return repr(self.sourceLevel()).encode()
+      if not query and key.startswith('SOUR:') and key.split(':')[1] in ('CURR', 'VOLT') and key.split(':')[2:] in ([], ['LEV'], ['LEV','IMM'], ['LEV','IMM','AMPL']):
+        self.setSourceLevel(float(args[0]), key.split(':')[1]) # each source function has its own level
+        return None
+    # the trigger model commands wait (outside the lock) for any running model
+    if key in ('INIT', 'INIT:IMM') and not query:
+      if self.sweep is None:
+        levels = [None]*int(self.setting('SENS:COUN', '1'))
+        self.runModel(levels)
+      else:
+        levels, delay = self.sweepLevels()
+        self.runModel(levels, delay)
+      return None
+    if key == 'TRAC:TRIG' and not query:
+      self.runModel([None]*int(self.setting('SENS:COUN', '1')))
+      return None
+    if key == 'ABOR':
+      self.abort = True
+      return None
+
+    # everything else is just a setting we remember
+    with self.lock:
+      if query:
+        if key in self.settings:
+          return self.settings[key].encode()
+        self.pushError(-113, 'Undefined header')
+        return None
+      if len(args) == 0:
+        self.pushError(-109, 'Missing parameter')
+        return None
+      self.settings[key] = argString
+      if key.endswith(':AUTO') and isOn(argString): # e.g. RANG:AUTO ON forgets the fixed range
+        self.settings.pop(key.rsplit(':', 1)[0], None)
+      if key == 'SENS:FUNC' or key == 'SOUR:FUNC':
+        self.settings[key] = functionName(argString)
+      if key == 'SOUR:FUNC':
+        self.sweep = None # changing the source function throws away the sweep
+    return None
+
+  # handles one message (commands separated by ';'), returns the response message or None
+  def message(self, msg):
+    responses = []
+    for cmd in splitOutsideQuotes(msg, ';'):
+      response = self.command(cmd)
+      if response is not None:
+        responses.append(response)
+    if len(responses) == 0:
+      return None
+    return b';'.join(responses) + b'\n'
+
+class handler(socketserver.StreamRequestHandler):
+  disable_nagle_algorithm = True # answer small queries straight away
+
+  def handle(self):
+    inst = self.server.instrument
+    for line in self.rfile:
+      try:
+        response = inst.message(line.decode('utf-8', 'replace').rstrip('\r\n'))
+      except Exception as e: # a real instrument doesn't fall over on garbage either
+        inst.pushError(-100, 'Command error: {:}'.format(e))
+        response = None
+      if response is not None:
+        self.wfile.write(response)
+
+class server(socketserver.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+# accepts connections and hangs up straight away, like the ports k2450.visaConnect pokes when it can't connect
+class probeHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    pass
+
+# a simulated 2450 listening on host:port
+# probePorts are extra ports that just accept connections (so visaConnect's port probing finds them)
+class simulated2450:
+  def __init__(self, host='127.0.0.1', port=5025, probePorts=[], **instrumentArgs):
+    self.instrument = instrument(**instrumentArgs)
+    self.server = server((host, port), handler)
+    self.server.instrument = self.instrument
+    self.host, self.port = self.server.server_address[:2]
+    self.probeServers = [server((host, p), probeHandler) for p in probePorts]
+    self.threads = []
+
+  # starts serving in background threads
+  def start(self):
+    for s in [self.server] + self.probeServers:
+      thread = threading.Thread(target=s.serve_forever, daemon=True)
+      thread.start()
+      self.threads.append(thread)
+    return self
+
+  def stop(self):
+    for s in [self.server] + self.probeServers:
+      s.shutdown()
+      s.server_close()
+
+  def address(self):
+    return 'TCPIP::{:}::{:}::SOCKET'.format(self.host, self.port)
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+    return False
+
+def main():
+  parser = argparse.ArgumentParser(description='Simulated Keithley 2450 sourcemeter (SCPI over TCP)')
+  parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+  parser.add_argument('--port', type=int, default=5025, help='TCP port to listen on')
+  parser.add_argument('--probe-ports', dest='probePorts', type=int, nargs='*', default=[], help='extra ports that just accept connections, e.g. 5030 111 1024 for visaConnect\'s port probing')
+  parser.add_argument('--resistance', type=float, default=5000, help='resistance of the simulated sample [ohm]')
+  parser.add_argument('--noise', type=float, default=1e-4, help='relative noise on readings')
+  parser.add_argument('--line-frequency', dest='lineFrequency', type=float, default=50, help='power line frequency [Hz]')
+  parser.add_argument('--time-scale', dest='timeScale', type=float, default=1, help='multiplies all simulated delays (0 for instant)')
+  args = parser.parse_args()
+  sim = simulated2450(args.host, args.port, args.probePorts, resistance=args.resistance, noise=args.noise, lineFrequency=args.lineFrequency, timeScale=args.timeScale)
+  print('Simulated 2450 listening at', sim.address())
+  sim.start()
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    sim.stop()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,199 @@
+# drives several sourcemeters (e.g. on parallel probe stations) from one process
+# each station owns its connection and runs its jobs one at a time, while the stations run concurrently in a
+# thread pool, since talking to an instrument is almost all waiting, N stations take about as long as one
+# usage:
+#   manager = k2450.stations.stationManager()
+#   manager.add('A', 'TCPIP::192.168.1.204::5025::SOCKET')
+#   manager.add('B', 'TCPIP::192.168.1.205::5025::SOCKET')
+#   manager.connectAll()
+#   results = manager.sweepAll(sweepParams) # {'A': {'ok': True, 'i': ..., 'v': ..., ...}, 'B': {...}}
+#   manager.closeAll()
+# the k2450 functions print as they go, so with several stations their chatter interleaves
+import concurrent.futures
+import time
+
+import k2450
+import k2450.pool
+
+# one sourcemeter and its (shared, self healing, see k2450.pool) connection
+class station:
+  def __init__(self, name, address, timeout=1000, termination='\n'):
+    self.name = name
+    self.conn = k2450.pool.connection(address, timeout, termination)
+
+  @property
+  def address(self):
+    return self.conn.address
+
+  @property
+  def openParams(self):
+    return self.conn.openParams
+
+  # the connection itself, valid while a job runs (see run)
+  @property
+  def sm(self):
+    return self.conn.sm
+
+  @property
+  def connected(self):
+    return self.conn.sm is not None
+
+  # connects (and with setup, runs setup2450), returns True on success
+  def connect(self, setup=True):
+    self.conn.setup = setup
+    try:
+      with self.conn:
+        return True
+    except ConnectionError:
+      return False
+
+  def close(self):
+    self.conn.close()
+
+  # {'idn': ..., 'lineFrequency': ...} see k2450.instrumentInfo
+  def info(self):
+    return k2450.instrumentInfo(self.sm)
+
+  # turns the source output off (before the probes move, say) and returns once it is
+  # through a batch so a reconnect keeps it off (see k2450.pool)
+  def outputOff(self):
+    with k2450.commandBatch(self.sm, checkErrors=False) as b:
+      b.write('OUTPut OFF')
+      b.query('*OPC?')
+
+  # calls fun(self, *args, **kwargs) with the connection to ourselves (reopened first if it dropped), returns what it returns
+  def run(self, fun, *args, **kwargs):
+    with self.conn:
+      return fun(self, *args, **kwargs)
+
+  # configures, runs and fetches one sweep (see k2450.configureSweep), returns a dict with what happened
+  def sweep(self, sweepParams):
+    result = {'station': self.name, 'address': self.address, 'ok': False, 'start': time.time()}
+    try:
+      if not k2450.configureSweep(self.sm, sweepParams):
+        result['error'] = 'configure failed'
+      elif not k2450.doSweep(self.sm):
+        result['error'] = 'sweep failed'
+      else:
+        i, v, i2, v2 = k2450.fetchSweepData(self.sm, sweepParams)
+        if i is None:
+          result['error'] = 'fetch failed'
+        else:
+          result.update({'i': i, 'v': v, 'i2': i2, 'v2': v2, 'ok': True})
+    finally:
+      result['end'] = time.time()
+    return result
+
+  # rSweep's preliminary check then the sweep it sets up (see k2450.rSweepStatus), returns a dict with what happened
+  def rSweep(self, rsOpt):
+    result = {'station': self.name, 'address': self.address, 'ok': False, 'start': time.time()}
+    try:
+      result['rsStatus'] = k2450.rSweepStatus(self.sm, rsOpt)
+      if result['rsStatus'] != k2450.RS_OK:
+        result['error'] = 'preliminary check failed'
+      elif not k2450.doSweep(self.sm):
+        result['error'] = 'sweep failed'
+      else:
+        i, v, i2, v2 = k2450.fetchSweepData(self.sm, rsOpt)
+        if i is None:
+          result['error'] = 'fetch failed'
+        else:
+          result.update({'i': i, 'v': v, 'i2': i2, 'v2': v2, 'ok': True})
+    finally:
+      result['end'] = time.time()
+    return result
+
+# the stations and the threads that drive them
+class stationManager:
+  def __init__(self, maxWorkers=None):
+    self.stations = {} # {name: station}, in the order they were added
+    self.maxWorkers = maxWorkers # None for one thread per station
+    self.pool = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.closeAll()
+
+  def add(self, name, address, timeout=1000, termination='\n'):
+    if name in self.stations:
+      raise ValueError('There is already a station called {:}'.format(name))
+    self.stations[name] = station(name, address, timeout, termination)
+    if (self.pool is not None) and (self.maxWorkers is None): # the next jobs get a pool with a thread for this one too
+      self.pool.shutdown(wait=False)
+      self.pool = None
+    return self.stations[name]
+
+  def __getitem__(self, name):
+    return self.stations[name]
+
+  def __len__(self):
+    return len(self.stations)
+
+  def _pool(self):
+    if self.pool is None:
+      if self.maxWorkers is None:
+        nWorkers = max(len(self.stations), 1)
+      else:
+        nWorkers = self.maxWorkers
+      self.pool = concurrent.futures.ThreadPoolExecutor(nWorkers, thread_name_prefix='station')
+    return self.pool
+
+  # starts fun(station, *args, **kwargs) on each of the named stations (all by default)
+  # returns {name: concurrent.futures.Future}
+  def submit(self, fun, *args, names=None, **kwargs):
+    if names is None:
+      names = list(self.stations)
+    return {n: self._pool().submit(self.stations[n].run, fun, *args, **kwargs) for n in names}
+
+  # runs fun(station, *args, **kwargs) on the stations concurrently and waits for them all
+  # returns {name: what fun returned}, or the exception it raised
+  def runAll(self, fun, *args, names=None, **kwargs):
+    futures = self.submit(fun, *args, names=names, **kwargs)
+    results = {}
+    for (name, future) in futures.items():
+      try:
+        results[name] = future.result()
+      except Exception as e:
+        print('Error: station {:} failed: {:}'.format(name, e))
+        results[name] = e
+    return results
+
+  # connects to (and sets up) all the stations, returns {name: True on success}
+  def connectAll(self, setup=True):
+    return self.runAll(lambda s: s.connect(setup))
+
+  # a sweep on every connected station, perStation has {name: sweepParams} for the ones that differ
+  # returns {name: station.sweep's result}
+  def sweepAll(self, sweepParams, perStation={}):
+    names = [n for n in self.stations if self.stations[n].connected]
+    futures = {n: self._pool().submit(self.stations[n].run, station.sweep, perStation.get(n, sweepParams)) for n in names}
+    return self._collect(futures)
+
+  # rSweep and its sweep on every connected station, perStation as for sweepAll
+  def rSweepAll(self, rsOpt, perStation={}):
+    names = [n for n in self.stations if self.stations[n].connected]
+    futures = {n: self._pool().submit(self.stations[n].run, station.rSweep, perStation.get(n, rsOpt)) for n in names}
+    return self._collect(futures)
+
+  # waits for the futures, a station that raised gets a result saying why
+  def _collect(self, futures):
+    results = {}
+    for (name, future) in futures.items():
+      try:
+        results[name] = future.result()
+      except Exception as e:
+        print('Error: station {:} failed: {:}'.format(name, e))
+        results[name] = {'station': name, 'address': self.stations[name].address, 'ok': False, 'error': repr(e)}
+    return results
+
+  def closeAll(self):
+    for s in self.stations.values():
+      try:
+        s.close()
+      except Exception:
+        pass
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
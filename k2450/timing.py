@@ -0,0 +1,166 @@
+# how long a sweep takes, learned from the sweeps we've timed
+# the model is linear in a handful of coefficients:
+#   duration = start + nReadings*(perReading + integration*tInt*k + delay*stepDelay + autoDelay*[auto delay] + autoRange*[autorange])
+# where tInt = NPLC/line frequency and k counts the integrations per reading (x2 for autozero, x2 for
+# offset compensation), so a new instrument starts from what the 2450 manual says (priorMean, with
+# generous priorSigma uncertainties) and every timed sweep narrows the coefficients down for that instrument
+# the timeouts then follow from the prediction and its uncertainty instead of a fudge factor
+# usage:
+#   timer = k2450.timing.sweepTimer(k2450.timing.defaultPath) # or no path to keep it in memory
+#   config = k2450.timing.sweepConfig(sweepParams, lineFrequency=50)
+#   seconds, sigma = timer.predict(idn, config)
+#   ... time the sweep ...
+#   timer.record(idn, config, seconds)
+import json
+import math
+import os
+import threading
+
+import numpy
+
+defaultPath = os.path.join(os.path.expanduser('~'), '.k2450-timing.json') # where rs-tool keeps its timings
+defaultLineFrequency = 50 # Hz, for when we don't know the instrument's
+
+coefficientNames = ['start', 'perReading', 'integration', 'delay', 'autoDelay', 'autoRange']
+priorMean = numpy.array([0.05, 0.002, 1.0, 1.0, 0.003, 0.01]) # s, s, -, -, s, s
+priorSigma = numpy.array([0.5, 0.01, 0.5, 0.2, 0.01, 0.02])
+relativeNoise = 0.02 # how repeatable a sweep's duration is...
+absoluteNoise = 0.05 # s ...and how well we can time it (waitForComplete's polling)
+nSigma = 4 # timeouts are this many standard deviations past the expected duration
+minTimeout = 1000 # ms
+maxObservations = 200 # per instrument, the oldest are forgotten first
+
+# the settings that decide how long a sweep takes, from configureSweep's sweepParams or rSweep's rsOpt
+# nReadings overrides the count implied by nPoints and dual (e.g. for rSweep's preliminary readings)
+def sweepConfig(params, lineFrequency=None, nReadings=None):
+  config = {}
+  dual = params.get('dual', 'ON') in ('ON', True)
+  if nReadings is None:
+    if dual:
+      nReadings = int(params['nPoints'])*2-1
+    else:
+      nReadings = int(params['nPoints'])
+  config['nReadings'] = nReadings
+  config['nplc'] = float(params['nplc'])
+  if lineFrequency is None:
+    lineFrequency = defaultLineFrequency
+  config['lineFrequency'] = float(lineFrequency)
+  config['autoZero'] = bool(params.get('autoZero', True))
+  config['oCom'] = bool(params.get('oCom', False))
+  config['stepDelay'] = float(params.get('stepDelay', -1))
+  config['autoRange'] = str(params.get('rangeType', 'BEST')).upper() == 'AUTO'
+  return config
+
+# the row of the model's design matrix for one configuration
+def features(config):
+  n = config['nReadings']
+  tInt = config['nplc']/config['lineFrequency']
+  k = 1
+  if config['autoZero']:
+    k = k*2 # a reference and a zero reading go with every reading
+  if config['oCom']:
+    k = k*2 # one reading with the source on, one with it off
+  if config['stepDelay'] < 0: # auto delay
+    delay = 0
+    auto = 1
+  else:
+    delay = config['stepDelay']
+    auto = 0
+  return numpy.array([1, n, n*tInt*k, n*delay, n*auto, n*float(config['autoRange'])])
+
+# the noise we expect on a timing of about this many seconds
+def noise(seconds):
+  return relativeNoise*abs(seconds) + absoluteNoise
+
+class sweepTimer:
+  def __init__(self, path=None):
+    self.lock = threading.Lock() # sweeps on different instruments may finish at once
+    self.observations = {} # {instrument: [[config, seconds], ...]}
+    self.fits = {} # {instrument: (coefficients, covariance)}, dropped when new observations come in
+    self.path = None
+    if path is not None:
+      self.load(path)
+
+  # reads the timings stored in path (if it exists) and saves new ones there from now on
+  def load(self, path):
+    with self.lock:
+      self.path = path
+      if os.path.exists(path):
+        try:
+          with open(path) as f:
+            stored = json.load(f)
+        except ValueError:
+          print('Warning: ignoring the unreadable sweep timings in {:}'.format(path))
+          stored = {}
+        for (instrument, observations) in stored.items():
+          self.observations.setdefault(instrument, [])
+          self.observations[instrument] = (observations + self.observations[instrument])[-maxObservations:]
+        self.fits = {}
+
+  def save(self):
+    with self.lock:
+      self._save()
+
+  def _save(self):
+    if self.path is None:
+      return
+    temp = self.path + '.tmp' # so a crash can't leave a half written file behind
+    with open(temp, 'w') as f:
+      json.dump(self.observations, f)
+    os.replace(temp, self.path)
+
+  # remembers that a sweep with this config took this many seconds on this instrument (its *IDN? string)
+  def record(self, instrument, config, seconds):
+    with self.lock:
+      observations = self.observations.setdefault(str(instrument), [])
+      observations.append([config, seconds])
+      del(observations[:-maxObservations])
+      self.fits.pop(str(instrument), None)
+      try:
+        self._save()
+      except OSError as e:
+        print('Warning: unable to save the sweep timings to {:}: {:}'.format(self.path, e))
+
+  # the coefficients (and their covariance) for this instrument, a bayesian linear fit from the prior
+  def fit(self, instrument):
+    instrument = str(instrument)
+    with self.lock:
+      if instrument in self.fits:
+        return self.fits[instrument]
+      observations = self.observations.get(instrument, [])
+      precision = numpy.diag(1/priorSigma**2)
+      weighted = priorMean/priorSigma**2
+      if len(observations) > 0:
+        x = numpy.array([features(config) for (config, seconds) in observations])
+        y = numpy.array([seconds for (config, seconds) in observations])
+        w = 1/noise(y)**2
+        precision = precision + (x.T*w) @ x
+        weighted = weighted + (x.T*w) @ y
+      covariance = numpy.linalg.inv(precision)
+      coefficients = covariance @ weighted
+      nParams = len(coefficientNames)
+      if len(observations) > nParams:
+        # if the timings scatter more than noise() says they should, the model is worse than we thought
+        chi2 = (w*(y - x @ coefficients)**2).sum()/(len(observations) - nParams)
+        covariance = covariance*max(chi2, 1)
+      self.fits[instrument] = (coefficients, covariance)
+      return self.fits[instrument]
+
+  # returns (expected duration, its standard deviation) in seconds
+  def predict(self, instrument, config):
+    coefficients, covariance = self.fit(instrument)
+    x = features(config)
+    seconds = max(float(x @ coefficients), 0)
+    sigma = math.sqrt(float(x @ covariance @ x) + noise(seconds)**2)
+    return (seconds, sigma)
+
+  # how long to wait for the sweep before giving up on it [ms]
+  def timeout(self, instrument, config):
+    seconds, sigma = self.predict(instrument, config)
+    return max(minTimeout, round((seconds + nSigma*sigma)*1000))
+
+  # the timings we have for this instrument as {coefficient name: (value, standard deviation)}
+  def summary(self, instrument):
+    coefficients, covariance = self.fit(instrument)
+    sigmas = numpy.sqrt(numpy.diag(covariance))
+    return {name: (float(c), float(s)) for (name, c, s) in zip(coefficientNames, coefficients, sigmas)}
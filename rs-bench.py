@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# author: grey@christoforo.net
+# end to end timing of the instrument I/O: connect, setup, configure, sweep and data transfer
+# each stage is timed on its own, for the raw socket and pyvisa transports and over a range of
+# sweep lengths and NPLCs, against the simulated 2450 (k2450.sim) unless an instrument address is given
+# examples:
+#   ./rs-bench.py --output before.json
+#   ./rs-bench.py --output after.json --compare before.json
+#   ./rs-bench.py --address TCPIP::192.168.1.204::5025::SOCKET --points 21 --nplc 1
+import argparse
+import contextlib
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import time
+
+import k2450 # functions to talk to a keithley 2450 sourcemeter
+import k2450.sim # the instrument stand in
+
+probePorts = k2450.probedPorts # what visaConnect pokes when a connection fails
+
+# times fun() repeats times, returns (list of times in seconds, last result)
+def timeIt(fun, repeats):
+  times = []
+  result = None
+  for n in range(repeats):
+    t = time.perf_counter()
+    result = fun()
+    times.append(time.perf_counter() - t)
+  return (times, result)
+
+def record(results, transport, stage, times, **params):
+  entry = {'transport': transport, 'stage': stage, 'times': times, 'median': statistics.median(times), 'min': min(times)}
+  entry.update(params)
+  results.append(entry)
+  extra = ' '.join(['{:}={:}'.format(k, v) for (k, v) in sorted(params.items())])
+  print('{:8s} {:18s} {:24s} median {:9.2f} ms  min {:9.2f} ms'.format(transport, stage, extra, entry['median']*1000, entry['min']*1000), file=sys.stderr)
+
+# the open parameters and resource name to reach the instrument through each transport
+def openParams(host, port, timeout):
+  return {'resource_name': 'TCPIP::{:}::{:}::SOCKET'.format(host, port), 'timeout': timeout, '_read_termination': '\n'}
+
+# opens a connection for the given transport, returns the connection object
+def connect(transport, host, port, timeout):
+  params = openParams(host, port, timeout)
+  if transport == 'socket':
+    k2450.knownAddresses.pop(params['resource_name'], None) # time a first connection, identification included
+    return k2450.visaConnect(None, params) # the SOCKET resource name means a raw socketConn
+  else: # pyvisa (pyvisa-py speaks raw sockets too)
+    rm = k2450.resourceManager('@py')
+    sm = rm.open_resource(params['resource_name'], timeout=timeout, read_termination='\n', write_termination='\n')
+    from pyvisa import constants
+    try:
+      sm.set_visa_attribute(constants.VI_ATTR_TCPIP_NODELAY, constants.VI_TRUE) # same as socketConn does
+    except Exception: # not every backend can, then small messages may wait on delayed ACKs
+      pass
+    sm.query('*IDN?;:SYSTem:LFRequency?') # same as what visaConnect does
+    return sm
+
+def sweepParams(nPoints, nplc, sweepStart):
+  p = {}
+  p['maxCurrent'] = 0.001 # amps
+  p['sweepStart'] = sweepStart # volts
+  p['sweepEnd'] = -sweepStart # volts
+  p['rangeType'] = 'BEST'
+  p['failAbort'] = 'OFF'
+  p['dual'] = 'ON'
+  p['nPoints'] = nPoints
+  p['sourceFun'] = 'voltage'
+  p['senseFun'] = 'current'
+  p['fourWire'] = True
+  p['nplc'] = nplc
+  p['autoZero'] = False
+  p['stepDelay'] = -1
+  return p
+
+def rsOpt(nPoints, nplc):
+  o = {}
+  o['fourWire'] = True
+  o['autoZero'] = True
+  o['nplc'] = nplc
+  o['iMax'] = 1e-5
+  o['vLim'] = 0.2
+  o['nPoints'] = nPoints
+  o['oCom'] = True
+  o['failAbort'] = 'OFF'
+  o['stepDelay'] = '-1'
+  return o
+
+def benchTransport(transport, host, port, args, results):
+  timeout = args.timeout
+  connectTimes = []
+  sm = None
+  for n in range(args.repeats):
+    if sm is not None: # reconnect
+      sm.close()
+      del(sm)
+    times, sm = timeIt(lambda: connect(transport, host, port, timeout), 1)
+    if sm is None:
+      print('Unable to connect via', transport, file=sys.stderr)
+      return
+    connectTimes += times
+  record(results, transport, 'connect', connectTimes)
+
+  times, ok = timeIt(lambda: k2450.setup2450(sm), args.repeats)
+  record(results, transport, 'setup2450', times)
+
+  for nplc in args.nplc:
+    times, status = timeIt(lambda: k2450.rSweepStatus(sm, rsOpt(args.points[0], nplc)), args.repeats)
+    record(results, transport, 'rSweep', times, nplc=nplc, nPoints=args.points[0])
+    for nPoints in args.points:
+      direction = 1
+      configureTimes = []
+      reconfigureTimes = []
+      sweepTimes = []
+      fetchTimes = []
+      for n in range(args.repeats):
+        k2450.forgetState(sm) # a full configuration...
+        params = sweepParams(nPoints, nplc, -direction)
+        t, ok = timeIt(lambda: k2450.configureSweep(sm, params), 1)
+        configureTimes += t
+        direction = -direction # ...and one where only the direction changes
+        params = sweepParams(nPoints, nplc, -direction)
+        t, ok = timeIt(lambda: k2450.configureSweep(sm, params), 1)
+        reconfigureTimes += t
+
+        def sweep():
+          k2450.doSweep(sm)
+          return k2450.waitForComplete(sm)
+        t, ok = timeIt(sweep, 1)
+        sweepTimes += t
+
+        nReadings = int(sm.query(':TRACE:ACTUAL?'))
+        def fetch():
+          return k2450.queryValues(sm, 'TRACE:DATA? 1, {:}, "defbuffer1", SOUR, READ'.format(nReadings), nValues=nReadings*2)
+        t, values = timeIt(fetch, 1)
+        fetchTimes += t
+        sm.write(':TRACE:CLEAR')
+      record(results, transport, 'configureSweep', configureTimes, nplc=nplc, nPoints=nPoints)
+      record(results, transport, 'reconfigureSweep', reconfigureTimes, nplc=nplc, nPoints=nPoints)
+      record(results, transport, 'sweep', sweepTimes, nplc=nplc, nPoints=nPoints)
+      record(results, transport, 'query_values', fetchTimes, nplc=nplc, nPoints=nPoints)
+  sm.close()
+
+# prints how the medians in results compare to the ones in an earlier results file
+def compare(results, oldFile):
+  with open(oldFile) as f:
+    old = json.load(f)['results']
+  def key(entry):
+    return tuple(sorted([(k, v) for (k, v) in entry.items() if k not in ('times', 'median', 'min')]))
+  oldByKey = {key(e): e for e in old}
+  print('Compared with {:}:'.format(oldFile), file=sys.stderr)
+  for entry in results:
+    k = key(entry)
+    if k in oldByKey:
+      ratio = entry['median']/oldByKey[k]['median']
+      extra = ' '.join(['{:}={:}'.format(a, b) for (a, b) in k if a not in ('transport', 'stage')])
+      print('{:8s} {:18s} {:24s} {:9.2f} ms -> {:9.2f} ms  (x{:.2f})'.format(entry['transport'], entry['stage'], extra, oldByKey[k]['median']*1000, entry['median']*1000, ratio), file=sys.stderr)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the k2450 I/O stack stage by stage.')
+  parser.add_argument('--address', help='benchmark a real instrument at this TCPIP::host::port::SOCKET address instead of the simulator')
+  parser.add_argument('--transport', nargs='+', choices=['socket', 'pyvisa'], default=['socket', 'pyvisa'])
+  parser.add_argument('--points', type=int, nargs='+', default=[11, 101, 1001], help='sweep lengths (per direction)')
+  parser.add_argument('--nplc', type=float, nargs='+', default=[0.01, 0.1, 1], help='integration times')
+  parser.add_argument('--repeats', type=int, default=5, help='how many times to time each stage')
+  parser.add_argument('--timeout', type=int, default=10000, help='communication timeout [ms]')
+  parser.add_argument('--time-scale', dest='timeScale', type=float, default=1, help="the simulator's time scale (0 takes the instrument's timing out of the picture)")
+  parser.add_argument('--port', type=int, default=5025, help='port for the simulator')
+  parser.add_argument('--output', '-o', help='save the results to this JSON file')
+  parser.add_argument('--compare', help='compare with the results in this JSON file')
+  parser.add_argument('--verbose', '-v', action='store_true', help="show k2450's output while benchmarking")
+  args = parser.parse_args()
+
+  sim = None
+  if args.address is None:
+    # visaConnect pokes a few ports when it can't connect, give it something to poke (111 might need root)
+    ports = []
+    for p in probePorts:
+      try:
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # like the simulator does
+        s.bind(('127.0.0.1', p))
+        s.close()
+        ports.append(p)
+      except OSError:
+        print('Warning: unable to listen on port {:}, visaConnect will not be able to probe it'.format(p), file=sys.stderr)
+    sim = k2450.sim.simulated2450('127.0.0.1', args.port, ports, timeScale=args.timeScale).start()
+    host, port = sim.host, sim.port
+  else:
+    host = args.address.split('::')[1]
+    port = int(args.address.split('::')[2])
+
+  results = []
+  if args.verbose:
+    chatter = contextlib.ExitStack() # does nothing
+  else:
+    chatter = contextlib.redirect_stdout(open(os.devnull, 'w'))
+  try:
+    with chatter:
+      for transport in args.transport:
+        try:
+          benchTransport(transport, host, port, args, results)
+        except ImportError as e:
+          print('Skipping the {:} transport: {:}'.format(transport, e), file=sys.stderr)
+  finally:
+    if sim is not None:
+      sim.stop()
+
+  info = {'time': time.time(), 'python': platform.python_version(), 'platform': platform.platform(), 'simulated': sim is not None, 'timeScale': args.timeScale}
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump({'info': info, 'results': results}, f, indent=1)
+  if args.compare is not None:
+    compare(results, args.compare)
+
+if __name__ == "__main__":
+  main()
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 # author: grey@christoforo.net
-import visa # https://github.com/hgrecco/pyvisa
-import numpy
 import sys
+import logging
+import queue # for the instrument worker's jobs
+import threading
 import time
 
 import k2450 # functions to talk to a keithley 2450 sourcemeter
+import k2450.pool # the connection, shared and reopened when it drops
+import k2450.log # where the print()s go
 import rs # grey's sheet resistance library
+import rs.plot # live plotting
+import rs.store # where the sweeps are kept
 
 # for plotting
 import matplotlib.pyplot as plt
@@ -21,81 +26,130 @@ import pyqtGen
 from PyQt5 import QtCore, QtGui, QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
-#========= start print override stuff =========
-# this stuff is for overriding print() so that
-# any calls to it are mirrored to my gui's log pane 
-import builtins as __builtin__
-systemPrint = __builtin__.print
-myPrinter = None
-import io
-class MyPrinter(QtCore.QObject): # a class that holds the signals we'll need for passing around the log data
-  writeToLog = QtCore.pyqtSignal(str) # this signal sends the contents for the log
-  scrollLog = QtCore.pyqtSignal() # this signal tells the log to scroll to its max position
-def print(*args, **kwargs): # overload the print() function
-  global myPrinter
-  if myPrinter is not None: # check to see if the gui has created myPrinter
-    stringBuf = io.StringIO()
-    kwargs['file'] = stringBuf
-    systemPrint(*args, **kwargs) # print to our string buffer
-    myPrinter.writeToLog.emit(stringBuf.getvalue()) # send the print to the gui
-    myPrinter.scrollLog.emit() # tell the gui to scroll the log
-    stringBuf.close()
-    kwargs['file'] = sys.stdout
-  return systemPrint(*args, **kwargs) # now do the print for real
-__builtin__.print = print
-#========= end print override stuff =========
+# draws the sweep as it comes in, on the GUI thread
+# the sweep thread emits readingsArrived with each batch of readings (see k2450.streamSweepData), the batches are
+# added to the plots as they arrive and a timer puts them on the screen at most frameRate times a second
+class livePlotter(QtCore.QObject):
+  started = QtCore.pyqtSignal(object) # a sweep with these sweepParams is about to start, from any thread
+  readingsArrived = QtCore.pyqtSignal(object) # a batch of SOUR, READ pairs (an [n,2] array), from any thread
+  frameRate = 20 # Hz
 
-# this is the thread where the sweep takes place
-class sweepThread(QtCore.QThread):
-  def __init__(self, mainWindow, parent=None):
+  def __init__(self, ax1, ax2, parent=None):
+    QtCore.QObject.__init__(self, parent)
+    self.ax1 = ax1
+    self.ax2 = ax2
+    self.plots = []
+    self.started.connect(self.start) # queued when emitted from another thread, so these run here
+    self.readingsArrived.connect(self.addReadings)
+    self.timer = QtCore.QTimer(self)
+    self.timer.setInterval(int(1000/self.frameRate))
+    self.timer.timeout.connect(self.redraw)
+
+  # gets the axes ready for a sweep with these sweepParams
+  def start(self, sweepParams):
+    self.stop()
+    self.nPoints = sweepParams['nPoints']
+    self.iColumn, self.vColumn = k2450.ivColumns(sweepParams)
+    self.dual = sweepParams.get('dual', 'ON') in ('ON', True)
+    self.n = 0 # readings so far
+    self.plots = [rs.plot.livePlot(self.ax1, 'Forward Sweep (live)')]
+    if self.dual:
+      self.plots.append(rs.plot.livePlot(self.ax2, 'Reverse Sweep (live)'))
+    else:
+      self.ax2.clear()
+    self.timer.start()
+
+  # the first nPoints readings are the forward sweep, the reverse one starts at the turnaround point (see k2450.splitSweepData)
+  def addReadings(self, readings):
+    if len(self.plots) == 0:
+      return # not started, or stopped already
+    first = self.n
+    self.n = self.n + len(readings)
+    forward = readings[0:max(self.nPoints - first, 0)]
+    self.plots[0].add(forward[:,self.iColumn], forward[:,self.vColumn])
+    if self.dual:
+      reverse = readings[max(self.nPoints - 1 - first, 0):]
+      self.plots[1].add(reverse[:,self.iColumn], reverse[:,self.vColumn])
+
+  def redraw(self):
+    for p in self.plots:
+      if p.dirty:
+        p.draw()
+
+  def stop(self):
+    self.timer.stop()
+    for p in self.plots:
+      p.finish()
+    self.plots = []
+
+# runs the instrument jobs one at a time, in the order they were asked for, in a thread of its own
+# so the window never waits on the instrument, what happened comes back with signals (handled on the GUI thread)
+# cancel() drops the jobs that haven't started and sets cancelled, which the running job can watch
+class instrumentWorker(QtCore.QThread):
+  jobStarted = QtCore.pyqtSignal(str) # job name
+  jobDone = QtCore.pyqtSignal(str, object) # job name, what it returned
+  jobFailed = QtCore.pyqtSignal(str, str) # job name, why
+  idle = QtCore.pyqtSignal() # no jobs left
+
+  def __init__(self, parent=None):
     QtCore.QThread.__init__(self, parent)
-    self.mainWindow = mainWindow
+    self.jobs = queue.Queue()
+    self.lock = threading.Lock()
+    self.queued = set() # names of the jobs waiting to run, asking for one of these again doesn't queue it twice
+    self.generation = 0 # goes up with every cancel, jobs from an earlier generation are dropped
+    self.cancelled = threading.Event()
+
+  # queues fun(*args) to run as the job called name, returns False if a job with that name is already waiting
+  def submit(self, name, fun, *args):
+    with self.lock:
+      if name in self.queued:
+        return False
+      self.queued.add(name)
+      self.jobs.put((name, fun, args, self.generation))
+    return True
+
+  def cancel(self):
+    with self.lock:
+      self.generation = self.generation + 1
+      self.cancelled.set()
 
   def run(self):
-    self.mainWindow.ui.applyButton.setEnabled(False)
-    self.mainWindow.ui.sweepButton.setEnabled(False)
-    if not k2450.doSweep(self.mainWindow.sm):
-      print ("Failed to do forward sweep.")
-    else:
-      # get the forward data
-      [i,v] = k2450.fetchSweepData(self.mainWindow.sm,self.mainWindow.sweepParams)
-      self.mainWindow.ax1.clear()
-      if i is not None:
-        self.mainWindow.ax1.set_title('Forward Sweep Results',loc="right")
-        rs.plotSweep(i,v,self.mainWindow.ax1) # plot the sweep results
-      else:
-        print("Failed to fetch forward sweep data.")
+    while True:
+      job = self.jobs.get()
+      if job is None: # see stop
+        break
+      name, fun, args, generation = job
+      with self.lock:
+        self.queued.discard(name)
+        dropped = generation != self.generation
+        if not dropped:
+          self.cancelled.clear()
+      if not dropped:
+        self.jobStarted.emit(name)
+        try:
+          self.jobDone.emit(name, fun(*args))
+        except Exception as e:
+          print("{:} failed: {:}".format(name.capitalize(), e))
+          self.jobFailed.emit(name, str(e))
+      if self.jobs.empty():
+        self.idle.emit()
 
-    # now do a reverse sweep
-    reverseParams = self.mainWindow.sweepParams.copy()
-    reverseParams['sweepStart'] = self.mainWindow.sweepParams['sweepEnd']
-    reverseParams['sweepEnd'] = self.mainWindow.sweepParams['sweepStart']
-    confRes = k2450.configureSweep(self.mainWindow.sm,reverseParams)
-    if confRes:
-      time.sleep(5)
-    if not confRes:
-      print ("Failed to configure reverse sweep.")
-    elif not k2450.doSweep(self.mainWindow.sm):
-      print ("Failed to do reverse sweep.")
-    else:
-      # get the reverse data
-      [i,v] = k2450.fetchSweepData(self.mainWindow.sm,reverseParams)
-      self.mainWindow.ax2.clear()
-      if i is not None:
-        self.mainWindow.ax2.set_title('Reverse Sweep Results',loc="right")
-        rs.plotSweep(i,v,self.mainWindow.ax2) # plot the sweep results
-      else:
-        print("Failed to fetch reverse sweep data.")
-    print('======================================')
-    self.mainWindow.ui.applyButton.setEnabled(True)
-    self.mainWindow.ui.sweepButton.setEnabled(True)    
+  # cancels everything and waits for the thread to finish
+  def stop(self):
+    self.cancel()
+    self.jobs.put(None)
+    self.wait()
     
 class MainWindow(QtWidgets.QMainWindow):
+  logLines = 5000 # the log pane keeps this many lines
+  logRate = 10 # Hz, how often the log pane catches up
+  
   def __init__(self):
     QtWidgets.QMainWindow.__init__(self)
     
     self.setup = False # to keep track of if the sourcemeter is setup or not
     self.configured = False # to keep track of if the sweep is configured or not
+    k2450.sweepTiming.load(k2450.timing.defaultPath) # remember how long sweeps take between sessions
     
     # Set up the user interface from Designer
     self.ui = pyqtGen.Ui_MainWindow()
@@ -126,12 +180,17 @@ class MainWindow(QtWidgets.QMainWindow):
     vBox = QtWidgets.QVBoxLayout()
     vBox.addWidget(FigureCanvas(fig))
     self.ui.plotTab.setLayout(vBox)
+    self.livePlotter = livePlotter(self.ax1, self.ax2, self)
     
-    # set up things for our log pane
-    global myPrinter
-    myPrinter = MyPrinter()
-    myPrinter.writeToLog.connect(self.ui.textBrowser.insertPlainText)
-    myPrinter.scrollLog.connect(self.scrollLog)
+    # set up things for our log pane, it shows what's logged (see k2450.log) a few times a second, in batches
+    self.logHandler = k2450.log.ringHandler(self.logLines)
+    self.logHandler.setFormatter(logging.Formatter('%(message)s'))
+    logging.getLogger(k2450.log.loggerName).addHandler(self.logHandler)
+    self.ui.textBrowser.document().setMaximumBlockCount(self.logLines) # the oldest lines go
+    self.logTimer = QtCore.QTimer(self)
+    self.logTimer.setInterval(int(1000/self.logRate))
+    self.logTimer.timeout.connect(self.flushLog)
+    self.logTimer.start()
     self.ui.textBrowser.setTextBackgroundColor(QtGui.QColor('black'))
     self.ui.textBrowser.setTextColor(QtGui.QColor(0, 255, 0))
     #self.ui.textBrowser.setFontWeight(QtGui.QFont.Bold)
@@ -141,8 +200,21 @@ class MainWindow(QtWidgets.QMainWindow):
     #p.setColor(self.ui.textBrowser.backgroundRole, QtGui.QColor('black'))
     self.ui.textBrowser.setPalette(p)
     
-    # for now put these here, should be initiated by user later:
-    self.rm = visa.ResourceManager('@py') # select pyvisa-py (pure python) backend
+    self.conn = None # the sourcemeter connection, from k2450.pool when we first connect
+    
+    # every sweep goes in here (see rs.store)
+    try:
+      self.store = rs.store.resultsStore(rs.store.defaultPath)
+    except Exception as e:
+      print("Warning: unable to open the results store in {:}: {:}".format(rs.store.defaultPath, e))
+      self.store = None
+    
+    # everything that talks to the sourcemeter runs in here
+    self.worker = instrumentWorker(self)
+    self.worker.jobStarted.connect(self.jobStarted)
+    self.worker.jobDone.connect(self.jobDone)
+    self.worker.idle.connect(self.workerIdle)
+    self.worker.start()
     
     # connect up the sweep button
     self.ui.sweepButton.clicked.connect(self.doSweep)
@@ -153,6 +225,9 @@ class MainWindow(QtWidgets.QMainWindow):
     # connect up the apply button
     self.ui.applyButton.clicked.connect(self.applySweepValues)
     
+    # connect up the cancel button
+    self.ui.cancelButton.clicked.connect(self.cancel)
+    
     # save any changes the user makes
     self.ui.visaAddressLineEdit.editingFinished.connect(self.aSettingHasChanged)
     self.ui.terminationLineEdit.editingFinished.connect(self.aSettingHasChanged)
@@ -168,12 +243,18 @@ class MainWindow(QtWidgets.QMainWindow):
     self.ui.autoDelayCheckBox.stateChanged.connect(self.aSettingHasChanged)    
     self.ui.autoDelayCheckBox.stateChanged.connect(self.autoDelayStateChange)
     self.ui.autoZeroCheckBox.stateChanged.connect(self.aSettingHasChanged)
-    self.sweepThread = sweepThread(self)
+    
+  def closeEvent(self, event):
+    self.worker.stop()
+    self.livePlotter.stop()
+    self.logTimer.stop()
+    logging.getLogger(k2450.log.loggerName).removeHandler(self.logHandler)
+    QtWidgets.QMainWindow.closeEvent(self, event)
     
   def __del__(self):
     try:
-      print("Closing connection to", self.sm._logging_extra['resource_name'],"...")
-      self.sm.close() # close connection
+      print("Closing connection to", self.conn.address,"...")
+      self.conn.close() # close connection
       print("Connection closed.")
     except:
       return
@@ -193,41 +274,59 @@ class MainWindow(QtWidgets.QMainWindow):
     self.ui.stepDelayDoubleSpinBox.setEnabled(not isChecked)
   
   def applySweepValues(self):
-    #TODO: somehow detect that a user has changed a sweep parameter in the UI and they need to be resent to the sourcemeter
+    self.ui.applyButton.setEnabled(False)
+    self.submit('configure', self.configure, self.connectionSettings(), self.sweepSettings())
+    
+  # the sweep parameters from the UI
+  def sweepSettings(self):
+    sweepParams = {} # here we'll store the parameters that define our sweep
+    #sweepParams['maxCurrent'] = 0.05 # amps
+    #sweepParams['sweepStart'] = -0.003 # volts
+    #sweepParams['sweepEnd'] = 0.003 # volts
+    #sweepParams['nPoints'] = 101
+    #sweepParams['stepDelay'] = -1 # seconds (-1 for auto, nearly zero, delay)
+    sweepParams['maxCurrent'] = self.ui.currentLimitDoubleSpinBox.value()/1000 # amps
+    sweepParams['sweepStart'] = self.ui.startVoltageDoubleSpinBox.value()/1000 # volts
+    sweepParams['sweepEnd'] = self.ui.endVoltageDoubleSpinBox.value()/1000 # volts
+    sweepParams['nPoints'] = self.ui.numberOfStepsSpinBox.value()
+    sweepParams['stepDelay'] = self.ui.stepDelayDoubleSpinBox.value()/1000
+    
+    sweepParams['sourceFun'] = 'voltage'
+    sweepParams['senseFun'] = 'current'
+    sweepParams['fourWire'] = True
+    sweepParams['rangeType'] = 'BEST' # fixed, auto or best
+    sweepParams['failAbort'] = 'OFF'
+    sweepParams['dual'] = 'ON' # sweep there and back again in one go
+    sweepParams['nplc'] = self.ui.nPLCDoubleSpinBox.value() # intigration time (in number of power line cycles)
+    
+    if self.ui.autoZeroCheckBox.isChecked():
+      sweepParams['autoZero'] = True
+    else:
+      sweepParams['autoZero'] = False
+    
+    if self.ui.autoDelayCheckBox.isChecked():
+      sweepParams['stepDelay'] = -1 # seconds (-1 for auto, nearly zero, delay)
+    return sweepParams
+  
+  # (runs in the worker) sets up the sweep, connecting first if need be
+  def configure(self, connectionSettings, sweepParams):
     if not self.setup:
       print("The sourcemeter has not been set up. We'll try that now.")
-      self.connectToKeithley()
+      self.connectSourcemeter(*connectionSettings)
     if self.setup:
-      self.sweepParams = {} # here we'll store the parameters that define our sweep
-      #self.sweepParams['maxCurrent'] = 0.05 # amps
-      #self.sweepParams['sweepStart'] = -0.003 # volts
-      #self.sweepParams['sweepEnd'] = 0.003 # volts
-      #self.sweepParams['nPoints'] = 101
-      #self.sweepParams['stepDelay'] = -1 # seconds (-1 for auto, nearly zero, delay)
-      self.sweepParams['maxCurrent'] = self.ui.currentLimitDoubleSpinBox.value()/1000 # amps
-      self.sweepParams['sweepStart'] = self.ui.startVoltageDoubleSpinBox.value()/1000 # volts
-      self.sweepParams['sweepEnd'] = self.ui.endVoltageDoubleSpinBox.value()/1000 # volts
-      self.sweepParams['nPoints'] = self.ui.numberOfStepsSpinBox.value()
-      self.sweepParams['stepDelay'] = self.ui.stepDelayDoubleSpinBox.value()/1000
-      
-      self.sweepParams['sourceFun'] = 'voltage'
-      self.sweepParams['senseFun'] = 'current'
-      self.sweepParams['fourWire'] = True
-      self.sweepParams['nplc'] = self.ui.nPLCDoubleSpinBox.value() # intigration time (in number of power line cycles)
-      
-      if self.ui.autoZeroCheckBox.isChecked():
-        self.sweepParams['autoZero'] = True
-      else:
-        self.sweepParams['autoZero'] = False
-      
-      if self.ui.autoDelayCheckBox.isChecked():
-        self.sweepParams['stepDelay'] = -1 # seconds (-1 for auto, nearly zero, delay)
-      self.sweepParams['durationEstimate'] = k2450.estimateSweepTimeout(self.sweepParams['nPoints'], self.sweepParams['stepDelay'],self.sweepParams['nplc'])      
-      self.configured = k2450.configureSweep(self.sm,self.sweepParams)
+      # fetchSweepData picks the timeout from the sweep duration model, calibrated by the sweeps we've done
+      try:
+        with self.conn as sm:
+          self.configured = k2450.configureSweep(sm,sweepParams)
+      except Exception as e:
+        print(e)
+        self.configured = False
+      self.sweepParams = sweepParams
       if self.configured:
         print('Sweep parameters applied.')
       else:
         print('Sweep parameters not applied.')
+    return self.configured
     
   def connectToKeithley(self):
     # ====for TCPIP comms====
@@ -245,35 +344,135 @@ class MainWindow(QtWidgets.QMainWindow):
     #sm.set_visa_attribute(visa.constants.VI_ATTR_ASRL_BAUD,57600)
     #sm.set_visa_attribute(visa.constants.VI_ASRL_END_TERMCHAR,u'\r')
     #openParams = {'resource_name':fullAddress, 'timeout': deviceTimeout}
-    if (not self.setup):
-      self.openParams = {'resource_name': self.ui.visaAddressLineEdit.text(), 'timeout': self.ui.timeoutSpinBox.value(), '_read_termination': self.ui.terminationLineEdit.text().replace("\\n", '\n').replace("\\t",
-  '\t').replace("\\r",'\r')}
-      self.sm = k2450.visaConnect(self.rm, self.openParams)
-      if self.sm is not None:
-        result = k2450.setup2450(self.sm)
-        if result is True:
-          self.setup = True
-    else:
+    self.ui.connectButton.setEnabled(False)
+    self.submit('connect', self.connectSourcemeter, *self.connectionSettings())
+    
+  # (address, timeout, termination) from the UI
+  def connectionSettings(self):
+    address = self.ui.visaAddressLineEdit.text()
+    termination = self.ui.terminationLineEdit.text().replace("\\n", '\n').replace("\\t", '\t').replace("\\r",'\r')
+    return (address, self.ui.timeoutSpinBox.value(), termination)
+    
+  # (runs in the worker) connects and sets up the sourcemeter
+  def connectSourcemeter(self, address, timeout, termination):
+    if self.setup and (self.conn.address == address):
       print('Already connected.')
+    else:
+      self.configured = False
+    # the pool's connection is shared with anything else in this process and is reopened (and set up again) if it drops
+    self.conn = k2450.pool.connection(address, timeout, termination)
+    try:
+      with self.conn: # connects and sets up (or checks that it's still there)
+        pass
+      self.setup = True
+      self.conn.keepAlive(10) # check on it every so often while we're idle
+    except ConnectionError as e:
+      print(e)
+      self.setup = False
+    return self.setup
+    
+  # puts the lines logged since last time in the log pane, all at once
+  def flushLog(self):
+    lines = self.logHandler.take()
+    if len(lines) == 0:
+      return
+    self.ui.textBrowser.moveCursor(QtGui.QTextCursor.End)
+    self.ui.textBrowser.insertPlainText('\n'.join(lines) + '\n')
+    self.scrollLog()
     
   def scrollLog(self): # scrolls log to maximum position
     self.ui.textBrowser.verticalScrollBar().setValue(self.ui.textBrowser.verticalScrollBar().maximum())    
     
   def doSweep(self):
-    if not self.configured:
-      print("The sweep has not been configured. We'll try that now.")
-      self.applySweepValues()
-    if self.configured:
-      print("Waiting 5 seconds before we start the sweep...")
-      time.sleep(5)
-      self.sweepThread.start() 
+    self.ui.sweepButton.setEnabled(False) # one sweep at a time
+    self.submit('sweep', self.runSweep, self.connectionSettings(), self.sweepSettings())
     #self.ui.tehTabs.setCurrentIndex(0) # switch to plot tab
+    
+  # (runs in the worker) one dual sweep gives us both the forward and the reverse data, as (i,v,i2,v2)
+  # the readings go to the live plot as they come in, the cancel button aborts it
+  def runSweep(self, connectionSettings, sweepParams):
+    if (not self.configured) or (sweepParams != self.sweepParams):
+      print("The sweep has not been configured. We'll try that now.")
+      self.configure(connectionSettings, sweepParams)
+    if not self.configured:
+      return None
+    start = time.time()
+    with self.conn as sm: # nobody else gets to use the sourcemeter until we're done
+      if not k2450.doSweep(sm):
+        return None
+      self.livePlotter.started.emit(sweepParams)
+      result = k2450.fetchSweepData(sm,sweepParams,onReadings=self.livePlotter.readingsArrived.emit,cancel=self.worker.cancelled)
+      idn = k2450.instrumentInfo(sm)['idn']
+    if result[0] is not None:
+      self.storeSweep(sweepParams, result, idn, start)
+    return result
+    
+  # (runs in the worker) adds a sweep to the results store
+  def storeSweep(self, sweepParams, result, idn, start):
+    if self.store is None:
+      return
+    results = {'sample': '', 'address': self.conn.address, 'idn': idn, 'status': 'ok', 'start': start, 'end': time.time(), 'sweepParams': sweepParams}
+    for (direction, i, v) in (('forward', result[0], result[1]), ('reverse', result[2], result[3])):
+      if i is not None:
+        results[direction] = {'i': i, 'v': v}
+    rs.fitDirections(results)
+    try:
+      self.store.add(results)
+    except Exception as e:
+      print("Warning: unable to store the sweep:", e)
+    
+  # queues a job for the worker (see instrumentWorker.submit)
+  def submit(self, name, fun, *args):
+    self.ui.cancelButton.setEnabled(True)
+    return self.worker.submit(name, fun, *args)
+    
+  def cancel(self):
+    print("Cancelling...")
+    self.worker.cancel()
+    
+  def jobStarted(self, name):
+    self.ui.cancelButton.setEnabled(True)
+    
+  def jobDone(self, name, result):
+    if name == 'sweep':
+      self.showSweep(result)
+    
+  def workerIdle(self):
+    self.ui.cancelButton.setEnabled(False)
+    self.ui.connectButton.setEnabled(True)
+    self.ui.applyButton.setEnabled(True)
+    self.ui.sweepButton.setEnabled(True)
+    self.livePlotter.stop() # in case the sweep didn't make it to the end
+    
+  # the sweep's over: swap the live plots for the full ones (with the fits), here on the GUI thread
+  def showSweep(self, result):
+    self.livePlotter.stop()
+    if result is None:
+      print ("Failed to do sweep.")
+    else:
+      [i,v,i2,v2] = result
+      self.ax1.clear()
+      self.ax2.clear()
+      if i is not None:
+        self.ax1.set_title('Forward Sweep Results',loc="right")
+        rs.plotSweep(i,v,self.ax1) # plot the sweep results
+      else:
+        print("Failed to fetch forward sweep data.")
+      if i2 is not None:
+        self.ax2.set_title('Reverse Sweep Results',loc="right")
+        rs.plotSweep(i2,v2,self.ax2) # plot the sweep results
+      else:
+        print("Failed to fetch reverse sweep data.")
+    print('======================================')
 
 def main():
-  app = QtWidgets.QApplication(sys.argv)
-  sweepUI = MainWindow()
-  sweepUI.show()
-  sys.exit(app.exec_())
+  logger = k2450.log.setup() # to the console as well as the log pane
+  with k2450.log.capturePrints(logger):
+    app = QtWidgets.QApplication(sys.argv)
+    sweepUI = MainWindow()
+    sweepUI.show()
+    ret = app.exec_()
+  sys.exit(ret)
 
 if __name__ == "__main__":
   main()
@@ -1,141 +1,424 @@
 #!/usr/bin/env python3
 # author: grey@christoforo.net
-import ipaddress
-import numpy
+# headless sheet resistance measurement, suitable for running from a job queue
+# examples:
+#   ./rs-tool.py --address TCPIP::192.168.1.204::5025::SOCKET --sample A1 --output results.csv
+#   ./rs-tool.py --config station1.json --sample A2 --format json > A2.json
+#   ./rs-tool.py --address TCPIP::192.168.1.204::5025::SOCKET TCPIP::192.168.1.205::5025::SOCKET --sample A3 B3 -o results.csv
+#   ./rs-tool.py --sample A4 --store ~/rs-results -o A4.json
+#   ./rs-tool.py --sample C1 --shape rectangle --size 10 5 --probe-spacing 1 -o C1.json
+#   ./rs-tool.py --sample W1 --disc-sites 100 10 --shape disc --size 100 --stage mystage:stage -o W1-map.csv
+# parameters come from (in increasing order of priority) the defaults below, a JSON config file
+# and the command line, the exit status tells you how it went (see the EXIT_ codes)
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
 import sys
 import time
-import math
 
 import k2450 # functions to talk to a keithley 2450 sourcemeter
+import k2450.stations # for measuring with several sourcemeters at once
+import k2450.mapping # for measuring at many sites on a sample
 import rs # grey's sheet resistance library
+import rs.geometry # geometry factors
+import rs.store # for keeping results
 
-# for plotting
-import matplotlib.pyplot as plt
-plt.switch_backend("Qt5Agg")
+# matplotlib is imported only if we're asked to plot
 
 # debugging/testing stuff
 #visa.log_to_screen() # for debugging
 #import timeit
 
+# exit status codes
+EXIT_OK = 0
+EXIT_CONNECT = 1 # could not connect to or set up the sourcemeter
+EXIT_USAGE = 2 # bad arguments or config file (same as argparse uses)
+EXIT_SWEEP = 3 # the sweep or the data fetch failed
+EXIT_VLIMIT = 4 # rSweep's preliminary measurement hit the source voltage limit
+EXIT_LOW_VOLTAGE = 5 # rSweep's preliminary measurement found too little voltage
+EXIT_UNSTEADY = 6 # rSweep's preliminary measurement found an unsteady source current
+EXIT_TIMEOUT = 7 # rSweep's preliminary measurement timed out
+rsExitCodes = {k2450.RS_VLIMIT: EXIT_VLIMIT, k2450.RS_LOW_VOLTAGE: EXIT_LOW_VOLTAGE, k2450.RS_UNSTEADY: EXIT_UNSTEADY, k2450.RS_TIMEOUT: EXIT_TIMEOUT}
 
-def main():
-  
-  # ====for TCPIP comms====
-  #instrumentIP = ipaddress.ip_address('172.17.3.60')
-  instrumentIP = ipaddress.ip_address('192.168.1.204') # IP address of sourcemeter
-  #fullAddress = 'TCPIP::'+str(instrumentIP)+'::INSTR'
-  fullAddress = 'TCPIP::'+str(instrumentIP)+'::5025::SOCKET' # for raw TCPIP comms directly through a socket @ port 5025 (probably worse than INSTR)
-  deviceTimeout = 1000 # ms
-  openParams = {'resource_name': fullAddress, 'timeout': deviceTimeout, '_read_termination': u'\n'}
-  
-  # ====for serial rs232 comms=====
-  #serialPort = "/dev/ttyUSB0"
-  #fullAddress = "ASRL"+serialPort+"::INSTR"
-  #deviceTimeout = 1000 # ms
-  #sm = rm.open_resource(smAddress)
-  #sm.set_visa_attribute(visa.constants.VI_ATTR_ASRL_BAUD,57600)
-  #sm.set_visa_attribute(visa.constants.VI_ASRL_END_TERMCHAR,u'\r')
-  #openParams = {'resource_name':fullAddress, 'timeout': deviceTimeout}
-  
-  if 'SOCKET' in fullAddress:
-    rm = None
+# ====for TCPIP comms====
+#fullAddress = 'TCPIP::192.168.1.204::INSTR'
+# for raw TCPIP comms directly through a socket @ port 5025 (probably worse than INSTR)
+# ====for serial rs232 comms=====
+#fullAddress = "ASRL/dev/ttyUSB0::INSTR"
+defaults = {}
+defaults['address'] = 'TCPIP::192.168.1.204::5025::SOCKET' # VISA address of the sourcemeter (or a list of them to measure with several at once)
+defaults['timeout'] = 1000 # ms
+defaults['termination'] = '\n'
+defaults['sample'] = '' # a name to identify the sample by in the results (or a list, one per address)
+defaults['timingFile'] = k2450.timing.defaultPath # where sweep timings are kept for the sweep duration model, '' for nowhere
+defaults['store'] = '' # results store directory (see rs.store) to add the results to, '' for none
+# the sample's geometry, for the sheet resistance's geometry factor (see rs.geometry), lengths in mm
+defaults['shape'] = 'infinite' # infinite, rectangle or disc
+defaults['size'] = None # [length along the probe line, width] for a rectangle, [diameter] for a disc
+defaults['position'] = None # [along, across] the probe line from the sample's centre, None for centred
+defaults['probeSpacing'] = 1.0
+defaults['thickness'] = 0 # of the conducting layer, 0 for a thin film
+# maps, an rSweep at each of a list of sites (see k2450.mapping), x and y from the sample's centre in mm
+defaults['sites'] = '' # csv (site, x, y) or json file with the sites, '' for none
+defaults['grid'] = None # [nx, ny] sites, pitch apart
+defaults['discSites'] = None # [diameter, pitch] the grid sites that fit on a disc
+defaults['pitch'] = 1.0 # of the grid
+defaults['stage'] = '' # the stage that moves the probe head as package.module:className, '' for a mock one
+defaults['stageSpeed'] = None # the mock stage's speed [mm/s], None for instant moves
+# rSweep options, see k2450.rSweep
+defaults['fourWire'] = True
+defaults['autoZero'] = True
+defaults['nplc'] = 1
+defaults['iMax'] = 1e-5 # amps
+defaults['vLim'] = 0.2 # volts
+defaults['nPoints'] = 21
+defaults['oCom'] = True
+defaults['failAbort'] = 'OFF'
+defaults['stepDelay'] = '-1' # in seconds, -1 is auto delay
+
+rsOptKeys = ['fourWire', 'autoZero', 'nplc', 'iMax', 'vLim', 'nPoints', 'oCom', 'failAbort', 'stepDelay']
+
+def parseArgs(argv):
+  parser = argparse.ArgumentParser(description='Measure sheet resistance with a Keithley 2450 via an in-line four point probe.')
+  parser.add_argument('--config', help='JSON file with any of the settings below (keys as in the rs-tool.py defaults)')
+  parser.add_argument('--address', nargs='+', help='VISA resource name, e.g. TCPIP::192.168.1.204::5025::SOCKET, give several to measure with them all at once (default: {:})'.format(defaults['address']))
+  parser.add_argument('--timeout', type=int, help='communication timeout in ms')
+  parser.add_argument('--sample', nargs='+', help='sample name to store with the results (one per address)')
+  parser.add_argument('--timing-file', dest='timingFile', help="file to keep sweep timings in, they calibrate the sweep timeouts ('' for none, default: {:})".format(defaults['timingFile']))
+  parser.add_argument('--store', help='also add the results to the results store in this directory (see rs.store)')
+  parser.add_argument('--shape', choices=['infinite', 'rectangle', 'disc'], help='sample shape, for the geometry factor')
+  parser.add_argument('--size', type=float, nargs='+', help='sample size [mm]: length (along the probe line) and width of a rectangle, diameter of a disc')
+  parser.add_argument('--position', type=float, nargs=2, help='probe head position from the sample centre [mm], along and across the probe line')
+  parser.add_argument('--probe-spacing', dest='probeSpacing', type=float, help='probe spacing [mm]')
+  parser.add_argument('--thickness', type=float, help='conducting layer thickness [mm]')
+  parser.add_argument('--sites', help='map the sample: measure at each site in this csv (site, x, y) or json file [mm from its centre]')
+  parser.add_argument('--grid', type=int, nargs=2, metavar=('NX', 'NY'), help='map the sample: measure on a grid of sites, --pitch apart')
+  parser.add_argument('--disc-sites', dest='discSites', type=float, nargs=2, metavar=('DIAMETER', 'PITCH'), help='map the sample: measure at the grid sites that fit on a disc [mm]')
+  parser.add_argument('--pitch', type=float, help='grid pitch [mm]')
+  parser.add_argument('--stage', help='stage that moves the probe head between sites, as package.module:className (default: a mock one that does nothing)')
+  parser.add_argument('--stage-speed', dest='stageSpeed', type=float, help="the mock stage's speed [mm/s], for dry runs")
+  parser.add_argument('--nplc', type=float, help='integration time in power line cycles')
+  parser.add_argument('--i-max', dest='iMax', type=float, help='max source current [A]')
+  parser.add_argument('--v-lim', dest='vLim', type=float, help='source voltage limit [V]')
+  parser.add_argument('--n-points', dest='nPoints', type=int, help='number of points per sweep direction')
+  parser.add_argument('--step-delay', dest='stepDelay', help='source delay [s], -1 for auto')
+  parser.add_argument('--fail-abort', dest='failAbort', choices=['ON', 'OFF'], help='abort the sweep if the source limit is hit')
+  parser.add_argument('--two-wire', dest='fourWire', action='store_false', default=None, help='measure in two wire mode')
+  parser.add_argument('--no-auto-zero', dest='autoZero', action='store_false', default=None, help='only autozero once, before the sweep')
+  parser.add_argument('--no-ocom', dest='oCom', action='store_false', default=None, help='disable offset compensation')
+  parser.add_argument('--output', '-o', default='-', help='where to write results, format from the extension (.json, .csv or .npz), - for stdout (default)')
+  parser.add_argument('--format', choices=['json', 'csv', 'npz'], help='output format (overrides the --output extension)')
+  parser.add_argument('--plot', action='store_true', help='show the sweeps in a plot window when done (blocks until it is closed)')
+  args = parser.parse_args(argv)
+
+  settings = defaults.copy()
+  if args.config is not None:
+    try:
+      with open(args.config) as f:
+        fromFile = json.load(f)
+    except (OSError, ValueError) as e:
+      parser.exit(EXIT_USAGE, 'Unable to read config file {:}: {:}\n'.format(args.config, e))
+    unknown = [k for k in fromFile if k not in defaults]
+    if len(unknown) > 0:
+      parser.exit(EXIT_USAGE, 'Unknown settings in {:}: {:}\n'.format(args.config, ', '.join(unknown)))
+    settings.update(fromFile)
+  for key in defaults:
+    value = getattr(args, key, None)
+    if value is not None:
+      settings[key] = value
+  settings['stepDelay'] = str(settings['stepDelay'])
+  try:
+    settings['geometryFactor'] = rs.geometry.geometryFactor(settings['shape'], settings['probeSpacing'], settings['size'], settings['position'], settings['thickness'])
+  except (ValueError, TypeError) as e:
+    parser.exit(EXIT_USAGE, 'Bad sample geometry: {:}\n'.format(e))
+
+  # one set of settings per sourcemeter
+  addresses = settings['address']
+  if isinstance(addresses, str):
+    addresses = [addresses]
+  samples = settings['sample']
+  if isinstance(samples, str):
+    samples = [samples]*len(addresses)
+  if len(samples) != len(addresses):
+    parser.exit(EXIT_USAGE, 'Give one sample name per address ({:} addresses, {:} samples)\n'.format(len(addresses), len(samples)))
+  stationSettings = []
+  for (address, sample) in zip(addresses, samples):
+    stationSettings.append(settings.copy())
+    stationSettings[-1].update({'address': address, 'sample': sample})
+
+  settings['mapSites'] = None
+  try:
+    if settings['sites'] != '':
+      settings['mapSites'] = k2450.mapping.loadSites(settings['sites'])
+    elif settings['grid'] is not None:
+      settings['mapSites'] = k2450.mapping.gridSites(settings['grid'][0], settings['grid'][1], settings['pitch'])
+    elif settings['discSites'] is not None:
+      settings['mapSites'] = k2450.mapping.discSites(settings['discSites'][0], settings['discSites'][1], settings['probeSpacing'])
+  except (OSError, ValueError, KeyError, TypeError) as e:
+    parser.exit(EXIT_USAGE, 'Unable to make the map sites: {:}\n'.format(e))
+  if (settings['mapSites'] is not None) and (len(stationSettings) > 1):
+    parser.exit(EXIT_USAGE, 'Maps take one sourcemeter at a time\n')
+  stationSettings[0]['mapSites'] = settings['mapSites']
+
+  if args.format is not None:
+    outFormat = args.format
+  elif args.output != '-':
+    outFormat = os.path.splitext(args.output)[1].lstrip('.').lower()
+    if outFormat not in ('json', 'csv', 'npz'):
+      parser.exit(EXIT_USAGE, 'Unable to tell the output format from {:}, use --format\n'.format(args.output))
+  elif settings['mapSites'] is not None:
+    outFormat = 'csv'
+  else:
+    outFormat = 'json'
+  if (settings['mapSites'] is not None) and (outFormat != 'csv'):
+    parser.exit(EXIT_USAGE, 'Maps are written as csv (a row per site as it is done)\n')
+  if (outFormat == 'npz') and (len(stationSettings) > 1):
+    parser.exit(EXIT_USAGE, 'NPZ output takes one sourcemeter at a time, use json or csv for several\n')
+  return (stationSettings, args.output, outFormat, args.plot)
+
+# runs one measurement, returns (exit status, results dict)
+# uses the given k2450.stations.station, or makes one for settings['address']
+def measure(settings, station=None):
+  results = {}
+  results['sample'] = settings['sample']
+  results['address'] = settings['address']
+  results['start'] = time.time()
+  results['rsOpt'] = {k: settings[k] for k in rsOptKeys}
+  results['geometryFactor'] = settings['geometryFactor']
+  results['geometry'] = {k: settings[k] for k in ('shape', 'size', 'position', 'probeSpacing', 'thickness')}
+  results['status'] = 'connect failed'
+
+  if station is None:
+    station = k2450.stations.station(settings['sample'], settings['address'], settings['timeout'], settings['termination'])
+
+  # form a connection to our sourcemeter and do the generic 2450 setup
+  if not station.connect():
+    return (EXIT_CONNECT, results)
+  sm = station.sm
+
+  try:
+    results['idn'] = station.info()['idn']
+
+    rsOpt = results['rsOpt'].copy()
+    rsOpt['geometryFactor'] = settings['geometryFactor']
+    rsStatus = k2450.rSweepStatus(sm, rsOpt)
+    if rsStatus != k2450.RS_OK:
+      results['status'] = 'preliminary check failed'
+      results['rsStatus'] = rsStatus
+      return (rsExitCodes[rsStatus], results)
+
+    # the dual (forward then reverse) sweep
+    results['status'] = 'sweep failed'
+    results['expectedDuration'], results['expectedDurationSigma'] = k2450.sweepDuration(sm, rsOpt)
+    if not k2450.doSweep(sm):
+      return (EXIT_SWEEP, results)
+    [i,v,i2,v2] = k2450.fetchSweepData(sm, rsOpt)
+    if (i is None) or (i2 is None):
+      return (EXIT_SWEEP, results)
+
+    results['forward'] = {'i': i, 'v': v}
+    results['reverse'] = {'i': i2, 'v': v2}
+    rs.fitDirections(results, settings['geometryFactor'])
+    results['status'] = 'ok'
+    return (EXIT_OK, results)
+  except Exception as e: # the link dropped or timed out, say so in the results like the stations' failures (see measureAll)
+    print('Error: Measurement failed: {:}'.format(e))
+    results['status'] = 'failed: {:}'.format(e)
+    return (EXIT_SWEEP, results)
+  finally:
+    results['end'] = time.time()
+    print("Closing connection to sourcemeter...")
+    station.close() # close connection
+    print("Connection closed.")
+
+summaryColumns = ['sample', 'start', 'end', 'address', 'idn', 'status', 'R_forward', 'RSigma_forward', 'rS_forward', 'rSSigma_forward', 'R_reverse', 'RSigma_reverse', 'rS_reverse', 'rSSigma_reverse']
+mapColumns = ['site', 'x', 'y', 'geometryFactor'] + summaryColumns
+
+# one row of summaryColumns (or these columns) for the csv output
+def summaryRow(results, columns=summaryColumns):
+  row = []
+  for column in columns:
+    if '_' in column:
+      name, direction = column.split('_')
+      row.append(results.get(direction, {}).get(name, ''))
+    else:
+      row.append(results.get(column, ''))
+  return row
+
+# runs the measurements on all the sourcemeters at once, returns (exit status, list of results dicts)
+# the exit status is the first station's (in the order given) that didn't go well
+def measureAll(stationSettings):
+  if len(stationSettings) == 1:
+    status, results = measure(stationSettings[0])
+    return (status, [results])
+  manager = k2450.stations.stationManager()
+  for (n, settings) in enumerate(stationSettings):
+    manager.add(n, settings['address'], settings['timeout'], settings['termination'])
+  with manager:
+    outcomes = manager.runAll(lambda station: measure(stationSettings[station.name], station))
+  status = EXIT_OK
+  allResults = []
+  for (n, settings) in enumerate(stationSettings):
+    if isinstance(outcomes[n], Exception):
+      outcomes[n] = (EXIT_SWEEP, {'sample': settings['sample'], 'address': settings['address'], 'status': 'failed: {:}'.format(outcomes[n])})
+    if status == EXIT_OK:
+      status = outcomes[n][0]
+    allResults.append(outcomes[n][1])
+  return (status, allResults)
+
+# measures the map in settings['mapSites'] (see parseArgs and k2450.mapping), an rSweep per site, each site being
+# fitted, written to out (a csv row of mapColumns, after a header if header) and stored while the next is measured
+# returns (exit status, list of results dicts), the exit status is the first site's that didn't go well
+def measureMap(settings, out, header):
+  sites = []
+  for site in settings['mapSites']:
+    try: # the geometry factor changes as the probe head nears the edges
+      site['geometryFactor'] = rs.geometry.geometryFactor(settings['shape'], settings['probeSpacing'], settings['size'], (site['x'], site['y']), settings['thickness'])
+    except ValueError as e:
+      print('Warning: Leaving out site {:}: {:}'.format(site['site'], e))
+      continue
+    sites.append(site)
+  try:
+    if settings['stage'] == '':
+      stage = k2450.mapping.mockStage(settings['stageSpeed'])
+    else:
+      stage = k2450.mapping.loadStage(settings['stage'])
+  except Exception as e:
+    print('Error: Unable to make the stage {:}: {:}'.format(settings['stage'], e))
+    return (EXIT_USAGE, [])
+  station = k2450.stations.station(settings['sample'], settings['address'], settings['timeout'], settings['termination'])
+  store = None
+  try:
+    if not station.connect():
+      return (EXIT_CONNECT, [])
+    common = {'sample': settings['sample'], 'address': settings['address'], 'idn': station.run(lambda s: s.info()['idn'])}
+    common['rsOpt'] = {k: settings[k] for k in rsOptKeys}
+    common['geometry'] = {k: settings[k] for k in ('shape', 'size', 'probeSpacing', 'thickness')}
+    if settings['store'] != '':
+      store = rs.store.resultsStore(settings['store'])
+    writer = csv.writer(out)
+    if header:
+      writer.writerow(mapColumns)
+    def finish(results): # in the plan's analysis thread
+      results.update(common)
+      if results['status'] == 'ok':
+        rs.fitDirections(results, results['geometryFactor'])
+      writer.writerow(summaryRow(results, mapColumns))
+      out.flush() # a row as each site is done
+      if store is not None:
+        store.add(results)
+    plan = k2450.mapping.measurementPlan(station, sites, common['rsOpt'], stage, finish)
+    results = plan.run()
+  finally:
+    print("Closing connection to sourcemeter...")
+    station.close()
+    stage.close()
+    if store is not None:
+      store.close()
+  status = EXIT_OK
+  for r in results:
+    if (status == EXIT_OK) and (r['status'] != 'ok'):
+      status = rsExitCodes.get(r.get('rsStatus'), EXIT_SWEEP)
+  return (status, results)
+
+# results is a list of results dicts (see measure), json output gets the list unless there's only one
+def writeResults(results, output, outFormat):
+  if outFormat == 'json':
+    def toList(o): # numpy arrays (and their scalars) aren't json serializable
+      if hasattr(o, 'tolist'):
+        return o.tolist()
+      raise TypeError(repr(o))
+    if len(results) == 1:
+      results = results[0]
+    data = (json.dumps(results, default=toList, indent=2) + '\n').encode()
+  elif outFormat == 'csv':
+    textBuf = io.StringIO()
+    writer = csv.writer(textBuf)
+    # when appending to an existing file, it already has its header
+    if (output == '-') or (not os.path.exists(output)) or (os.path.getsize(output) == 0):
+      writer.writerow(summaryColumns)
+    for r in results:
+      writer.writerow(summaryRow(r))
+    data = textBuf.getvalue().encode()
+  else: # npz
+    import numpy
+    results = results[0] # parseArgs made sure there's only one
+    arrays = {}
+    meta = results.copy()
+    for direction in ('forward', 'reverse'):
+      if direction in meta:
+        meta[direction] = results[direction].copy()
+        arrays['i_' + direction] = meta[direction].pop('i')
+        arrays['v_' + direction] = meta[direction].pop('v')
+    arrays['meta'] = numpy.array(json.dumps(meta))
+    binBuf = io.BytesIO()
+    numpy.savez(binBuf, **arrays)
+    data = binBuf.getvalue()
+
+  if output == '-':
+    sys.stdout.buffer.write(data)
+    sys.stdout.flush()
+  elif outFormat == 'csv':
+    with open(output, 'ab') as f: # so many samples can share one summary file
+      f.write(data)
   else:
-    import visa # https://github.com/hgrecco/pyvisa
-    # create a visa resource manager
-    rm = visa.ResourceManager('@py') # select pyvisa-py (pure python) backend
-  sleepTime = 10 #s  
-  
-  # form a connection to our sourcemeter
-  sm = k2450.visaConnect(rm, openParams)
-  if sm is None:
-    exit()
-
-  # generic 2450 setup
-  k2450.setup2450(sm)
-  
-  sweepParams = {} # here we'll store the parameters that define our sweep
-  #sweepParams['maxCurrent'] = 0.005 # amps
-  #sweepParams['sweepStart'] = -0.003 # volts
-  #sweepParams['sweepEnd'] = 0.003 # volts
-  #0.001 ua
-  # for very unconductive samples
-  sweepParams['maxCurrent'] = 0.00001 # amps
-  sweepParams['sweepStart'] = -1 # volts
-  sweepParams['sweepEnd'] = -0.5 # volts
-  
-  sweepParams['rangeType'] = 'BEST' # fixed, auto or best
-  sweepParams['failAbort'] = 'OFF'
-  sweepParams['dual'] = 'ON'
-  sweepParams['nPoints'] = 21
-  sweepParams['sourceFun'] = 'voltage'
-  sweepParams['senseFun'] = 'current'
-  sweepParams['fourWire'] = True
-  sweepParams['nplc'] = 3 # intigration time (in number of power line cycles)
-  sweepParams['autoZero'] = True
-  sweepParams['stepDelay'] = 2 # ms (-1 for auto, nearly zero, delay)
-  #sweepParams['durationEstimate'] = k2450.estimateSweepTimeout(sweepParams['nPoints'], sweepParams['stepDelay'], sweepParams['nplc'])
-  
-  #rOpt = {}
-  #rOpt['n'] = 5
-  #rOpt['fourWire'] = True
-  #rOpt['nplc'] = 10
-  #rOpt['sourceCurr'] = 1e-1 # amps
-  #rOpt['vMax'] = 2e-4 # 20e-3, 200e-3, 2, 20 200 volts
-  #rOpt['vMax'] = 200e-3
-  #rOpt['vMax'] = 2e-3
-  #rOpt['vMax'] = 20
-  #rOpt['vMax'] = 200
-  #rOpt['vMax'] = 2
-  
-  rsOpt = {}
-  rsOpt['fourWire'] = True
-  rsOpt['autoZero'] = True
-  #rsOpt['nplc'] = 10
-  #rsOpt['iMax'] = 5e-9
-  #rsOpt['vLim'] = 50
-  rsOpt['nplc'] = 1
-  rsOpt['iMax'] = 1e-5
-  rsOpt['vLim'] = 0.2
-  rsOpt['nPoints'] = 21
-  rsOpt['oCom'] = True
-  rsOpt['failAbort'] = 'OFF'
-  rsOpt['stepDelay'] = '-1' # in seconds, -1 is auto delay
-  #rsOpt['stepDelay'] = '1' # in seconds, -1 is auto delay
-  if k2450.rSweep(sm,rsOpt):
-    # initiate the sweeps
-    k2450.doSweep(sm)    
-    [i,v,i2,v2] = k2450.fetchSweepData(sm,rsOpt)
-    
+    with open(output, 'wb') as f:
+      f.write(data)
+
+# one figure per sourcemeter
+def plotResults(allResults):
+  # for plotting
+  import matplotlib.pyplot as plt
+  plt.switch_backend("Qt5Agg")
+
+  for results in allResults:
     fig = plt.figure() # make a figure to put the plot into
-    if i is not None:
-      ax = fig.add_subplot(2,1,1)
-      ax.clear()
-      ax.set_title('Forward Sweep Results',loc="right")
-      rs.plotSweep(i,v,ax) # plot the sweep results
-      plt.show(block=False)
-    
-    # setup for reverse sweep
-    #newEnd = sweepParams['sweepStart']
-    #newStart = sweepParams['sweepEnd']
-    #sweepParams['sweepStart'] = newStart # volts
-    #sweepParams['sweepEnd'] = newEnd # volts
-    #k2450.configureSweep(sm,sweepParams)
-    #time.sleep(sleepTime)
-    # initiate the reverse sweep
-    #k2450.doSweep(sm)
-    # get the data
-    #[i,v] = k2450.fetchSweepData(sm,sweepParams)
-    
-    if i is not None:
-      ax = fig.add_subplot(2,1,2)
-      ax.clear()
-      ax.set_title('Reverse Sweep Results',loc="right")
-      rs.plotSweep(i2,v2,ax) # plot the sweep results
-      plt.show()  
-  
-  print("Closing connection to sourcemeter...")
-  sm.close() # close connection
-  print("Connection closed.")
+    fig.suptitle('{:} {:}'.format(results['sample'], results['address']))
+    for n, direction, title in ((1, 'forward', 'Forward Sweep Results'), (2, 'reverse', 'Reverse Sweep Results')):
+      if direction in results:
+        ax = fig.add_subplot(2,1,n)
+        ax.set_title(title,loc="right")
+        rs.plotSweep(results[direction]['i'],results[direction]['v'],ax,results['geometryFactor']) # plot the sweep results
+  plt.show()
+
+def main(argv=None):
+  stationSettings, output, outFormat, plot = parseArgs(argv)
+  if stationSettings[0]['timingFile'] != '':
+    k2450.sweepTiming.load(os.path.expanduser(stationSettings[0]['timingFile']))
+
+  # keep the chatter from the measurement out of the way of results going to stdout
+  if output == '-':
+    chatter = contextlib.redirect_stdout(sys.stderr)
+  else:
+    chatter = contextlib.ExitStack() # does nothing
+  if stationSettings[0]['mapSites'] is not None: # rows go out (and into the store) as the sites are done
+    if output == '-':
+      out = sys.stdout
+      header = True
+    else:
+      out = open(output, 'a', newline='') # so many maps can share one file
+      header = out.tell() == 0
+    try:
+      with chatter:
+        status, results = measureMap(stationSettings[0], out, header)
+    finally:
+      if out is not sys.stdout:
+        out.close()
+  else:
+    with chatter:
+      status, results = measureAll(stationSettings)
+    writeResults(results, output, outFormat)
+  if (stationSettings[0]['store'] != '') and (stationSettings[0]['mapSites'] is None):
+    with rs.store.resultsStore(stationSettings[0]['store']) as store:
+      for r in results:
+        store.add(r)
+  good = [r for r in results if r['status'] == 'ok']
+  if plot and (len(good) > 0):
+    plotResults(good)
+  return status
 
 if __name__ == "__main__":
-  main()
+  sys.exit(main())
@@ -1,49 +1,93 @@
-from scipy.optimize import curve_fit
+# grey's sheet resistance library
+# this part is pure analysis (numpy only), the plotting lives in rs.plot which is only
+# imported when something gets drawn so headless jobs never touch matplotlib or Qt
 from math import pi, log, sqrt
-import uncertainties as eprop # for confidence intervals
+import collections
 import numpy
 
-# for plotting
-import matplotlib.pyplot as plt
-plt.switch_backend("Qt5Agg")
+# sheet resistance = R * this for an in-line four point probe on an infinite thin sheet
+thinSheetFactor = pi/log(2)
+
+# what analyzeSweep found out about an I-V curve
+sweepResult = collections.namedtuple('sweepResult', ['R', 'RSigma', 'rS', 'rSSigma', 'slope', 'intercept', 'covariance', 'residuals', 'geometryFactor'])
 
 def aLine(x,m,b):
   return m*x + b
 
-def plotSweep(i,v,ax):
-  print("Drawing sweep plot now")
-  
-  # fit the data to a line
-  popt, fitCovariance = curve_fit(aLine, v, i)
-  slope = popt[0]
-  yIntercept = popt[1]
-  iFit = aLine(v,slope,yIntercept)
-  
-  slopeSigma = numpy.sqrt(numpy.diag(fitCovariance))[0]
-  
-  uSlope = eprop.ufloat(slope,slopeSigma)
-
-  R = 1/uSlope # resistance
-  rS = R*pi/log(2) # sheet resistance
+# closed form least squares fit of y = m*x + b along the last axis of x and y
+# so stacking many I-V curves as rows of 2-D arrays fits them all at once
+# returns (slope, intercept, covariance, residuals) where covariance[...] is the
+# [[var(m), cov(m,b)], [cov(m,b), var(b)]] matrix (scaled by the residual variance like curve_fit's)
+def fitLines(x,y):
+  x = numpy.asarray(x, dtype=float)
+  y = numpy.asarray(y, dtype=float)
+  n = x.shape[-1]
+  xMean = x.mean(axis=-1, keepdims=True)
+  yMean = y.mean(axis=-1, keepdims=True)
+  dx = x - xMean
+  sxx = (dx*dx).sum(axis=-1)
+  sxy = (dx*(y - yMean)).sum(axis=-1)
+  xMean = xMean[...,0]
+  yMean = yMean[...,0]
+  slope = sxy/sxx
+  intercept = yMean - slope*xMean
+  residuals = y - aLine(x, slope[...,numpy.newaxis], intercept[...,numpy.newaxis])
+  if n > 2:
+    s2 = (residuals*residuals).sum(axis=-1)/(n - 2) # residual variance
+  else:
+    s2 = numpy.full_like(slope, numpy.inf) # a perfect fit through two points tells us nothing about the error
+  covariance = numpy.empty(slope.shape + (2,2))
+  covariance[...,0,0] = s2/sxx
+  covariance[...,1,1] = s2*(1/n + xMean*xMean/sxx)
+  covariance[...,0,1] = -xMean*s2/sxx
+  covariance[...,1,0] = covariance[...,0,1]
+  return (slope, intercept, covariance, residuals)
+
+# fits one line, see fitLines
+def fitLine(x,y):
+  slope, intercept, covariance, residuals = fitLines(x,y)
+  return (float(slope), float(intercept), covariance, residuals)
+
+# fits an I-V curve (current i as a function of voltage v) and works out the resistance and
+# sheet resistance (R times the geometry factor) with their one sigma uncertainties
+def analyzeSweep(i,v,geometryFactor=thinSheetFactor):
+  slope, intercept, covariance, residuals = fitLine(v, i)
+  slopeSigma = sqrt(covariance[0,0])
+  R = 1/slope # resistance
+  RSigma = slopeSigma/(slope*slope) # first order error propagation through 1/slope
+  rS = R*geometryFactor # sheet resistance
+  rSSigma = RSigma*abs(geometryFactor)
+  return sweepResult(R, RSigma, rS, rSSigma, slope, intercept, covariance, residuals, geometryFactor)
 
+# analyzeSweep for many I-V curves of the same length at once, one per row of i and v
+# returns arrays (R, RSigma, rS, rSSigma), geometryFactor can be one per curve
+def analyzeSweeps(i,v,geometryFactor=thinSheetFactor):
+  slope, intercept, covariance, residuals = fitLines(v, i)
+  R = 1/slope
+  RSigma = numpy.sqrt(covariance[...,0,0])/(slope*slope)
+  rS = R*geometryFactor
+  rSSigma = RSigma*numpy.abs(geometryFactor)
+  return (R, RSigma, rS, rSSigma)
+
+# fits each sweep direction of a results dict (see rs-tool.py), {'forward': {'i': ..., 'v': ...}, 'reverse': ...},
+# adding the R, RSigma, rS and rSSigma next to its i and v, returns the results dict
+def fitDirections(results, geometryFactor=thinSheetFactor):
+  for direction in ('forward', 'reverse'):
+    if direction in results:
+      fit = analyzeSweep(results[direction]['i'], results[direction]['v'], geometryFactor)
+      results[direction].update({'R': fit.R, 'RSigma': fit.RSigma, 'rS': fit.rS, 'rSSigma': fit.rSSigma})
+  return results
+
+# human readable (R, R_s) strings for a sweepResult
+def resultStrings(result):
+  import uncertainties as eprop # for confidence intervals (only needed for formatting)
+  R = eprop.ufloat(result.R, result.RSigma)
+  rS = eprop.ufloat(result.rS, result.rSSigma)
   rString = "R=" +  R.format('0.6g') + u" [\u03A9]"
-  print (rString)
   rSString = "R_s=" + rS.format('0.6g') + u" [\u03A9/\u25AB]"
-  print (rSString)
-  
-  vMax = max(v)
-  vMin = min(v)
-  vRange = vMax - vMin
-  onePercent = 0.01*vRange
-
-  # draw the plot on the given axis
-  ax.set_xlabel('Voltage [V]')
-  ax.set_ylabel('Current [A]')
-  data, = ax.plot(v,i,'ro', label="I-V data points")
-  fit, = ax.plot(v,iFit, label="Best linear fit")
-  fit.axes.text(0.1,0.9,'$'+rString+'$', transform = fit.axes.transAxes)
-  fit.axes.text(0.1,0.8,'$'+rSString+'$', transform = fit.axes.transAxes)
-  ax.legend(handles=[data, fit],loc=4)
-  ax.set_xlim([vMin-onePercent,vMax+onePercent])
-  ax.grid(b=True)
-  ax.get_figure().canvas.draw()
+  return (rString, rSString)
+
+# analyzes an I-V curve and draws it on the given matplotlib axis, see rs.plot
+def plotSweep(i,v,ax,geometryFactor=thinSheetFactor):
+  from rs import plot # matplotlib only gets loaded when we actually draw something
+  return plot.plotSweep(i,v,ax,geometryFactor)
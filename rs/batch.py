@@ -0,0 +1,144 @@
+# re-analysis of the sweeps in a results store (see rs.store), e.g. for when the geometry factor or the fit changes
+# the I-V arrays are read through memory maps a chunk of sweeps at a time and each chunk is fitted in one go
+# (rs.analyzeSweeps), so only a chunk's worth of the archive is ever in memory, the chunks can be spread
+# over several processes
+# usage:
+#   summary = rs.batch.reanalyze('~/rs-results', processes=4, sample='A1') # with each sweep's own geometry factor
+#   summary = rs.batch.reanalyze('~/rs-results', geometryFactor=4.2, sample='A1') # or one for all of them
+#   rs.batch.writeSummary(summary, 'summary.csv')
+# or from the command line:
+#   python3 -m rs.batch ~/rs-results --geometry-factor 4.2 --processes 4 --output summary.csv
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import sys
+import time
+
+import numpy
+
+import rs
+import rs.geometry
+import rs.store
+
+chunkSize = 5000 # sweeps per chunk
+fitColumns = [rs.store.fitColumn(f, d) for d in rs.store.directions for f in rs.store.fitNames]
+summaryColumns = ['id', 'sample', 'start', 'geometryFactor'] + fitColumns
+locationColumns = ['id', 'shard', 'offset', 'nForward', 'nReverse'] # where a sweep's arrays are
+
+# fits the sweeps at these locations (an [n,5] array of locationColumns), returns {fit column: array}
+# geometryFactor is one number or one per sweep
+# this is what runs in the worker processes, so it maps the shards itself
+def analyzeChunk(storePath, locations, geometryFactor):
+  n = len(locations)
+  geometryFactor = numpy.broadcast_to(numpy.asarray(geometryFactor, dtype=float), [n])
+  fits = {c: numpy.full(n, numpy.nan) for c in fitColumns}
+  offset = locations[:,2]
+  nForward = locations[:,3]
+  nReverse = locations[:,4]
+  for shard in numpy.unique(locations[:,1]):
+    values = numpy.memmap(rs.store.shardPath(storePath, shard), dtype=rs.store.dtype, mode='r')
+    inShard = locations[:,1] == shard
+    # forward i, forward v, reverse i, reverse v, back to back
+    for (direction, nPoints, start) in (('forward', nForward, offset), ('reverse', nReverse, offset + 2*nForward)):
+      for length in numpy.unique(nPoints[inShard]):
+        if length < 2:
+          continue # nothing to fit
+        rows = numpy.flatnonzero(inShard & (nPoints == length))
+        index = start[rows,numpy.newaxis] + numpy.arange(length) # [sweeps, points], reads just these pages of the map
+        i = values[index]
+        v = values[index + length]
+        for (name, result) in zip(rs.store.fitNames, rs.analyzeSweeps(i, v, geometryFactor[rows])):
+          fits[rs.store.fitColumn(name, direction)][rows] = result
+    del(values)
+  return fits
+
+# fits the stored sweeps again, returns the summary table as {column: array} (see summaryColumns)
+# store is a resultsStore or its path, the sweeps are the ones store.find(**criteria) finds (the ok ones by default)
+# geometryFactor is None for each sweep's own (the one it was measured with, pi/ln(2) for sweeps stored without
+# one), one number for all of them, or a function of the found rows (dicts with the summaryColumns' id, sample,
+# start and geometryFactor and the decoded config and extra) that returns one per row
+# processes > 1 fans the chunks out over that many processes
+def reanalyze(store, geometryFactor=None, processes=1, chunkSize=chunkSize, **criteria):
+  if isinstance(store, rs.store.resultsStore):
+    columns = summaryColumns[0:4] + locationColumns[1:]
+    if callable(geometryFactor):
+      columns = columns + ['config', 'extra']
+    rows = store.find(columns=columns, **criteria)
+    storePath = store.path
+  else:
+    with rs.store.resultsStore(store) as opened:
+      return reanalyze(opened, geometryFactor, processes, chunkSize, **criteria)
+  rows = [r for r in rows if r['shard'] is not None] # no arrays, nothing to fit
+  summary = {'id': numpy.array([r['id'] for r in rows], dtype=numpy.int64)}
+  summary['sample'] = numpy.array([r['sample'] for r in rows], dtype=object)
+  summary['start'] = numpy.array([r['start'] for r in rows], dtype=float)
+  if callable(geometryFactor):
+    for r in rows:
+      r['config'] = json.loads(r['config'])
+      r['extra'] = json.loads(r['extra'])
+    geometryFactor = numpy.asarray(geometryFactor(rows), dtype=float)
+  elif geometryFactor is None:
+    geometryFactor = numpy.array([rs.thinSheetFactor if r['geometryFactor'] is None else r['geometryFactor'] for r in rows], dtype=float)
+  else:
+    geometryFactor = numpy.full(len(rows), geometryFactor, dtype=float)
+  summary['geometryFactor'] = geometryFactor
+  locations = numpy.array([[r[c] for c in locationColumns] for r in rows], dtype=numpy.int64).reshape([-1, len(locationColumns)])
+  starts = range(0, len(rows), chunkSize)
+  chunks = [locations[s:s + chunkSize] for s in starts]
+  factors = [geometryFactor[s:s + chunkSize] for s in starts]
+  if processes > 1:
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+      results = list(pool.map(analyzeChunk, itertools.repeat(storePath), chunks, factors))
+  else:
+    results = [analyzeChunk(storePath, c, f) for (c, f) in zip(chunks, factors)]
+  for c in fitColumns:
+    summary[c] = numpy.concatenate([r[c] for r in results] + [numpy.empty(0)])
+  return summary
+
+# writes a summary table (see reanalyze) as csv, to stdout for '-'
+def writeSummary(summary, output):
+  if output == '-':
+    f = sys.stdout
+  else:
+    f = open(output, 'w', newline='')
+  try:
+    writer = csv.writer(f)
+    writer.writerow(summaryColumns)
+    writer.writerows(zip(*[summary[c].tolist() for c in summaryColumns]))
+  finally:
+    if f is not sys.stdout:
+      f.close()
+
+# a date (YYYY-MM-DD, local time) as a time.time() style timestamp
+def timestamp(date):
+  return time.mktime(time.strptime(date, '%Y-%m-%d'))
+
+def main():
+  parser = argparse.ArgumentParser(description='Fit the sweeps in a results store again and write a summary table.')
+  parser.add_argument('store', help='results store directory (see rs.store)')
+  parser.add_argument('--geometry-factor', dest='geometryFactor', type=float, help='R_s = R times this for every sweep (default: the one each sweep was measured with, or from the geometry below)')
+  parser.add_argument('--shape', choices=rs.geometry.shapes, help='work one geometry factor out for samples of this shape (see rs.geometry)')
+  parser.add_argument('--size', type=float, nargs='+', help='sample size: length (along the probe line) and width of a rectangle, diameter of a disc')
+  parser.add_argument('--probe-spacing', dest='probeSpacing', type=float, default=1, help='probe spacing (same unit as --size)')
+  parser.add_argument('--thickness', type=float, default=0, help='conducting layer thickness (same unit as --size)')
+  parser.add_argument('--sample', help='only this sample')
+  parser.add_argument('--since', type=timestamp, help='only sweeps from this date (YYYY-MM-DD) on')
+  parser.add_argument('--until', type=timestamp, help='only sweeps from before this date (YYYY-MM-DD)')
+  parser.add_argument('--processes', type=int, default=1, help='fit in this many processes')
+  parser.add_argument('--chunk-size', dest='chunkSize', type=int, default=chunkSize, help='sweeps fitted at once')
+  parser.add_argument('--output', '-o', default='-', help='csv file for the summary, - for stdout (default)')
+  args = parser.parse_args()
+  if (args.geometryFactor is None) and (args.shape is not None):
+    try:
+      args.geometryFactor = rs.geometry.geometryFactor(args.shape, args.probeSpacing, args.size, None, args.thickness)
+    except ValueError as e:
+      parser.error(str(e))
+  t = time.monotonic()
+  summary = reanalyze(args.store, args.geometryFactor, args.processes, args.chunkSize, sample=args.sample, since=args.since, until=args.until)
+  writeSummary(summary, args.output)
+  print('Fitted {:} sweeps in {:.2f} s'.format(len(summary['id']), time.monotonic() - t), file=sys.stderr)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,145 @@
+# geometry factors for an in-line, equally spaced four point probe: sheet resistance = R*geometryFactor where R = V/I
+# pi/ln(2) (rs.thinSheetFactor) is only right for a thin film that's infinitely big compared to the probe spacing s,
+# this corrects for
+#   the sample's size and shape (rectangles and discs) and where on it the probe head is (edge proximity)
+#   the sample's thickness t compared to s (for a layer on an insulating substrate)
+# discs come in closed form (the method of images), rectangles from a series solution that's slow enough that
+# centred probes on all but small or narrow rectangles use a precomputed table (interpolated in log(size/s), good
+# to 0.05%) and the rest get cached
+# all lengths are in the same (any) unit
+# usage:
+#   g = rs.geometry.geometryFactor('rectangle', s=1, size=(10, 5)) # a 10 mm x 5 mm coupon, 1 mm probe spacing
+#   g = rs.geometry.geometryFactor('disc', s=1, size=100, position=(30, 0), thickness=0.5)
+#   result = rs.analyzeSweep(i, v, geometryFactor=g)
+import functools
+from math import pi, log
+
+import numpy
+
+infiniteFactor = pi/log(2)
+shapes = ('infinite', 'rectangle', 'disc')
+tableMin = 20 # the table covers rectangles from this many probe spacings long (shorter ones get the series)...
+tableMax = 1000 # ...up to this (bigger is as good as infinite)...
+tableStepsLong = 24 # ...in this many logarithmic steps
+tableMinWidth = 0.1 # and from this many probe spacings wide (narrower ones get the series)...
+tableStepsWide = 128 # ...in this many, more since the factor bends most where the width is about s
+seriesTolerance = 1e-12 # the rectangle series stops once the terms are this small
+
+# what the thickness does to the geometry factor (multiply by this), t/s -> 0 gives 1
+# ln(2)/ln(sinh(t/s)/sinh(t/2s)), a layer of thickness t on an insulating substrate (Valdes)
+def thicknessCorrection(t, s):
+  x = numpy.asarray(t, dtype=float)/s
+  def logSinh(x): # without overflowing for thick samples
+    return x + numpy.log1p(-numpy.exp(-2*x)) - log(2)
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    correction = log(2)/(logSinh(x) - logSinh(x/2))
+  return numpy.where(x < 1e-6, 1.0, correction)[()]
+
+# the geometry factor with the probe head in a disc of this diameter, (x, y) is the middle of the probe head
+# from the disc's centre and angle the direction of the probe line (radians), all of these can be arrays
+# the images of the current probes in the disc's edge (at R^2/conj(z)) keep the current inside the disc
+# nan if a probe isn't on the disc
+def discFactor(diameter, s, x=0, y=0, angle=0):
+  radius = numpy.asarray(diameter, dtype=float)/2
+  middle = numpy.asarray(x, dtype=float) + 1j*numpy.asarray(y, dtype=float)
+  along = numpy.exp(1j*numpy.asarray(angle, dtype=float))
+  z = [middle + (k - 1.5)*s*along for k in range(4)] # the probes, current in at z[0], out at z[3]
+  def potential(at): # [V] per [R_s*I], up to a constant
+    p = 0
+    for (source, sign) in ((z[0], 1), (z[3], -1)):
+      with numpy.errstate(divide='ignore', invalid='ignore'):
+        image = numpy.where(source == 0, 0, numpy.log(numpy.abs(at - radius**2/numpy.conj(source))))
+      p = p - sign*(numpy.log(numpy.abs(at - source)) + image)/(2*pi) # an image at infinity (source at the centre) adds a constant
+    return p
+  factor = 1/(potential(z[1]) - potential(z[2]))
+  inside = (numpy.abs(z[0]) < radius) & (numpy.abs(z[3]) < radius)
+  return numpy.where(inside, factor, numpy.nan)[()]
+
+# -ln|2 sin(theta/2)| = sum over m >= 1 of cos(m theta)/m
+def cosineSum(theta):
+  return -numpy.log(numpy.abs(2*numpy.sin(theta/2)))
+
+# the geometry factor for a rectangle a long (along the probe line) and b wide, with the middle of the probe head
+# at (x, y) from a corner (the centre by default), nan if a probe isn't on the rectangle
+# from the Neumann Green's function of the rectangle as a series in cos(m pi x/a): the infinitely wide strip part
+# of it sums in closed form (cosineSum) and what the sides at y = 0 and y = b add dies off exponentially with m
+@functools.lru_cache(maxsize=4096)
+def rectangleFactor(a, b, s, x=None, y=None):
+  if x is None:
+    x = a/2
+  if y is None:
+    y = b/2
+  probes = x + (numpy.arange(4) - 1.5)*s
+  if (probes[0] <= 0) or (probes[3] >= a) or (y <= 0) or (y >= b):
+    return float('nan')
+  alpha = pi*probes/a
+  def strip(at): # [V] per [R_s*I] in an infinitely wide strip a long
+    return (cosineSum(at - alpha[0]) + cosineSum(at + alpha[0]) - cosineSum(at - alpha[3]) - cosineSum(at + alpha[3]))/(2*pi)
+  v = strip(alpha[1]) - strip(alpha[2])
+  # the sides: sum over m of (2/a) cos(k x)(cos(k x1) - cos(k x4)) r_m with k = m pi/a and
+  # r_m = (2 exp(-2kb) + exp(-2ky) + exp(-2k(b - y)))/(2k(1 - exp(-2kb)))
+  edge = min(y, b - y)
+  nTerms = int(numpy.ceil(-log(seriesTolerance)*a/(2*pi*edge))) + 1
+  k = pi*numpy.arange(1, nTerms + 1)/a
+  decay = numpy.exp(-2*k*b)
+  r = (2*decay + numpy.exp(-2*k*y) + numpy.exp(-2*k*(b - y)))/(2*k*(1 - decay))
+  sources = numpy.cos(k*probes[0]) - numpy.cos(k*probes[3])
+  v = v + ((2/a)*(numpy.cos(k*probes[1]) - numpy.cos(k*probes[2]))*sources*r).sum()
+  return float(1/v)
+
+# log(rectangleFactor) for centred probes over a grid of log(a/s), log(b/s), made the first time it's needed
+# (in logs since for narrow rectangles the factor goes as b, which interpolates exactly that way)
+@functools.lru_cache(maxsize=1)
+def rectangleTable():
+  logA = numpy.linspace(log(tableMin), log(tableMax), tableStepsLong)
+  logB = numpy.linspace(log(tableMinWidth), log(tableMax), tableStepsWide)
+  table = numpy.array([[log(rectangleFactor(float(numpy.exp(la)), float(numpy.exp(lb)), 1.0)) for lb in logB] for la in logA])
+  return (logA, logB, table)
+
+# rectangleFactor for centred probes, a and b can be arrays: from the table (bilinear in log(a/s), log(b/s)),
+# sizes past its far ends being taken as its ends, or for rectangles shorter or narrower than it covers, from
+# the series itself (nan if the probes don't fit)
+def centredRectangleFactor(a, b, s):
+  logA, logB, table = rectangleTable()
+  a, b = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float))
+  la = numpy.clip(numpy.log(a/s), logA[0], logA[-1])
+  lb = numpy.clip(numpy.log(b/s), logB[0], logB[-1])
+  ia = numpy.clip(numpy.searchsorted(logA, la) - 1, 0, len(logA) - 2)
+  ib = numpy.clip(numpy.searchsorted(logB, lb) - 1, 0, len(logB) - 2)
+  fa = (la - logA[ia])/(logA[ia + 1] - logA[ia])
+  fb = (lb - logB[ib])/(logB[ib + 1] - logB[ib])
+  factor = numpy.array(numpy.exp(table[ia, ib]*(1 - fa)*(1 - fb) + table[ia + 1, ib]*fa*(1 - fb) + table[ia, ib + 1]*(1 - fa)*fb + table[ia + 1, ib + 1]*fa*fb)) # an array even for scalars, to fill in below
+  outside = (a/s < tableMin) | (b/s < tableMinWidth)
+  for n in numpy.flatnonzero(outside):
+    factor.flat[n] = rectangleFactor(float(a.flat[n]), float(b.flat[n]), float(s))
+  return factor[()]
+
+# the factor that turns R = V/I into sheet resistance for a sample of this shape and size, probed with spacing s
+#   shape 'infinite': size is ignored
+#   shape 'rectangle': size = (length along the probe line, width)
+#   shape 'disc': size = diameter
+# position is the middle of the probe head from the sample's centre, (along the probe line, across it), None for
+# the centre, thickness is the conducting layer's (0 for a thin film), raises ValueError for impossible geometries
+def geometryFactor(shape='infinite', s=1, size=None, position=None, thickness=0):
+  if shape not in shapes:
+    raise ValueError('Unknown sample shape {:}, it can be one of {:}'.format(shape, ', '.join(shapes)))
+  if shape == 'infinite':
+    factor = infiniteFactor
+  elif shape == 'rectangle':
+    if (size is None) or (len(size) != 2):
+      raise ValueError('A rectangle needs its size as (length, width)')
+    a, b = float(size[0]), float(size[1])
+    if position is None:
+      factor = float(centredRectangleFactor(a, b, s))
+    else:
+      factor = rectangleFactor(a, b, float(s), a/2 + float(position[0]), b/2 + float(position[1]))
+  else:
+    diameter = float(numpy.ravel(size)[0]) if size is not None else None
+    if diameter is None:
+      raise ValueError('A disc needs its diameter')
+    if position is None:
+      position = (0, 0)
+    factor = float(discFactor(diameter, s, position[0], position[1]))
+  if numpy.isnan(factor):
+    raise ValueError('The probes do not fit on a {:} of size {:} at {:} with spacing {:}'.format(shape, size, position, s))
+  return factor*float(thicknessCorrection(thickness, s))
@@ -0,0 +1,115 @@
+# plotting for grey's sheet resistance library
+# everything here needs a matplotlib axis, the analysis itself is in rs
+import numpy
+
+import rs
+
+# analyzes an I-V curve and draws the data and fit on the given axis
+# R_s comes from the geometry factor (see rs.geometry), returns the sweepResult
+def plotSweep(i,v,ax,geometryFactor=rs.thinSheetFactor):
+  print("Drawing sweep plot now")
+  
+  # fit the data to a line
+  result = rs.analyzeSweep(i,v,geometryFactor)
+  iFit = rs.aLine(v,result.slope,result.intercept)
+  
+  rString, rSString = rs.resultStrings(result)
+  print (rString)
+  print (rSString)
+  
+  vMax = max(v)
+  vMin = min(v)
+  vRange = vMax - vMin
+  onePercent = 0.01*vRange
+
+  # draw the plot on the given axis
+  ax.set_xlabel('Voltage [V]')
+  ax.set_ylabel('Current [A]')
+  data, = ax.plot(v,i,'ro', label="I-V data points")
+  fit, = ax.plot(v,iFit, label="Best linear fit")
+  fit.axes.text(0.1,0.9,'$'+rString+'$', transform = fit.axes.transAxes)
+  fit.axes.text(0.1,0.8,'$'+rSString+'$', transform = fit.axes.transAxes)
+  ax.legend(handles=[data, fit],loc=4)
+  ax.set_xlim([vMin-onePercent,vMax+onePercent])
+  ax.grid(b=True)
+  ax.get_figure().canvas.draw()
+  return result
+
+# draws an I-V curve as its points come in (e.g. from k2450.streamSweepData) without redrawing the whole figure:
+# the points go into one Line2D that's blitted over a saved background, only when new points land outside the
+# axis limits do the limits grow (by margin, so that's rare) and the figure gets redrawn
+# add() only stores the points, draw() puts them on the screen, so the caller decides how often that happens
+# everything here has to run in the GUI's thread
+class livePlot:
+  margin = 0.1 # how far (as a fraction of the data's range) the limits reach past the data when they grow
+
+  def __init__(self, ax, title=None):
+    self.ax = ax
+    self.canvas = ax.get_figure().canvas
+    self.data = numpy.empty([64,2]) # (i, v) pairs, grown by doubling
+    self.n = 0
+    ax.clear()
+    if title is not None:
+      ax.set_title(title, loc="right")
+    ax.set_xlabel('Voltage [V]')
+    ax.set_ylabel('Current [A]')
+    ax.grid(True)
+    self.line, = ax.plot([], [], 'ro', label="I-V data points", animated=True) # animated: left out of full redraws, we draw it
+    self.background = None
+    self.stale = True # the limits need to change (or nothing's been drawn yet)
+    self.dirty = False # there are points that aren't on the screen yet
+    self.drawEvent = self.canvas.mpl_connect('draw_event', self.onDraw)
+
+  # a full redraw happened (ours, a resize...): remember what's under the line and put the line back
+  def onDraw(self, event):
+    self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+    self.ax.draw_artist(self.line)
+
+  def add(self, i, v):
+    i = numpy.asarray(i, dtype=float)
+    v = numpy.asarray(v, dtype=float)
+    nNew = len(i)
+    if nNew == 0:
+      return
+    if self.n + nNew > len(self.data):
+      grown = numpy.empty([max(2*len(self.data), self.n + nNew), 2])
+      grown[0:self.n] = self.data[0:self.n]
+      self.data = grown
+    self.data[self.n:self.n + nNew, 0] = i
+    self.data[self.n:self.n + nNew, 1] = v
+    self.n = self.n + nNew
+    self.line.set_data(self.data[0:self.n, 1], self.data[0:self.n, 0]) # views, no copies
+    if not self.stale:
+      xMin, xMax = self.ax.get_xlim()
+      yMin, yMax = self.ax.get_ylim()
+      self.stale = (v.min() < xMin) or (v.max() > xMax) or (i.min() < yMin) or (i.max() > yMax)
+    self.dirty = True
+
+  # the limits to cover values with some room to spare
+  def limits(self, values):
+    lo = values.min()
+    hi = values.max()
+    span = hi - lo
+    if span == 0:
+      span = abs(hi) or 1
+    return (lo - self.margin*span, hi + self.margin*span)
+
+  # shows the points added since the last draw
+  def draw(self):
+    if self.stale or (self.background is None):
+      if self.n > 0:
+        self.ax.set_xlim(self.limits(self.data[0:self.n, 1]))
+        self.ax.set_ylim(self.limits(self.data[0:self.n, 0]))
+      self.stale = False
+      self.canvas.draw() # onDraw saves the new background and draws the line
+    else:
+      self.canvas.restore_region(self.background)
+      self.ax.draw_artist(self.line)
+      self.canvas.blit(self.ax.bbox)
+    self.dirty = False
+
+  # stops following the canvas, the line becomes an ordinary one
+  def finish(self):
+    self.canvas.mpl_disconnect(self.drawEvent)
+    self.line.set_animated(False)
+    self.background = None
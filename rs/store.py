@@ -0,0 +1,243 @@
+# a results store for grey's sheet resistance library: every sweep we've done, on disk, findable
+# the raw I-V arrays go into append only binary shards (little endian float64, so they can be memory mapped)
+# and everything else (sample, times, instrument, settings, geometry factor, R and R_s) goes into an SQLite index next to them
+# a store is a directory:
+#   index.sqlite       one row per measurement, indexed by sample, start time and the main settings
+#   shard-00000.f8 ... forward i, forward v, reverse i, reverse v of each measurement, back to back
+# usage:
+#   store = rs.store.resultsStore('~/rs-results')
+#   store.add(results) # a results dict like rs-tool.py's measure makes
+#   rows = store.find(sample='A1', since=time.time() - 30*24*3600, nplc=1)
+#   arrays = store.arrays(rows[0]) # {'i_forward': ..., 'v_forward': ..., 'i_reverse': ..., 'v_reverse': ...}
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy
+
+try:
+  import fcntl # for locking shards, so several processes can share a store
+except ImportError: # windows
+  fcntl = None
+  import msvcrt
+
+defaultPath = os.path.join(os.path.expanduser('~'), 'rs-results') # where the tools keep their results by default
+shardBytes = 256*1024*1024 # a new shard is started once the current one is this big
+dtype = numpy.dtype('<f8')
+directions = ('forward', 'reverse')
+fitNames = ('R', 'RSigma', 'rS', 'rSSigma')
+settingColumns = {'nplc': 'REAL', 'nPoints': 'INTEGER', 'fourWire': 'INTEGER', 'autoZero': 'INTEGER', 'oCom': 'INTEGER'} # from the config, with an index for searching by them
+
+schema = '''
+CREATE TABLE IF NOT EXISTS sweeps (
+  id INTEGER PRIMARY KEY,
+  sample TEXT, address TEXT, idn TEXT, status TEXT, start REAL, end REAL,
+  {settings},
+  config TEXT, -- the sweepParams/rsOpt as JSON
+  geometryFactor REAL, -- the R_s = R times this that the fits were made with (NULL for pi/ln(2), see rs.geometry)
+  extra TEXT, -- whatever else was in the results, as JSON
+  shard INTEGER, offset INTEGER, nForward INTEGER, nReverse INTEGER, -- where the arrays are (offset counts values)
+  {fits}
+);
+CREATE INDEX IF NOT EXISTS sweepsBySample ON sweeps (sample, start);
+CREATE INDEX IF NOT EXISTS sweepsByStart ON sweeps (start);
+CREATE INDEX IF NOT EXISTS sweepsBySettings ON sweeps (nplc, nPoints, fourWire);
+'''.format(settings=', '.join(['{:} {:}'.format(k, t) for (k, t) in settingColumns.items()]),
+           fits=', '.join(['{:}_{:} REAL'.format(f, d) for d in directions for f in fitNames]))
+
+# where a store keeps shard number shard
+def shardPath(storePath, shard):
+  return os.path.join(storePath, 'shard-{:05d}.f8'.format(shard))
+
+# holds an exclusive lock on an open shard file, so processes sharing a store (the GUI and rs-tool, say)
+# take turns appending to it
+@contextlib.contextmanager
+def lockedShard(f):
+  if fcntl is not None:
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+  else: # the first byte stands for the whole file (it can be locked before it's written)
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    try:
+      yield
+    finally:
+      f.seek(0)
+      msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+# the column name for a fit result, e.g. rS_forward
+def fitColumn(name, direction):
+  return '{:}_{:}'.format(name, direction)
+
+class resultsStore:
+  def __init__(self, path=defaultPath):
+    self.path = os.path.expanduser(path)
+    os.makedirs(self.path, exist_ok=True)
+    self.lock = threading.Lock() # one sqlite connection, shared by whichever threads store results
+    self.db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), check_same_thread=False)
+    self.db.row_factory = sqlite3.Row
+    with self.db:
+      self.db.executescript(schema)
+      self.addColumns()
+    self.maps = {} # {shard number: numpy.memmap} for reading
+
+  # a store made before the geometryFactor column was gets it now, from what its rows kept in extra
+  def addColumns(self):
+    if 'geometryFactor' not in [r['name'] for r in self.db.execute('PRAGMA table_info(sweeps)')]:
+      self.db.execute('ALTER TABLE sweeps ADD COLUMN geometryFactor REAL')
+      self.db.execute("UPDATE sweeps SET geometryFactor = json_extract(extra, '$.geometryFactor')")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    with self.lock:
+      self.maps = {}
+      self.db.close()
+
+  def shardPath(self, shard):
+    return shardPath(self.path, shard)
+
+  # the shard new arrays go into
+  def currentShard(self):
+    last = self.db.execute('SELECT MAX(shard) FROM sweeps').fetchone()[0]
+    if last is None:
+      return 0
+    if os.path.exists(self.shardPath(last)) and (os.path.getsize(self.shardPath(last)) >= shardBytes):
+      return last + 1
+    return last
+
+  # appends values to the current shard, returns (shard, offset)
+  # the arrays go down before the index row that points at them, so a crash can only leave unreferenced bytes
+  # the shard is locked from finding its end until the values are written, in case another process is adding too
+  def writeArrays(self, values):
+    shard = self.currentShard()
+    with open(self.shardPath(shard), 'ab') as f, lockedShard(f):
+      offset = f.seek(0, os.SEEK_END)//dtype.itemsize # where it ends now, not when we opened it
+      f.write(numpy.ascontiguousarray(values, dtype=dtype).tobytes())
+      f.flush()
+      os.fsync(f.fileno())
+    self.maps.pop(shard, None) # it grew, map it again next time
+    return (shard, offset)
+
+  # stores a results dict: sample, address, idn, status, start, end, a config (rsOpt or sweepParams), geometryFactor and
+  # for each direction that was measured {'i': ..., 'v': ..., 'R': ..., 'RSigma': ..., 'rS': ..., 'rSSigma': ...}
+  # returns the new row's id
+  def add(self, results):
+    config = results.get('rsOpt', results.get('sweepParams', {}))
+    known = ('sample', 'address', 'idn', 'status', 'start', 'end', 'geometryFactor', 'rsOpt', 'sweepParams') + directions
+    extra = {k: v for (k, v) in results.items() if k not in known}
+    row = {k: results.get(k) for k in ('sample', 'address', 'idn', 'status', 'start', 'end', 'geometryFactor')}
+    if row['start'] is None:
+      row['start'] = time.time()
+    for k in settingColumns:
+      row[k] = config.get(k)
+    row['config'] = json.dumps(config, default=str)
+    row['extra'] = json.dumps(extra, default=str)
+    arrays = []
+    for d in directions:
+      r = results.get(d, {})
+      for f in fitNames:
+        row[fitColumn(f, d)] = r.get(f)
+      if 'i' in r:
+        arrays += [r['i'], r['v']]
+    row['nForward'] = len(results.get('forward', {}).get('i', []))
+    row['nReverse'] = len(results.get('reverse', {}).get('i', []))
+    with self.lock:
+      if len(arrays) > 0:
+        row['shard'], row['offset'] = self.writeArrays(numpy.concatenate([numpy.asarray(a, dtype=float) for a in arrays]))
+      else:
+        row['shard'], row['offset'] = (None, None)
+      columns = list(row)
+      with self.db:
+        cursor = self.db.execute('INSERT INTO sweeps ({:}) VALUES ({:})'.format(', '.join(columns), ', '.join(['?']*len(columns))), [row[c] for c in columns])
+      return cursor.lastrowid
+
+  # the rows (as dicts, without the arrays) that match, oldest first
+  # since/until are times (time.time() style), status=None finds failed measurements too,
+  # settings are config values to match, e.g. nplc=1 or iMax=1e-5 (the ones not in settingColumns are slower to search)
+  # columns picks the columns to return (all of them by default)
+  def find(self, sample=None, since=None, until=None, status='ok', limit=None, columns=None, **settings):
+    where = []
+    params = []
+    for (column, op, value) in (('sample', '=', sample), ('start', '>=', since), ('start', '<', until), ('status', '=', status)):
+      if value is not None:
+        where.append('{:} {:} ?'.format(column, op))
+        params.append(value)
+    for (k, v) in settings.items():
+      if k in settingColumns:
+        where.append('{:} = ?'.format(k))
+      else:
+        where.append("json_extract(config, '$.{:}') = ?".format(k))
+      params.append(v)
+    if columns is None:
+      sql = 'SELECT * FROM sweeps'
+    else:
+      sql = 'SELECT {:} FROM sweeps'.format(', '.join(columns))
+    if len(where) > 0:
+      sql = sql + ' WHERE ' + ' AND '.join(where)
+    sql = sql + ' ORDER BY start'
+    if limit is not None:
+      sql = sql + ' LIMIT {:d}'.format(limit)
+    with self.lock:
+      return [dict(r) for r in self.db.execute(sql, params)]
+
+  # the row with this id (or None)
+  def get(self, id):
+    with self.lock:
+      r = self.db.execute('SELECT * FROM sweeps WHERE id = ?', (id,)).fetchone()
+    return None if r is None else dict(r)
+
+  # the shard as a read only memory map
+  def shardMap(self, shard):
+    with self.lock:
+      if shard not in self.maps:
+        self.maps[shard] = numpy.memmap(self.shardPath(shard), dtype=dtype, mode='r')
+      return self.maps[shard]
+
+  # a row's I-V arrays (read only views onto the memory mapped shard, nothing is loaded until it's used)
+  # row is a row from find/get or its id
+  def arrays(self, row):
+    if not isinstance(row, dict):
+      row = self.get(row)
+    if row['shard'] is None:
+      return {}
+    values = self.shardMap(row['shard'])
+    offset = row['offset']
+    if offset + 2*(row['nForward'] + row['nReverse']) > len(values): # written after we mapped it (by someone else)
+      with self.lock:
+        self.maps.pop(row['shard'], None)
+      values = self.shardMap(row['shard'])
+    arrays = {}
+    for (d, n) in (('forward', row['nForward']), ('reverse', row['nReverse'])):
+      if n > 0:
+        arrays['i_' + d] = values[offset:offset + n]
+        arrays['v_' + d] = values[offset + n:offset + 2*n]
+        offset = offset + 2*n
+    return arrays
+
+  # a row turned back into a results dict like the one that was added
+  def results(self, row):
+    if not isinstance(row, dict):
+      row = self.get(row)
+    results = {k: row[k] for k in ('sample', 'address', 'idn', 'status', 'start', 'end')}
+    results['config'] = json.loads(row['config'])
+    results.update(json.loads(row['extra']))
+    if row['geometryFactor'] is not None:
+      results['geometryFactor'] = row['geometryFactor']
+    arrays = self.arrays(row)
+    for d in directions:
+      if 'i_' + d in arrays:
+        results[d] = {'i': arrays['i_' + d], 'v': arrays['v_' + d]}
+        results[d].update({f: row[fitColumn(f, d)] for f in fitNames})
+    results['id'] = row['id']
+    return results